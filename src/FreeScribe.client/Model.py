@@ -1,9 +1,74 @@
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaRAMCache
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+import numpy as np
 import os
 from typing import Optional, Dict, Any
 import threading
+import concurrent.futures
+from contextlib import contextmanager
 from UI.LoadingWindow import LoadingWindow
 import tkinter.messagebox as messagebox
+from utils.progress import UNIT_TOKENS
+from utils.token_stream import GenerationStats, record_generation
+from utils.gguf_registry import DEFAULT_MODEL, FALLBACK_CONTEXT_SIZE, GGUFError, get_registry, read_model_info
+from utils.llm_tuner import calibrate, find_tuning, store_tuning
+
+# Tokens proposed per step by speculative decoding. Every proposed token is verified by
+# the model in the same batch: a GPU checks 10 almost as fast as 1, on a CPU the cost
+# of the rejected ones outweighs the gain beyond a few.
+DRAFT_TOKENS_GPU = 10
+DRAFT_TOKENS_CPU = 2
+# Longest wait for the local model to load before a generation, tuning included
+MODEL_LOAD_TIMEOUT = 300
+
+class DraftModel(LlamaDraftModel):
+    """
+    Proposes the next tokens with a small GGUF model for speculative decoding.
+
+    The draft model continues the sequence greedily. The tokens it evaluated are kept
+    between steps, so each step only evaluates the tokens accepted since the last one.
+    It must share the vocabulary of the main model, e.g. a smaller model of the same family.
+
+    Attributes:
+        model: The Llama instance of the draft model.
+        num_pred_tokens: Number of tokens proposed per step.
+    """
+    def __init__(self, model_path: str, num_pred_tokens: int, context_size: int, gpu_layers: int = 0,
+                 n_threads: Optional[int] = None):
+        self.model = Llama(
+            model_path=model_path,
+            n_ctx=context_size,
+            n_gpu_layers=gpu_layers,
+            n_threads=n_threads or os.cpu_count(),
+            verbose=False,
+        )
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, **kwargs):
+        drafted = []
+        # generate() reuses the evaluated prefix shared with the previous step
+        for token in self.model.generate(input_ids.tolist(), top_k=1, top_p=1.0, temp=0.0, repeat_penalty=1.0):
+            if token == self.model.token_eos():
+                break
+            drafted.append(token)
+            if len(drafted) >= self.num_pred_tokens:
+                break
+        return np.array(drafted, dtype=np.intc)
+
+    def close(self):
+        self.model.close()
+
+class PromptCache(LlamaRAMCache):
+    """
+    RAM cache of evaluated prompt states counting all the memory each state holds.
+
+    Besides the KV state, llama_cpp saves the logits of the evaluated tokens with every
+    state (tokens × vocabulary size × 4 bytes, 1 MB per token with Gemma 2's 256k
+    vocabulary), which LlamaRAMCache leaves out of its capacity.
+    """
+    @property
+    def cache_size(self):
+        return sum(state.llama_state_size + state.scores.nbytes for state in self.cache_state.values())
 
 class Model:
     """
@@ -14,9 +79,25 @@ class Model:
     The class is configured to support multi-GPU setups and custom configurations for batch size,
     context window, and sampling settings. 
 
+    Prompts of every note share long, static instruction prefixes (the Pre-Processing and
+    AISCRIBE prompts). A new prompt reuses the evaluated prefix it shares with the
+    previous one. With a prompt cache the evaluated state of recent prompts is also kept
+    in RAM, so a new prompt that starts like any cached one only evaluates the part that
+    differs, usually the transcript.
+
+    The context size and chat format default to the ones suited to the model, read from
+    the header of the GGUF file.
+
+    Notes mostly copy spans of the transcript and of the list of facts. With speculative
+    decoding several tokens are proposed per step, by looking up the last tokens in the
+    prompt (prompt lookup decoding) or with a small draft model, and the model verifies
+    them in one batch; the generated text is the same, it is generated in fewer steps.
+
     Attributes:
         model: Instance of the Llama model configured with specified GPU and context parameters.
         config: Dictionary containing the GPU and model configuration.
+        first_token_times: Seconds to the first generated token of each generation stage,
+            the first (uncached) and the latest measurement keyed by the stage label.
 
     Methods:
         generate_response: Generates a text response based on an input prompt using
@@ -26,32 +107,68 @@ class Model:
     def __init__(
         self,
         model_path: str,
-        chat_template: str = None,
-        context_size: int = 4096,
+        chat_template: Optional[str] = None,
+        context_size: Optional[int] = None,
         gpu_layers: int = -1,  # -1 means load all layers to GPU
         main_gpu: int = 0,     # Primary GPU device index
         tensor_split: Optional[list] = None,  # For multi-GPU setup
         n_batch: int = 512,    # Batch size for inference
         n_threads: Optional[int] = None,  # CPU threads when needed
-        seed: int = 1337
+        n_threads_batch: Optional[int] = None,  # CPU threads evaluating prompts
+        seed: int = 1337,
+        prompt_cache_mb: int = 0,  # RAM for evaluated prompt prefixes, 0 to disable
+        speculative_decoding: bool = False,
+        draft_model_path: Optional[str] = None,  # Prompt lookup decoding when not set
+        num_draft_tokens: Optional[int] = None
     ):
         """
         Initializes the GGUF model with GPU acceleration.
         
         Args:
             model_path: Path to the model file
-            context_size: Size of the context window
+            chat_template: chat_format of llama_cpp, None for the model's embedded
+                template or the format of its architecture
+            context_size: Size of the context window, None for the model's trained
+                context capped at 8192 tokens
             gpu_layers: Number of layers to offload to GPU (-1 for all)
             main_gpu: Main GPU device index
             tensor_split: List of GPU memory splits for multi-GPU setup
             n_batch: Batch size for inference
-            n_threads: Number of CPU threads
+            n_threads: Number of CPU threads generating tokens
+            n_threads_batch: Number of CPU threads evaluating prompts, defaults to n_threads
             seed: Random seed for reproducibility
+            prompt_cache_mb: Megabytes of RAM for the states of evaluated prompts, their KV
+                state and logits, 0 to only reuse the prefix shared with the previous prompt
+            speculative_decoding: Propose several tokens per step and verify them in one batch
+            draft_model_path: Path of a small GGUF model sharing the vocabulary of the
+                model to propose the tokens, None to look them up in the prompt
+            num_draft_tokens: Tokens proposed per step, by default 10 with GPU layers and 2 on the CPU
         """
         try:
+            if chat_template is None or context_size is None:
+                try:
+                    info = read_model_info(model_path)
+                    chat_template = chat_template or info.default_chat_format
+                    context_size = context_size or info.default_context_size
+                    print(f"Loading {info.filename}: {info.architecture}, {info.quantization}, "
+                          f"context {context_size} of {info.context_length}, chat format {chat_template or 'embedded'}")
+                except (GGUFError, OSError) as e:
+                    # Let llama_cpp report the invalid model
+                    print(f"Could not read the metadata of {model_path}: {e}")
+                    context_size = context_size or FALLBACK_CONTEXT_SIZE
+
             # Set environment variables for GPU
             os.environ["CUDA_VISIBLE_DEVICES"] = str(main_gpu)
             
+            self.draft_model = None
+            if speculative_decoding:
+                num_draft_tokens = num_draft_tokens or (DRAFT_TOKENS_CPU if gpu_layers == 0 else DRAFT_TOKENS_GPU)
+                if draft_model_path:
+                    self.draft_model = DraftModel(draft_model_path, num_draft_tokens, context_size,
+                                                  gpu_layers=gpu_layers, n_threads=n_threads)
+                else:
+                    self.draft_model = LlamaPromptLookupDecoding(num_pred_tokens=num_draft_tokens)
+
             # Initialize model with GPU settings
             self.model = Llama(
                 model_path=model_path,
@@ -59,20 +176,50 @@ class Model:
                 n_gpu_layers=gpu_layers,
                 n_batch=n_batch,
                 n_threads=n_threads or os.cpu_count(),
+                n_threads_batch=n_threads_batch or n_threads or os.cpu_count(),
                 seed=seed,
                 tensor_split=tensor_split,
                 chat_format=chat_template,
+                draft_model=self.draft_model,
+                # Verifying proposed tokens needs the logits of every evaluated token
+                logits_all=self.draft_model is not None,
             )
-        
+
+            if self.draft_model is not None:
+                if isinstance(self.draft_model, DraftModel) and self.draft_model.model.n_vocab() != self.model.n_vocab():
+                    raise ValueError(f"The draft model {os.path.basename(draft_model_path)} does not share the "
+                                     f"vocabulary of {os.path.basename(model_path)}")
+                print(f"Speculative decoding with {num_draft_tokens} proposed tokens per step, keeping the logits "
+                      f"of the context takes {context_size * self.model.n_vocab() * 4 / 2**20:.0f} MB")
+
+            if prompt_cache_mb > 0:
+                # Completions look up the cached state sharing the longest prefix with
+                # their prompt and save their own state when they finish
+                self.model.set_cache(PromptCache(capacity_bytes=int(prompt_cache_mb * 1024 * 1024)))
+                print(f"Prompt cache of {prompt_cache_mb} MB, the logits saved with each prompt take "
+                      f"{self.model.n_vocab() * 4 * 1000 / 2**20:.0f} MB per 1000 tokens")
+
             # Store configuration
             self.config = {
                 "gpu_layers": gpu_layers,
                 "main_gpu": main_gpu,
                 "context_size": context_size,
-                "n_batch": n_batch
+                "n_batch": n_batch,
+                "n_threads": n_threads or os.cpu_count(),
+                "n_threads_batch": n_threads_batch or n_threads or os.cpu_count(),
+                "prompt_cache_mb": prompt_cache_mb,
+                "speculative_decoding": speculative_decoding,
+                "draft_model_path": draft_model_path,
+                "num_draft_tokens": num_draft_tokens
             }
+            self.first_token_times = {}
         except Exception as e:
+            if getattr(self, "model", None) is not None:
+                self.model.close()
+            if isinstance(getattr(self, "draft_model", None), DraftModel):
+                self.draft_model.close()
             self.model = None
+            self.draft_model = None
             raise e
         
     def generate_response(
@@ -81,7 +228,10 @@ class Model:
         max_tokens: int = 50,
         temperature: float = 0.1,
         top_p: float = 0.95,
-        repeat_penalty: float = 1.1
+        repeat_penalty: float = 1.1,
+        progress_channel=None,
+        progress_label: str = "Generating",
+        on_token=None
     ) -> str:
         """
         Generates a response using GPU-accelerated inference.
@@ -92,6 +242,9 @@ class Model:
             temperature: Sampling temperature (higher = more random)
             top_p: Top-p sampling threshold
             repeat_penalty: Penalty for repeating tokens
+            progress_channel: Optional ProgressChannel the generated token count is published into
+            progress_label: Label of the generation stage shown with the progress
+            on_token: Optional callable called with the text of each token as it is generated
             
         Returns:
             Generated text response
@@ -105,23 +258,63 @@ class Model:
                 "content": prompt}
             ]
 
-            response = self.model.create_chat_completion(
-                messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                repeat_penalty=repeat_penalty,
-            )
+            if progress_channel is not None:
+                # max_tokens is an upper bound, the generation usually stops earlier
+                progress_channel.start(progress_label, total=max_tokens, unit=UNIT_TOKENS, upper_bound=True)
+
+            stats = GenerationStats(progress_label)
 
-            # reset the model tokens
-            self.model.reset()
-            return response["choices"][0]["message"]["content"]
+            try:
+                # Stream the completion so progress can be reported per token
+                response_chunks = self.model.create_chat_completion(
+                    messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    repeat_penalty=repeat_penalty,
+                    stream=True,
+                )
+
+                response_text = []
+                for chunk in response_chunks:
+                    content = chunk["choices"][0]["delta"].get("content")
+                    if content:
+                        stats.token()
+                        response_text.append(content)
+                        if on_token is not None:
+                            on_token(content)
+                        if progress_channel is not None:
+                            progress_channel.update(advance=1)
+            finally:
+                # Also when the completion fails, so the progress does not stay up
+                if progress_channel is not None:
+                    progress_channel.finish()
+
+            stats.finish()
+            self._report_generation(stats)
+
+            # The evaluated tokens are kept, the next prompt only evaluates what differs
+            return "".join(response_text)
             
         except Exception as e:
             print(f"GPU inference error ({e.__class__.__name__}): {str(e)}")
             return f"({e.__class__.__name__}): {str(e)}"
 
-    
+    def _report_generation(self, stats: GenerationStats):
+        """
+        Records the timing of a generation and compares its time to the first token with
+        the stage's first measurement, which evaluated the whole prompt.
+        """
+        record_generation(stats, "local")
+        seconds = stats.time_to_first_token
+        if seconds is None:
+            return
+        times = self.first_token_times.setdefault(stats.label, {"first": seconds, "latest": seconds})
+        times["latest"] = seconds
+        if seconds < times["first"]:
+            print(f"{stats.label}: first run took {times['first']:.2f}s to the first token, "
+                  f"{times['first'] / max(seconds, 1e-3):.1f}x faster with the prompt cache")
+
     def get_gpu_info(self) -> Dict[str, Any]:
         """
         Returns information about the current GPU configuration.
@@ -133,18 +326,37 @@ class Model:
             "context_size": self.config["context_size"]
         }
 
+    def count_tokens(self, text: str) -> int:
+        """
+        Counts the tokens of a text with the model's tokenizer.
+
+        Args:
+            text: The text to measure
+
+        Returns:
+            Number of tokens, without the beginning of sequence token
+        """
+        return len(self.model.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
     def close(self):
         """
         Unloads the model from GPU memory.
         """
         self.model.close()
         self.model = None
+        self._close_draft_model()
     
     def __del__(self):
         """Cleanup GPU memory on deletion"""
-        if self.model is not None:
+        if getattr(self, "model", None) is not None:
             self.model.close()
         self.model = None
+        self._close_draft_model()
+
+    def _close_draft_model(self):
+        if isinstance(getattr(self, "draft_model", None), DraftModel):
+            self.draft_model.close()
+        self.draft_model = None
 
 class ModelManager:
     """
@@ -154,65 +366,182 @@ class ModelManager:
     using the llama.cpp Python bindings. It supports different model architectures and
     quantization levels.
 
+    Models are loaded in the background. While a new model loads the current one keeps
+    serving generations, then the two are swapped atomically; the replaced model is
+    closed once the generations using it are done. Every load is represented by a
+    Future resolving to the loaded Model, so callers wait on it instead of polling.
+    A model that has not been used for the "Local LLM Idle Unload (minutes)" setting is
+    unloaded to give its RAM back to the speech to text engine, and is loaded again
+    by the next generation.
+
     Attributes:
-        local_model (Llama): Static reference to the loaded model instance. None if no model is loaded.
+        local_model (Model): Static reference to the loaded model instance. None if no model is loaded.
+
+    Example:
+        >>> ModelManager.setup_model(app_settings, root)  # returns at once
+        >>> with ModelManager.use(app_settings, root) as model:
+        ...     note = model.generate_response(prompt)
     """
     local_model = None
 
+    # Guards the attributes below and the swap of local_model
+    _lock = threading.RLock()
+    # Load settings of the loaded model, a load with the same settings is not repeated
+    _loaded_key = None
+    # Future of the load in progress and its load settings
+    _pending = None
+    _pending_key = None
+    # Generations in progress by id of the Model, and the replaced models still in use
+    _in_use = {}
+    _retired = {}
+    _idle_timer = None
+
+    @staticmethod
+    def _load_settings(app_settings):
+        """
+        Reads the settings a model is loaded with.
+
+        Returns:
+            Dict with the model path, GPU layers, draft model path and the options of Model
+        """
+        gpu_layers = 0
+
+        if app_settings.editable_settings["Architecture"] == "CUDA (Nvidia GPU)":
+            gpu_layers = -1
+
+        # The selected model if it is in the models folder, else the default one
+        model = get_registry().resolve(app_settings.editable_settings["Model"])
+        model_path = model.path if model is not None else f"./models/{DEFAULT_MODEL}"
+        draft_model = app_settings.editable_settings["Local LLM Draft Model"].strip()
+        return {
+            "model_path": model_path,
+            "gpu_layers": gpu_layers,
+            "prompt_cache_mb": int(app_settings.editable_settings["Local LLM Prompt Cache (MB)"]),
+            "speculative_decoding": bool(app_settings.editable_settings["Local LLM Speculative Decoding"]),
+            "draft_model_path": os.path.join(os.path.dirname(model_path), draft_model) if draft_model else None,
+            "auto_tune": bool(app_settings.editable_settings["Auto-tune Local LLM"]),
+        }
+
     @staticmethod
     def setup_model(app_settings, root):
         """
-        Initialize and load the LLM model based on application settings.
+        Initialize and load the LLM model based on application settings in the background.
 
-        Creates a loading window and starts model loading in a separate thread to prevent
-        UI freezing. Automatically checks thread status and closes the loading window
-        when complete.
+        The model currently loaded keeps serving generations until the new one is ready.
+        When no model is loaded a loading window is shown until the load completes.
+        Nothing is loaded again if the model is already loaded or loading with the same settings.
 
         Args:
             app_settings: Application settings object containing model preferences
             root: Tkinter root window for creating the loading dialog
 
-        Raises:
-            ValueError: If the specified model file cannot be loaded
-        
+        Returns:
+            Future resolving to the loaded Model, or to the exception raised when it
+            could not be loaded
+
         Note:
             The method uses threading to avoid blocking the UI while loading the model.
+            The loading window is only shown when called from the main (Tk) thread.
             GPU layers are set to -1 for CUDA architecture and 0 for CPU.
+            The first time a model is loaded on a computer its threads and batch size
+            are calibrated, which takes up to a minute, and stored in the settings.
         """
-        loading_window = LoadingWindow(root, "Loading Model", "Loading Model. Please wait")
+        load = ModelManager._load_settings(app_settings)
+        key = tuple(sorted(load.items()))
+        model_path = load["model_path"]
+        gpu_layers = load["gpu_layers"]
 
-        # unload before loading new model
-        if ModelManager.local_model is not None:
-            ModelManager.unload_model()
+        with ModelManager._lock:
+            if ModelManager._pending is not None and ModelManager._pending_key == key:
+                return ModelManager._pending
+            if ModelManager._pending is None and ModelManager.local_model is not None and ModelManager._loaded_key == key:
+                return ModelManager._completed(ModelManager.local_model)
+            future = concurrent.futures.Future()
+            # A load in progress with other settings is superseded by this one
+            ModelManager._pending = future
+            ModelManager._pending_key = key
+            serving = ModelManager.local_model is not None
+
+        # Threads and batch size measured for this computer and model, once
+        tuning = find_tuning(app_settings.editable_settings, model_path, gpu_layers)
+        needs_tuning = load["auto_tune"] and tuning is None and os.path.exists(model_path)
+
+        loading_window = None
+        if serving:
+            print(f"Loading {os.path.basename(model_path)} in the background, the current model serves until it is ready")
+        elif threading.current_thread() is not threading.main_thread():
+            # Tk may only be used from the main thread, e.g. a note waiting for the model
+            # after it was unloaded shows its own window
+            print(f"Loading {os.path.basename(model_path)}{', tuning it for this computer first' if needs_tuning else ''}")
+        elif needs_tuning:
+            loading_window = LoadingWindow(root, "Loading Model", "Tuning for this computer, once")
+        else:
+            loading_window = LoadingWindow(root, "Loading Model", "Loading Model. Please wait")
 
         def load_model():
             """
             Internal function to handle the actual model loading process.
             
-            Determines the model file based on settings and initializes the Llama instance
-            with appropriate parameters.
+            Measures the best threads and batch size for the model if it was not tuned on
+            this computer yet, then initializes the Llama instance with them and swaps
+            it in if no other load was requested meanwhile.
             """
-            gpu_layers = 0
-
-            if app_settings.editable_settings["Architecture"] == "CUDA (Nvidia GPU)":
-                gpu_layers = -1
+            nonlocal tuning
+            if needs_tuning:
+                try:
+                    tuning = calibrate(model_path, gpu_layers=gpu_layers)
+                    store_tuning(app_settings.editable_settings, model_path, gpu_layers, tuning)
+                    app_settings.save_settings_to_file()
+                except Exception as e:
+                    # Load with the defaults, tuning is tried again next time
+                    print(f"Failed to tune the model ({e.__class__.__name__}): {e}")
 
-            model_to_use = "gemma-2-2b-it-Q8_0.gguf"
-                
-            model_path = f"./models/{model_to_use}"
+            use_tuning = tuning is not None and load["auto_tune"]
             try:
-                ModelManager.local_model = Model(model_path,
-                    context_size=4096,
+                model = Model(model_path,
                     gpu_layers=gpu_layers,
                     main_gpu=0,
-                    n_batch=512,
-                    n_threads=None,
-                    seed=1337)
+                    n_batch=tuning["n_batch"] if use_tuning else 512,
+                    n_threads=tuning["n_threads"] if use_tuning else None,
+                    n_threads_batch=tuning["n_threads_batch"] if use_tuning else None,
+                    seed=1337,
+                    prompt_cache_mb=load["prompt_cache_mb"],
+                    speculative_decoding=load["speculative_decoding"],
+                    draft_model_path=load["draft_model_path"])
             except Exception as e:
                 # model doesnt exist
                 #TODO: Logo to system log
+                with ModelManager._lock:
+                    if ModelManager._pending is future:
+                        ModelManager._pending = None
+                        ModelManager._pending_key = None
+                # Before the dialog, which blocks until it is dismissed, so a waiting generation fails at once
+                future.set_exception(e)
                 messagebox.showerror("Model Error", f"Model failed to load. Please ensure you have a valid model selected in the settings. Currently trying to load: {os.path.abspath(model_path)}. Error received ({e.__class__.__name__}): {str(e)}")
-                ModelManager.local_model = None
+                return
+
+            with ModelManager._lock:
+                superseded = ModelManager._pending is not future
+                if not superseded:
+                    previous = ModelManager.local_model
+                    ModelManager.local_model = model
+                    ModelManager._loaded_key = key
+                    ModelManager._pending = None
+                    ModelManager._pending_key = None
+                    if previous is not None:
+                        ModelManager._retire(previous)
+                    ModelManager._schedule_idle_unload(app_settings)
+                newer = ModelManager._pending
+
+            if superseded:
+                # Another model was requested while this one loaded, or the model was unloaded
+                model.close()
+                if newer is not None:
+                    newer.add_done_callback(lambda done: ModelManager._copy_result(done, future))
+                else:
+                    future.set_exception(RuntimeError("The model was unloaded while it was loading"))
+            else:
+                future.set_result(model)
 
         thread = threading.Thread(target=load_model)
         thread.start()
@@ -231,40 +560,168 @@ class ModelManager:
             else:
                 loading_window.destroy()
 
-        root.after(500, lambda: check_thread_status(thread, loading_window, root))
+        if loading_window is not None:
+            root.after(500, lambda: check_thread_status(thread, loading_window, root))
+        return future
+
+    @staticmethod
+    def ready():
+        """
+        Returns the readiness of the model serving the next generations.
+
+        Returns:
+            Future of the load in progress, a completed Future of the loaded model when
+            nothing is loading, or None when no model is loaded or loading
+        """
+        with ModelManager._lock:
+            if ModelManager._pending is not None:
+                return ModelManager._pending
+            if ModelManager.local_model is not None:
+                return ModelManager._completed(ModelManager.local_model)
+            return None
+
+    @staticmethod
+    def get_model(app_settings, root, timeout: Optional[float] = MODEL_LOAD_TIMEOUT) -> "Model":
+        """
+        Returns the model to generate with, waiting for it to load if none is loaded.
+
+        While another model loads in the background the loaded one is returned at once.
+
+        Args:
+            app_settings: Application settings object, used to load the model if needed
+            root: Tkinter root window for the loading dialog
+            timeout: Seconds to wait for the model to load, None to wait until it is loaded
+
+        Raises:
+            concurrent.futures.TimeoutError: If the model did not load in time
+            Exception: The error raised by loading the model
+        """
+        with ModelManager._lock:
+            if ModelManager.local_model is not None:
+                return ModelManager.local_model
+            future = ModelManager._pending
+        if future is None:
+            future = ModelManager.setup_model(app_settings, root)
+        return future.result(timeout=timeout)
 
+    @staticmethod
+    @contextmanager
+    def use(app_settings, root, timeout: Optional[float] = MODEL_LOAD_TIMEOUT):
+        """
+        Context manager holding the model for a generation.
+
+        The model is not closed while it is in use, even if it is replaced by another
+        model or unloaded, and the idle time is counted from the end of the last use.
+
+        Args:
+            app_settings: Application settings object, used to load the model if needed
+            root: Tkinter root window for the loading dialog
+            timeout: Seconds to wait for the model to load
+        """
+        while True:
+            model = ModelManager.get_model(app_settings, root, timeout)
+            with ModelManager._lock:
+                # The model may have been unloaded between loading and now
+                if model is ModelManager.local_model or id(model) in ModelManager._retired:
+                    ModelManager._in_use[id(model)] = ModelManager._in_use.get(id(model), 0) + 1
+                    ModelManager._cancel_idle_unload()
+                    break
+        try:
+            yield model
+        finally:
+            with ModelManager._lock:
+                ModelManager._in_use[id(model)] -= 1
+                if not ModelManager._in_use[id(model)]:
+                    del ModelManager._in_use[id(model)]
+                    if ModelManager._retired.pop(id(model), None) is not None:
+                        model.close()
+                if not ModelManager._in_use:
+                    ModelManager._schedule_idle_unload(app_settings)
 
     @staticmethod
     def start_model_threaded(settings, root_window):
         """
-        Start the model in a separate thread.
+        Start loading the model in the background.
 
         :param settings: Configuration settings for the model
         :type settings: dict
         :param root_window: The main application window reference
         :type root_window: tkinter.Tk
-        :return: The created thread instance
-        :rtype: threading.Thread
+        :return: Future resolving to the loaded model
+        :rtype: concurrent.futures.Future
         
-        This method creates and starts a new thread that runs the model's start 
-        function with the provided settings and root window reference. The model
-        is accessed through ModelManager's local_model attribute.
+        setup_model returns at once and loads the model on its own thread, it is called
+        on the calling thread so the loading window is created by the main thread. The
+        model is accessed through ModelManager's local_model attribute.
         """
-        thread = threading.Thread(target=ModelManager.setup_model, args=(settings, root_window))
-        thread.start()
-        return thread
+        return ModelManager.setup_model(settings, root_window)
 
     @staticmethod
     def unload_model():
         """
         Safely unload and cleanup the currently loaded model.
 
-        Closes the model if it exists and sets the local_model reference to None.
-        This method should be called before loading a new model or shutting down
-        the application.
+        Closes the model if it exists and sets the local_model reference to None. A model
+        still generating is closed when its generation is done, and a load in progress
+        is abandoned. This method should be called when the local model is turned off or
+        the application shuts down.
         """
-        if ModelManager.local_model is not None:
-            ModelManager.local_model.model.close()
-            del ModelManager.local_model
-            ModelManager.local_model = None
-            
\ No newline at end of file
+        with ModelManager._lock:
+            ModelManager._cancel_idle_unload()
+            # The load in progress closes its model when it sees it was superseded
+            ModelManager._pending = None
+            ModelManager._pending_key = None
+            if ModelManager.local_model is not None:
+                ModelManager._retire(ModelManager.local_model)
+                ModelManager.local_model = None
+                ModelManager._loaded_key = None
+
+    @staticmethod
+    def _retire(model):
+        # Called with the lock held, closes the model now or after its last generation
+        if id(model) in ModelManager._in_use:
+            ModelManager._retired[id(model)] = model
+        else:
+            # Also closes the draft model of speculative decoding
+            model.close()
+
+    @staticmethod
+    def _schedule_idle_unload(app_settings):
+        # Called with the lock held
+        ModelManager._cancel_idle_unload()
+        try:
+            minutes = float(app_settings.editable_settings["Local LLM Idle Unload (minutes)"] or 0)
+        except ValueError:
+            minutes = 0
+        if minutes <= 0 or ModelManager.local_model is None:
+            return
+        ModelManager._idle_timer = threading.Timer(minutes * 60, ModelManager._unload_idle, args=(minutes,))
+        ModelManager._idle_timer.daemon = True
+        ModelManager._idle_timer.start()
+
+    @staticmethod
+    def _cancel_idle_unload():
+        if ModelManager._idle_timer is not None:
+            ModelManager._idle_timer.cancel()
+            ModelManager._idle_timer = None
+
+    @staticmethod
+    def _unload_idle(minutes):
+        with ModelManager._lock:
+            if ModelManager._in_use or ModelManager._pending is not None or ModelManager.local_model is None:
+                return
+            print(f"Unloading the local LLM after {minutes:g} minutes without use")
+            ModelManager.unload_model()
+
+    @staticmethod
+    def _completed(model):
+        future = concurrent.futures.Future()
+        future.set_result(model)
+        return future
+
+    @staticmethod
+    def _copy_result(source, target):
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
@@ -1,6 +1,10 @@
 import tkinter as tk
 from tkinter import ttk
 from utils.file_utils import get_file_path
+from utils.progress import UNIT_SECONDS, format_duration
+
+# How often the progress channel is polled in milliseconds
+PROGRESS_POLL_INTERVAL = 250
 
 class LoadingWindow:
     """
@@ -17,6 +21,8 @@ class LoadingWindow:
     :type initial_text: str
     :param on_cancel: Callback function to execute when cancel is pressed
     :type on_cancel: callable or None
+    :param progress_channel: Optional channel to render percent complete, rate and ETA from
+    :type progress_channel: utils.progress.ProgressChannel or None
     
     :ivar popup: The main popup window
     :type popup: tk.Toplevel
@@ -37,7 +43,7 @@ class LoadingWindow:
     >>> processing.destroy()
     """
 
-    def __init__(self, parent=None, title="Processing", initial_text="Loading", on_cancel=None):
+    def __init__(self, parent=None, title="Processing", initial_text="Loading", on_cancel=None, progress_channel=None):
         """
         Initialize the processing popup window.
         
@@ -49,17 +55,23 @@ class LoadingWindow:
         :type initial_text: str
         :param on_cancel: Callback function to execute when cancel is pressed
         :type on_cancel: callable or None
+        :param progress_channel: Optional channel to render percent complete, rate and ETA from
+        :type progress_channel: utils.progress.ProgressChannel or None
         """
         try:
             self.title = title
             self.initial_text = initial_text
             self.parent = parent
             self.on_cancel = on_cancel
+            self.progress_channel = progress_channel
             self.cancelled = False
             
             self.popup = tk.Toplevel(parent)
             self.popup.title(title)
-            self.popup.geometry("200x105")  # Increased height for cancel button
+            if progress_channel is None:
+                self.popup.geometry("200x105")  # Increased height for cancel button
+            else:
+                self.popup.geometry("240x130")  # Extra line for the progress details
             self.popup.iconbitmap(get_file_path('assets','logo.ico'))
 
             if parent:
@@ -80,6 +92,11 @@ class LoadingWindow:
             self.progress.pack(padx=20, pady=(0,10), fill='x')
             self.progress.start()
 
+            if progress_channel is not None:
+                self.detail_label = tk.Label(self.popup, text="")
+                self.detail_label.pack(pady=(0,5))
+                self.popup.after(PROGRESS_POLL_INTERVAL, self._poll_progress)
+
             # Add cancel button
             self.cancel_button = ttk.Button(self.popup, text="Cancel", command=self._handle_cancel)
             self.cancel_button.pack(pady=(4,0))
@@ -95,6 +112,46 @@ class LoadingWindow:
                 parent.wm_attributes('-disabled', False)
             raise
 
+    def _poll_progress(self):
+        """
+        Internal method to render the latest snapshot of the progress channel.
+
+        Switches the progress bar to determinate mode once the total amount of work
+        is known and shows the measured rate and ETA underneath it.
+        """
+        if not self.popup or not self.popup.winfo_exists():
+            return
+
+        snapshot = self.progress_channel.snapshot()
+
+        if snapshot["percent"] is not None:
+            if str(self.progress.cget('mode')) != 'determinate':
+                self.progress.stop()
+                self.progress.configure(mode='determinate', maximum=100)
+            self.progress['value'] = snapshot["percent"]
+        elif str(self.progress.cget('mode')) != 'indeterminate':
+            self.progress.configure(mode='indeterminate')
+            self.progress.start()
+
+        if snapshot["unit"] == UNIT_SECONDS:
+            rate = f"{snapshot['rate']:.1f}x real-time"
+        else:
+            rate = f"{snapshot['rate']:.1f} tok/s"
+
+        details = [snapshot["label"]] if snapshot["label"] else []
+        if snapshot["upper_bound"] and snapshot["total"]:
+            # The stage usually ends before the total, so show the count rather than a percentage
+            details.append(f"{int(snapshot['done'])} of at most {int(snapshot['total'])} {snapshot['unit']}")
+        elif snapshot["percent"] is not None:
+            details.append(f"{snapshot['percent']:.0f}%")
+        if snapshot["done"] > 0:
+            details.append(rate)
+        if snapshot["eta"] is not None:
+            details.append(f"ETA {'at most ' if snapshot['upper_bound'] else ''}{format_duration(snapshot['eta'])}")
+        self.detail_label.config(text=" · ".join(details))
+
+        self.popup.after(PROGRESS_POLL_INTERVAL, self._poll_progress)
+
     def _handle_cancel(self):
         """
         Internal method to handle cancel button press.
@@ -171,6 +171,23 @@ class MainWindowUI:
             self.root.after_cancel(self.current_container_status_check_id)
             self.current_container_status_check_id = None
 
+    def show_server_busy(self, delay: float):
+        """
+        Show in the window title that the speech to text server is busy.
+
+        Safe to call from worker threads.
+
+        :param delay: Seconds until the request is retried.
+        :type delay: float
+        """
+        self.root.after(0, self.root.title, f"AI Medical Scribe - Speech to text server busy, retrying in {delay:.0f}s")
+
+    def clear_server_busy(self):
+        """
+        Restore the window title after the server accepted a request again.
+        """
+        self.root.after(0, self.root.title, "AI Medical Scribe")
+
     def toggle_menu_bar(self, enable: bool):
         """
         Enable or disable the menu bar.
@@ -24,6 +24,7 @@ from tkinter import ttk, messagebox
 import requests
 import numpy as np
 from utils.file_utils import get_resource_path, get_file_path
+from utils.gguf_registry import DEFAULT_MODEL, get_registry
 from Model import ModelManager
 import threading
 from UI.Widgets.MicrophoneSelector import MicrophoneState
@@ -118,6 +119,7 @@ class SettingsWindow():
             "Use best_of",
             "best_of",
             "max_context_length",
+            "AI Server Context Size",
             "max_length",
             "rep_pen",
             "rep_pen_range",
@@ -132,10 +134,21 @@ class SettingsWindow():
             "singleline",
             "frmttriminc",
             "frmtrmblln",
+            "Local LLM Prompt Cache (MB)",
+            "Stream Generated Notes",
+            "Local LLM Speculative Decoding",
+            "Local LLM Draft Model",
+            "Auto-tune Local LLM",
+            "Local LLM Idle Unload (minutes)",
         ]
 
         self.adv_whisper_settings = [
             "Real Time Audio Length",
+            "Use Transcript Cache",
+            "Transcript Cache Size (MB)",
+            "S2T Server Unix Socket",
+            "S2T Server Job Threshold (MB)",
+            "S2T Progressive Upload",
         ]
 
 
@@ -153,6 +166,7 @@ class SettingsWindow():
             "use_authors_note": False,
             "use_world_info": False,
             "max_context_length": 5000,
+            "AI Server Context Size": 0,
             "max_length": 400,
             "rep_pen": 1.1,
             "rep_pen_range": 5000,
@@ -178,6 +192,8 @@ class SettingsWindow():
             "Real Time Audio Length": 5,
             "Real Time Silence Length": 1,
             "Silence cut-off": 0.035,
+            "Use Transcript Cache": False,
+            "Transcript Cache Size (MB)": 256,
             "LLM Container Name": "ollama",
             "LLM Caddy Container Name": "caddy-ollama",
             "LLM Authentication Container Name": "authentication-ollama",
@@ -192,6 +208,17 @@ class SettingsWindow():
             "Use Post-Processing": False, # Disabled for now causes unexcepted behaviour
             "AI Server Self-Signed Certificates": False,
             "S2T Server Self-Signed Certificates": False,
+            "S2T Server Unix Socket": "",
+            "S2T Server Job Threshold (MB)": 10,
+            "S2T Progressive Upload": True,
+            "Local LLM Prompt Cache (MB)": 0,
+            "Stream Generated Notes": True,
+            "Local LLM Speculative Decoding": False,
+            "Local LLM Draft Model": "",
+            "Auto-tune Local LLM": True,
+            "Local LLM Idle Unload (minutes)": 30,
+            # Threads and batch sizes measured by utils.llm_tuner, by computer and model
+            "Local LLM Tuning": {},
             "Pre-Processing": "Please break down the conversation into a list of facts. Take the conversation and transform it to a easy to read list:\n\n",
             "Post-Processing": "\n\nUsing the provided list of facts, review the SOAP note for accuracy. Verify that all details align with the information provided in the list of facts and ensure consistency throughout. Update or adjust the SOAP note as necessary to reflect the listed facts without offering opinions or subjective commentary. Ensure that the revised note excludes a \"Notes\" section and does not include a header for the SOAP note. Provide the revised note after making any necessary corrections.",
             "Show Scrub PHI": False,
@@ -443,11 +470,19 @@ class SettingsWindow():
         Updates the models dropdown with the available models.
 
         This method fetches the available models from the AI Scribe service and updates
-        the dropdown widget in the settings window with the new list of models.
+        the dropdown widget in the settings window with the new list of models. With the
+        local LLM it lists the GGUF models of the models folder instead.
         """
         if self.editable_settings_entries["Use Local LLM"].get():
-            dropdown["values"] = ["gemma-2-2b-it-Q8_0.gguf"]
-            dropdown.set("gemma-2-2b-it-Q8_0.gguf")
+            # The GGUF models in the models folder, their headers are cached so this is instant
+            models = get_registry().filenames() or [DEFAULT_MODEL]
+            dropdown["values"] = models
+            if self.editable_settings["Model"] in models:
+                dropdown.set(self.editable_settings["Model"])
+            elif DEFAULT_MODEL in models:
+                dropdown.set(DEFAULT_MODEL)
+            else:
+                dropdown.set(models[0])
         else:
             dropdown["values"] = ["Loading models...", "Custom"]
             dropdown.set("Loading models...")
@@ -510,23 +545,21 @@ class SettingsWindow():
         self.main_window = window
 
     def load_or_unload_model(self, old_model, new_model, old_use_local_llm, new_use_local_llm, old_architecture, new_architecture):
-        # Check if old model and new model are different if they are reload and make sure new model is checked.
-        if old_model != new_model and new_use_local_llm == 1:
-            ModelManager.unload_model()
-            ModelManager.start_model_threaded(self, self.main_window.root)
+        """
+        Load, swap or unload the local model after the settings were saved.
 
-        # Load the model if check box is now selected
-        if old_use_local_llm == 0 and new_use_local_llm == 1:
+        A new model or architecture is loaded in the background while the current model
+        keeps serving, and replaces it once loaded. Must be called after the new values
+        are stored in editable_settings, which the model is loaded from.
+        """
+        # Load the model if check box is now selected, or reload it if the model or architecture changed.
+        if new_use_local_llm == 1 and (old_use_local_llm == 0 or old_model != new_model or old_architecture != new_architecture):
             ModelManager.start_model_threaded(self, self.main_window.root)
 
         # Check if Local LLM was on and if turned off unload model.abs
         if old_use_local_llm == 1 and new_use_local_llm == 0:
             ModelManager.unload_model()
 
-        if old_architecture != new_architecture and new_use_local_llm == 1:
-            ModelManager.unload_model()
-            ModelManager.start_model_threaded(self, self.main_window.root)
-
     def _create_settings_and_aiscribe_if_not_exist(self):
         if not os.path.exists(get_resource_path('settings.txt')):
             print("Settings file not found. Creating default settings file.")
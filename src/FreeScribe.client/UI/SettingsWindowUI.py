@@ -26,6 +26,7 @@ from UI.Widgets.AudioMeter import AudioMeter
 import threading
 from Model import Model, ModelManager
 from utils.file_utils import get_file_path
+from utils.transcript_cache import TranscriptCache
 from UI.MarkdownWindow import MarkdownWindow
 from UI.Widgets.MicrophoneSelector import MicrophoneSelector
 from UI.SettingsWindow import SettingsKeys, FeatureToggle
@@ -451,13 +452,13 @@ class SettingsWindowUI:
         right_frame = ttk.Frame(self.advanced_settings_frame)
         right_frame.grid(row=row, column=1, padx=10, pady=5, sticky="nw")
         
-        self.create_editable_settings_col(left_frame, right_frame, 0, 0, self.settings.adv_whisper_settings)
+        left_row, _ = self.create_editable_settings_col(left_frame, right_frame, 0, 0, self.settings.adv_whisper_settings)
         
         # Audio meter
-        tk.Label(left_frame, text="Whisper Audio Cutoff").grid(row=1, column=0, padx=0, pady=0, sticky="w")
+        tk.Label(left_frame, text="Whisper Audio Cutoff").grid(row=left_row, column=0, padx=0, pady=0, sticky="w")
         self.cutoff_slider = AudioMeter(left_frame, width=150, height=50, 
                                     threshold=self.settings.editable_settings["Silence cut-off"] * 32768)
-        self.cutoff_slider.grid(row=1, column=1, padx=0, pady=0, sticky="w")
+        self.cutoff_slider.grid(row=left_row, column=1, padx=0, pady=0, sticky="w")
         row += 1
 
         # AI Settings
@@ -535,12 +536,10 @@ class SettingsWindowUI:
         This method retrieves the values from the UI elements and calls the
         `save_settings` method of the `settings` object to save the settings.
         """
-        self.settings.load_or_unload_model(self.settings.editable_settings["Model"],
-            self.get_selected_model(),
-            self.settings.editable_settings["Use Local LLM"],
-            self.settings.editable_settings_entries["Use Local LLM"].get(),
-            self.settings.editable_settings["Architecture"],
-            self.architecture_dropdown.get())
+        # save the old LLM settings, the model is loaded or unloaded once the new ones are saved
+        old_llm_model = self.settings.editable_settings["Model"]
+        old_use_local_llm = self.settings.editable_settings["Use Local LLM"]
+        old_architecture = self.settings.editable_settings["Architecture"]
 
         if self.get_selected_model() not in ["Loading models...", "Failed to load models"]:
             self.settings.editable_settings["Model"] = self.get_selected_model()
@@ -555,6 +554,7 @@ class SettingsWindowUI:
         # save the old whisper model to compare with the new model later
         old_local_whisper = self.settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value]
         old_model = self.settings.editable_settings["Whisper Model"]
+        old_use_transcript_cache = self.settings.editable_settings["Use Transcript Cache"]
 
         self.settings.save_settings(
             self.openai_api_key_entry.get(),
@@ -565,6 +565,20 @@ class SettingsWindowUI:
             self.cutoff_slider.threshold / 32768,
         )
 
+        self.settings.load_or_unload_model(old_llm_model,
+            self.settings.editable_settings["Model"],
+            old_use_local_llm,
+            self.settings.editable_settings["Use Local LLM"],
+            old_architecture,
+            self.settings.editable_settings["Architecture"])
+
+        # the cached transcripts are plain text, do not keep them once the cache is turned off
+        if old_use_transcript_cache and not self.settings.editable_settings["Use Transcript Cache"]:
+            try:
+                TranscriptCache().clear()
+            except OSError as e:
+                print(f"Failed to clear the transcript cache: {e}")
+
         if self.settings.editable_settings["Use Docker Status Bar"] and self.main_window.docker_status_bar is None:
             self.main_window.create_docker_status_bar()
         elif not self.settings.editable_settings["Use Docker Status Bar"] and self.main_window.docker_status_bar is not None:
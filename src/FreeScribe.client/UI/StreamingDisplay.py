@@ -0,0 +1,96 @@
+import threading
+
+# Longest time between two repaints of streamed text in milliseconds, 10 per second
+STREAM_REFRESH_INTERVAL = 100
+
+class StreamingDisplay:
+    """
+    Streams generated text into a read-only text box while it is being generated.
+
+    Tokens arrive on the generation thread and are buffered, a callback on the Tk event
+    loop inserts whatever arrived since the last repaint. The text box is repainted at a
+    bounded rate however fast the model generates, instead of once per token.
+
+    :param root: The Tk root window, used to schedule the repaints
+    :type root: tk.Tk
+    :param text_box: The CustomTextBox the text is streamed into
+    :type text_box: UI.Widgets.CustomTextBox.CustomTextBox
+    :param refresh_interval: Milliseconds between repaints
+    :type refresh_interval: int
+
+    Example
+    -------
+    >>> stream = StreamingDisplay(root, response_display)
+    >>> stream.begin()
+    >>> stream.append("Subjective: ")  # from the generation thread
+    >>> stream.stop()  # before the final text is displayed
+    """
+
+    def __init__(self, root, text_box, refresh_interval=STREAM_REFRESH_INTERVAL):
+        self.root = root
+        self.text_box = text_box
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._pending = []
+        # Incremented by every begin, repaints of an earlier stream stop themselves
+        self._stream_id = 0
+        self._active = False
+
+    def begin(self):
+        """
+        Clear the text box and start a new stream.
+        """
+        with self._lock:
+            self._stream_id += 1
+            self._pending = []
+            self._active = True
+            stream_id = self._stream_id
+        self.root.after(0, self._start, stream_id)
+
+    def append(self, text):
+        """
+        Queue generated text for the next repaint. Safe to call from any thread.
+
+        :param text: The generated text.
+        :type text: str
+        """
+        with self._lock:
+            if self._active:
+                self._pending.append(text)
+
+    def stop(self):
+        """
+        End the stream and drop the text not painted yet, e.g. before the final text is displayed.
+        """
+        with self._lock:
+            self._active = False
+            self._pending = []
+
+    def _start(self, stream_id):
+        if not self._is_current(stream_id):
+            return
+        scrolled_text = self.text_box.scrolled_text
+        scrolled_text.configure(state='normal')
+        scrolled_text.delete("1.0", "end")
+        scrolled_text.configure(fg='black')
+        scrolled_text.configure(state='disabled')
+        self._repaint(stream_id)
+
+    def _repaint(self, stream_id):
+        with self._lock:
+            if not self._active or stream_id != self._stream_id:
+                return
+            text = "".join(self._pending)
+            self._pending = []
+
+        if text:
+            scrolled_text = self.text_box.scrolled_text
+            scrolled_text.configure(state='normal')
+            scrolled_text.insert("end", text)
+            scrolled_text.see("end")
+            scrolled_text.configure(state='disabled')
+        self.root.after(self.refresh_interval, self._repaint, stream_id)
+
+    def _is_current(self, stream_id):
+        with self._lock:
+            return self._active and stream_id == self._stream_id
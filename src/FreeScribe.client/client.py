@@ -18,6 +18,7 @@ import requests
 import pyperclip
 import wave
 import threading
+import concurrent.futures
 import numpy as np
 import base64
 import json
@@ -35,10 +36,20 @@ from UI.MainWindowUI import MainWindowUI
 from UI.SettingsWindow import SettingsWindow, SettingsKeys
 from UI.Widgets.CustomTextBox import CustomTextBox
 from UI.LoadingWindow import LoadingWindow
+from UI.StreamingDisplay import StreamingDisplay
 from UI.Widgets.MicrophoneSelector import MicrophoneState
-from Model import  ModelManager
+from Model import  ModelManager, MODEL_LOAD_TIMEOUT
 from utils.ip_utils import is_private_ip
 from utils.file_utils import get_file_path, get_resource_path
+from utils.transcript_cache import TranscriptCache
+from utils.request_utils import post_with_backoff
+from utils.uds_transport import UnixSocketTranscriber, read_pcm_wav, unix_sockets_supported
+from utils.transcription_jobs import JobApiUnavailableError, transcribe_with_job
+from utils.progressive_upload import ProgressiveUpload, ProgressiveUploadError
+from utils.progress import ProgressChannel, UNIT_TOKENS, track_whisper_progress
+from utils.token_stream import GenerationStats, iter_chat_deltas, record_generation
+from utils.note_planner import DEFAULT_MAX_PARALLEL, TokenBudget, estimate_tokens, extract_facts, within_tokens
+from utils.gguf_registry import FALLBACK_CONTEXT_SIZE, get_registry
 import ctypes
 import sys
 from UI.DebugWindow import DualOutput
@@ -103,6 +114,70 @@ GENERATION_THREAD_ID = None
 # Global instance of whisper model
 stt_local_model = None
 
+# Cache of transcripts keyed by audio content and transcription settings
+transcript_cache = TranscriptCache()
+
+# Progress of the current transcription or note generation, rendered by the loading windows
+progress_channel = ProgressChannel()
+
+# Connections to the Speech2Text server's Unix domain socket, created when one is configured
+unix_transcriber = None
+
+# Upload of the current recording to the Speech2Text server, None if it is not streamed
+progressive_upload = None
+
+
+def get_unix_transcriber():
+    """
+    Returns the transcriber of the configured S2T Server Unix Socket, or None to use HTTP.
+    """
+    global unix_transcriber
+    path = app_settings.editable_settings["S2T Server Unix Socket"].strip()
+    if not path or not unix_sockets_supported():
+        return None
+    if unix_transcriber is None or unix_transcriber.path != path:
+        unix_transcriber = UnixSocketTranscriber(path)
+    return unix_transcriber
+
+
+def start_progressive_upload():
+    """
+    Starts streaming the new recording to the remote Speech2Text server if enabled.
+
+    Only whole recordings sent over HTTP are streamed: real time segments are sent as they
+    are recorded, and a server on the same host gets the recording over its Unix socket.
+    """
+    global progressive_upload
+    discard_progressive_upload()
+    if (app_settings.editable_settings["Real Time"]
+            or app_settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value]
+            or not app_settings.editable_settings["S2T Progressive Upload"]
+            or get_unix_transcriber() is not None):
+        return
+    progressive_upload = ProgressiveUpload(
+        app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value],
+        headers={"Authorization": f"Bearer {app_settings.editable_settings[SettingsKeys.WHISPER_SERVER_API_KEY.value]}",
+                 "X-Priority": "bulk"},
+        verify=not app_settings.editable_settings["S2T Server Self-Signed Certificates"])
+
+
+def discard_progressive_upload():
+    """
+    Abandons the upload of the recording, if any, e.g. when its processing was canceled.
+    """
+    global progressive_upload
+    upload, progressive_upload = progressive_upload, None
+    if upload is not None:
+        threading.Thread(target=upload.abort, daemon=True).start()
+
+
+def use_transcription_job(file_path):
+    """
+    Whether a recording is large enough to be transcribed through the server's job API.
+    """
+    threshold_mb = float(app_settings.editable_settings["S2T Server Job Threshold (MB)"])
+    return threshold_mb > 0 and os.path.getsize(file_path) > threshold_mb * 1024 * 1024
+
 
 def get_prompt(formatted_message):
 
@@ -194,6 +269,8 @@ def record_audio():
         if not is_paused:
             data = stream.read(CHUNK, exception_on_overflow=False)
             frames.append(data)
+            if progressive_upload is not None:
+                progressive_upload.feed(data)
             # Check for silence
             audio_buffer = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
             if is_silent(audio_buffer, app_settings.editable_settings["Silence cut-off"]):
@@ -258,6 +335,22 @@ def realtime_text():
                         result = stt_local_model.transcribe(audio_buffer, fp16=False)
                         if not local_cancel_flag and not is_audio_processing_realtime_canceled.is_set():
                             update_gui(result['text'])
+                    elif get_unix_transcriber() is not None:
+                        # Same host server, send the raw samples without a WAV file or HTTP
+                        print("Remote Real Time Whisper over Unix socket")
+                        pcm = b''.join(frames)
+                        frames = []
+                        try:
+                            text = get_unix_transcriber().transcribe(pcm, options={"priority": "realtime"},
+                                                                     on_busy=window.show_server_busy,
+                                                                     on_retry=window.clear_server_busy,
+                                                                     should_cancel=is_audio_processing_realtime_canceled.is_set)
+                            if not local_cancel_flag and not is_audio_processing_realtime_canceled.is_set():
+                                update_gui(text)
+                        except Exception as e:
+                            update_gui(f"Error: {e}")
+                        finally:
+                            window.clear_server_busy()
                     else:
                         print("Remote Real Time Whisper")
                         if frames:
@@ -271,13 +364,18 @@ def realtime_text():
                         with open(file_to_send, 'rb') as f:
                             files = {'audio': f}
 
+                            # Live segments are served before uploaded recordings
                             headers = {
-                                "Authorization": "Bearer "+app_settings.editable_settings[SettingsKeys.WHISPER_SERVER_API_KEY.value]
+                                "Authorization": "Bearer "+app_settings.editable_settings[SettingsKeys.WHISPER_SERVER_API_KEY.value],
+                                "X-Priority": "realtime",
                             }
 
                             try:
                                 verify = not app_settings.editable_settings["S2T Server Self-Signed Certificates"]
-                                response = requests.post(app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value], headers=headers,files=files, verify=verify)
+                                response = post_with_backoff(app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value], headers=headers, files=files, verify=verify,
+                                                             on_busy=window.show_server_busy,
+                                                             on_retry=window.clear_server_busy,
+                                                             should_cancel=is_audio_processing_realtime_canceled.is_set)
                                 if response.status_code == 200:
                                     text = response.json()['text']
                                     if not local_cancel_flag and not is_audio_processing_realtime_canceled.is_set():
@@ -287,6 +385,7 @@ def realtime_text():
                             except Exception as e:
                                 update_gui(f"Error: {e}")
                             finally:
+                                window.clear_server_busy()
                                 #Task done clean up file
                                 if os.path.exists(file_to_send):
                                     f.close()
@@ -313,6 +412,10 @@ def save_audio():
             send_and_receive()
         elif app_settings.editable_settings["Real Time"] == False and is_audio_processing_whole_canceled.is_set() is False:
             threaded_send_audio_to_server()
+            return
+
+    # The recording is not transcribed, the server does not need its upload
+    discard_progressive_upload()
 
 def toggle_recording():
     global is_recording, recording_thread, DEFAULT_BUTTON_COLOUR, audio_queue, current_view, REALTIME_TRANSCRIBE_THREAD_ID
@@ -339,6 +442,7 @@ def toggle_recording():
         response_display.scrolled_text.configure(fg='black')
         response_display.scrolled_text.configure(state='disabled')
         is_recording = True
+        start_progressive_upload()
 
         recording_thread = threading.Thread(target=record_audio)
         recording_thread.start()
@@ -502,6 +606,50 @@ def toggle_aiscribe():
     use_aiscribe = not use_aiscribe
     toggle_button.config(text="AI Scribe\nON" if use_aiscribe else "AI Scribe\nOFF")
 
+def get_cached_transcript(file_path, engine, model):
+    """
+    Look up a previous transcript of an audio file in the transcript cache.
+
+    :param file_path: Path to the audio file being transcribed.
+    :type file_path: str
+    :param engine: Name of the speech-to-text engine.
+    :type engine: str
+    :param model: Model or endpoint used by the engine.
+    :type model: str
+    :return: A tuple of the cache key and the cached transcript (None on a miss or when the cache is disabled).
+    :rtype: tuple
+    """
+    if not app_settings.editable_settings["Use Transcript Cache"]:
+        return None, None
+
+    try:
+        cache_key = TranscriptCache.make_key(file_path, engine, model)
+        transcribed_text = transcript_cache.get(cache_key)
+        print(f"Transcript cache {'hit' if transcribed_text is not None else 'miss'}: {transcript_cache.stats()}")
+        return cache_key, transcribed_text
+    except OSError as e:
+        # The cache is an optimization, never fail the transcription because of it
+        print(f"Transcript cache unavailable: {e}")
+        return None, None
+
+def store_cached_transcript(cache_key, transcribed_text):
+    """
+    Store a transcript in the transcript cache.
+
+    :param cache_key: Key returned by :func:`get_cached_transcript`, None if caching is disabled.
+    :type cache_key: str or None
+    :param transcribed_text: The transcript to store.
+    :type transcribed_text: str
+    """
+    if cache_key is None:
+        return
+
+    try:
+        transcript_cache.max_size_bytes = int(float(app_settings.editable_settings["Transcript Cache Size (MB)"]) * 1024 * 1024)
+        transcript_cache.put(cache_key, transcribed_text)
+    except (OSError, ValueError) as e:
+        print(f"Failed to store transcript in cache: {e}")
+
 def send_audio_to_server():
     """
     Sends an audio file to either a local or remote Whisper server for transcription.
@@ -530,7 +678,7 @@ def send_audio_to_server():
         If there is an issue with the HTTP request to the remote server.
     """
 
-    global uploaded_file_path
+    global uploaded_file_path, progressive_upload
     current_thread_id = threading.current_thread().ident
 
     def cancel_whole_audio_process(thread_id):
@@ -547,7 +695,7 @@ def send_audio_to_server():
         finally:
             GENERATION_THREAD_ID = None
 
-    loading_window = LoadingWindow(root, "Processing Audio", "Processing Audio. Please wait.", on_cancel=lambda: (cancel_processing(), cancel_whole_audio_process(current_thread_id)))
+    loading_window = LoadingWindow(root, "Processing Audio", "Processing Audio. Please wait.", on_cancel=lambda: (cancel_processing(), cancel_whole_audio_process(current_thread_id)), progress_channel=progress_channel)
 
     # Check if SettingsKeys.LOCAL_WHISPER is enabled in the editable settings
     if app_settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value] == True:
@@ -565,9 +713,14 @@ def send_audio_to_server():
             delete_file = False if uploaded_file_path else True
             uploaded_file_path = None
 
-            # Transcribe the audio file using the loaded model
-            result = stt_local_model.transcribe(file_to_send)
-            transcribed_text = result["text"]
+            cache_key, transcribed_text = get_cached_transcript(file_to_send, "local-whisper", app_settings.editable_settings["Whisper Model"].strip())
+
+            if transcribed_text is None:
+                # Transcribe the audio file using the loaded model
+                with track_whisper_progress(progress_channel):
+                    result = stt_local_model.transcribe(file_to_send)
+                transcribed_text = result["text"]
+                store_cached_transcript(cache_key, transcribed_text)
 
             # done with file clean up
             if os.path.exists(file_to_send) and delete_file is True:
@@ -612,30 +765,91 @@ def send_audio_to_server():
         if uploaded_file_path:
             file_to_send = uploaded_file_path
             uploaded_file_path = None
+            upload = None
         else:
             file_to_send = get_resource_path('recording.wav')
+            # Most of the recording has already been streamed to the server
+            upload, progressive_upload = progressive_upload, None
+
+        cache_key, transcribed_text = get_cached_transcript(file_to_send, "remote-whisper", app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value])
 
         # Open the audio file in binary mode
         with open(file_to_send, 'rb') as f:
             files = {'audio': f}
 
             # Add the Bearer token to the headers for authentication
+            # Whole recordings yield to other clinicians' live segments on the server
             headers = {
-                "Authorization": f"Bearer {app_settings.editable_settings[SettingsKeys.WHISPER_SERVER_API_KEY.value]}"
+                "Authorization": f"Bearer {app_settings.editable_settings[SettingsKeys.WHISPER_SERVER_API_KEY.value]}",
+                "X-Priority": "bulk",
             }
 
             try:
-                verify = not app_settings.editable_settings["S2T Server Self-Signed Certificates"]
-
-                # Send the request without verifying the SSL certificate
-                response = requests.post(app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value], headers=headers, files=files, verify=verify)
-
-                response.raise_for_status()
+                if transcribed_text is None:
+                    verify = not app_settings.editable_settings["S2T Server Self-Signed Certificates"]
+
+                    # The remote server does not report progress, only the elapsed time is shown
+                    progress_channel.start("Transcribing remotely")
+
+                    def on_server_busy(delay):
+                        progress_channel.start(f"Server busy, retrying in {delay:.0f}s")
+
+                    job_started = []
+
+                    def on_job_progress(done, total):
+                        if not job_started:
+                            progress_channel.start("Transcribing remotely", total=total)
+                            job_started.append(True)
+                        progress_channel.update(done=done)
+
+                    if upload is not None:
+                        # Only the tail of the recording is left to upload and decode
+                        try:
+                            transcribed_text = upload.finish(on_progress=on_job_progress,
+                                                             should_cancel=is_audio_processing_whole_canceled.is_set)
+                        except (JobApiUnavailableError, ProgressiveUploadError) as e:
+                            print(f"{e}, uploading the recording instead")
+                        upload = None
+
+                    # A same host server gets the raw samples over its Unix socket, WAV files
+                    # that need converting are uploaded over HTTP
+                    transcriber = get_unix_transcriber()
+                    pcm = read_pcm_wav(file_to_send) if transcriber is not None and transcribed_text is None else None
+
+                    # Send the request, waiting and retrying while the server is busy
+                    if pcm is not None:
+                        transcribed_text = transcriber.transcribe(pcm, options={"priority": "bulk"},
+                                                                  on_busy=on_server_busy,
+                                                                  on_retry=lambda: progress_channel.start("Transcribing remotely"),
+                                                                  should_cancel=is_audio_processing_whole_canceled.is_set)
+                    elif transcribed_text is None and use_transcription_job(file_to_send):
+                        # Long recordings are submitted as a job and polled, so a proxy
+                        # timeout or a network drop does not lose the transcription
+                        try:
+                            transcribed_text = transcribe_with_job(app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value], files, headers=headers, verify=verify,
+                                                                   on_busy=on_server_busy,
+                                                                   on_retry=lambda: progress_channel.start("Transcribing remotely"),
+                                                                   on_progress=on_job_progress,
+                                                                   should_cancel=is_audio_processing_whole_canceled.is_set)
+                        except JobApiUnavailableError as e:
+                            print(f"{e}, uploading to the Whisper endpoint instead")
+                            f.seek(0)
+
+                    if transcribed_text is None:
+                        response = post_with_backoff(app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value], headers=headers, files=files, verify=verify,
+                                                     on_busy=on_server_busy,
+                                                     on_retry=lambda: progress_channel.start("Transcribing remotely"),
+                                                     should_cancel=is_audio_processing_whole_canceled.is_set)
+
+                        response.raise_for_status()
+
+                        transcribed_text = response.json()['text']
+                    progress_channel.finish()
+                    store_cached_transcript(cache_key, transcribed_text)
 
                 # check if canceled, if so do not update the UI
                 if not is_audio_processing_whole_canceled.is_set():
                     # Update the UI with the transcribed text
-                    transcribed_text = response.json()['text']
                     user_input.scrolled_text.configure(state='normal')
                     user_input.scrolled_text.delete("1.0", tk.END)
                     user_input.scrolled_text.insert(tk.END, transcribed_text)
@@ -652,6 +866,9 @@ def send_audio_to_server():
                 user_input.scrolled_text.insert(tk.END, f"An error occurred: {e}")
                 user_input.scrolled_text.configure(state='disabled')
             finally:
+                if upload is not None:
+                    # Answered from the transcript cache
+                    upload.abort()
                 # done with file clean up
                 f.close()
                 if os.path.exists(file_to_send) and delete_file:
@@ -697,6 +914,8 @@ def send_and_receive():
         
 
 def display_text(text):
+    # The full text replaces whatever was being streamed
+    note_stream.stop()
     response_display.scrolled_text.configure(state='normal')
     response_display.scrolled_text.delete("1.0", tk.END)
     response_display.scrolled_text.insert(tk.END, f"{text}\n")
@@ -746,7 +965,18 @@ def show_response(event):
         response_display.scrolled_text.configure(state='disabled')
         pyperclip.copy(response_text)
 
-def send_text_to_api(edited_text):
+def start_note_stream():
+    """
+    Clears the note display to stream the text of the next generation stage into it.
+
+    :return: Callable receiving the generated text, None if streaming is disabled.
+    """
+    if not app_settings.editable_settings["Stream Generated Notes"]:
+        return None
+    note_stream.begin()
+    return note_stream.append
+
+def send_text_to_api(edited_text, progress_label="Generating", on_token=None):
     headers = {
         "Authorization": f"Bearer {app_settings.OPENAI_API_KEY}",
         "Content-Type": "application/json",
@@ -788,6 +1018,10 @@ def send_text_to_api(edited_text):
 
         print(f"Error parsing settings: {e}. Using default settings.")
 
+    if on_token is not None:
+        # Tokens are sent as server-sent events as they are generated
+        payload["stream"] = True
+
     try:
 
         if app_settings.editable_settings["Model Endpoint"].endswith('/'):
@@ -795,11 +1029,33 @@ def send_text_to_api(edited_text):
 
         # Open API Style
         verify = not app_settings.editable_settings["AI Server Self-Signed Certificates"]
-        response = requests.post(app_settings.editable_settings["Model Endpoint"]+"/chat/completions", headers=headers, json=payload, verify=verify)
+        progress_channel.start(progress_label, unit=UNIT_TOKENS)
+        stats = GenerationStats(progress_label)
+        response = requests.post(app_settings.editable_settings["Model Endpoint"]+"/chat/completions", headers=headers, json=payload, verify=verify, stream=payload.get("stream", False))
 
         response.raise_for_status()
-        response_data = response.json()
-        response_text = (response_data['choices'][0]['message']['content'])
+        if response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            response_chunks = []
+            for content in iter_chat_deltas(response):
+                # Each delta of a chat completion stream carries one token
+                stats.token()
+                response_chunks.append(content)
+                if on_token is not None:
+                    on_token(content)
+                progress_channel.update(advance=1)
+            response_text = "".join(response_chunks)
+        else:
+            # Servers that do not stream answer with the whole completion
+            response_data = response.json()
+            response_text = (response_data['choices'][0]['message']['content'])
+
+            # Without streaming the token count is only known once the completion is done
+            if response_data.get('usage'):
+                stats.token(response_data['usage'].get('completion_tokens', 0))
+                progress_channel.update(done=stats.tokens)
+        stats.finish()
+        record_generation(stats, "api")
+        progress_channel.finish()
         return response_text
 
         #############################################################
@@ -823,65 +1079,142 @@ def send_text_to_api(edited_text):
         #         return response_text
 
     except Exception as e:
+        # Ends the stage so the progress does not stay up, finish() is a no-op once finished
+        progress_channel.finish()
         raise e
 
-def send_text_to_localmodel(edited_text):  
-    # Send prompt to local model and get response
-    if ModelManager.local_model is None:
-        ModelManager.setup_model(app_settings=app_settings, root=root)
+def load_local_model():
+    """
+    Returns the local model, loading it first if needed.
 
-        timer = 0
-        while ModelManager.local_model is None and timer < 30:
-            timer += 0.1
-            time.sleep(0.1)
-        
+    Waits on the Future of the load instead of polling. While another model loads in
+    the background the model being replaced is returned.
 
-    return ModelManager.local_model.generate_response(
-        edited_text,
-        max_tokens=int(app_settings.editable_settings["max_length"]),
-        temperature=float(app_settings.editable_settings["temperature"]),
-        top_p=float(app_settings.editable_settings["top_p"]),
-        repeat_penalty=float(app_settings.editable_settings["rep_pen"]),
-    )
+    :return: The loaded Model, None if it failed to load or did not load in time.
+    """
+    try:
+        return ModelManager.get_model(app_settings, root)
+    except concurrent.futures.TimeoutError:
+        print(f"The local model did not load within {MODEL_LOAD_TIMEOUT} seconds")
+    except Exception as e:
+        # The error was shown when loading
+        print(f"The local model failed to load ({e.__class__.__name__}): {e}")
+    return None
+
+def send_text_to_localmodel(edited_text, progress_label="Generating", on_token=None):
+    # Send prompt to local model and get response. The model is held so a model swap
+    # or idle unload does not close it during the generation.
+    with ModelManager.use(app_settings, root) as model:
+        return model.generate_response(
+            edited_text,
+            max_tokens=int(app_settings.editable_settings["max_length"]),
+            temperature=float(app_settings.editable_settings["temperature"]),
+            top_p=float(app_settings.editable_settings["top_p"]),
+            repeat_penalty=float(app_settings.editable_settings["rep_pen"]),
+            progress_channel=progress_channel,
+            progress_label=progress_label,
+            on_token=on_token,
+        )
+
+def count_local_model_tokens(text):
+    """
+    Counts the tokens of a text with the tokenizer of the local model.
 
+    The model is held while counting, as it may be swapped between calls.
+    """
+    with ModelManager.use(app_settings, root) as model:
+        return model.count_tokens(text)
     
 
 
-def send_text_to_chatgpt(edited_text):  
+def send_text_to_chatgpt(edited_text, progress_label="Generating", on_token=None):
     if app_settings.editable_settings["Use Local LLM"]:
-        return send_text_to_localmodel(edited_text)
+        return send_text_to_localmodel(edited_text, progress_label, on_token)
     else:
-        return send_text_to_api(edited_text)
+        return send_text_to_api(edited_text, progress_label, on_token)
+
+def note_token_budget():
+    """
+    The room for the prompts of a note in the context window of the LLM.
+
+    The local model's prompts are measured with its tokenizer within the context size of
+    the selected model, which is read from its file without loading it. The size of a
+    remote model's prompts is estimated from their length within the AI Server Context
+    Size setting.
+
+    :return: The budget, None for a remote model whose context size is not set, whose
+        prompts are sent whole.
+    :rtype: TokenBudget or None
+    """
+    max_tokens = int(app_settings.editable_settings["max_length"])
+    if app_settings.editable_settings["Use Local LLM"]:
+        model = ModelManager.local_model
+        if model is not None:
+            context_size = model.config["context_size"]
+        else:
+            info = get_registry().resolve(app_settings.editable_settings["Model"])
+            context_size = info.default_context_size if info is not None else FALLBACK_CONTEXT_SIZE
+        # The model is only loaded, or waited for, if a prompt has to be counted
+        return TokenBudget(count_local_model_tokens, context_size, max_tokens)
+    try:
+        context_size = int(app_settings.editable_settings["AI Server Context Size"] or 0)
+    except ValueError:
+        context_size = 0
+    if context_size <= 0:
+        return None
+    return TokenBudget(estimate_tokens, context_size, max_tokens)
 
 def generate_note(formatted_message):
             try:
                 # If note generation is on
                 if use_aiscribe:
-                    # If pre-processing is enabled
-                    if app_settings.editable_settings["Use Pre-Processing"]:
-                        #Generate Facts List
-                        list_of_facts = send_text_to_chatgpt(f"{app_settings.editable_settings['Pre-Processing']} {formatted_message}")
+                    budget = note_token_budget()
+                    note_room = budget.room_for(app_settings.AISCRIBE, app_settings.AISCRIBE2) if budget is not None else None
+                    # The local model generates one prompt at a time, a server can take several
+                    max_parallel = 1 if app_settings.editable_settings["Use Local LLM"] else DEFAULT_MAX_PARALLEL
+                    note_thread = threading.current_thread()
+
+                    def generate_stage(prompt, label):
+                        # Windows generated in parallel would interleave their text in the display
+                        on_token = start_note_stream() if threading.current_thread() is note_thread else None
+                        return send_text_to_chatgpt(prompt, label, on_token)
+
+                    # If pre-processing is enabled, or the transcript is too long to write the note from it directly
+                    too_long = budget is not None and not within_tokens(formatted_message, budget.count_tokens, note_room)
+                    if app_settings.editable_settings["Use Pre-Processing"] or too_long:
+                        if budget is not None:
+                            #Generate Facts List, from overlapping windows of a long transcript
+                            list_of_facts = extract_facts(formatted_message, generate_stage, budget,
+                                                          app_settings.editable_settings['Pre-Processing'],
+                                                          target_tokens=note_room, max_parallel=max_parallel)
+                        else:
+                            #Generate Facts List
+                            list_of_facts = generate_stage(f"{app_settings.editable_settings['Pre-Processing']} {formatted_message}", "Extracting facts")
                         
                         #Make a note from the facts
-                        medical_note = send_text_to_chatgpt(f"{app_settings.AISCRIBE} {list_of_facts} {app_settings.AISCRIBE2}")
+                        medical_note = send_text_to_chatgpt(f"{app_settings.AISCRIBE} {list_of_facts} {app_settings.AISCRIBE2}", "Writing note", start_note_stream())
 
                         # If post-processing is enabled check the note over
                         if app_settings.editable_settings["Use Post-Processing"]:
-                            post_processed_note = send_text_to_chatgpt(f"{app_settings.editable_settings['Post-Processing']}\nFacts:{list_of_facts}\nNotes:{medical_note}")
+                            review_prompt = f"{app_settings.editable_settings['Post-Processing']}\nFacts:{list_of_facts}\nNotes:{medical_note}"
+                            if budget is not None and not budget.fits(review_prompt):
+                                # Review the note alone rather than truncate it
+                                review_prompt = f"{app_settings.editable_settings['Post-Processing']}\nNotes:{medical_note}"
+                            post_processed_note = send_text_to_chatgpt(review_prompt, "Reviewing note", start_note_stream())
                             update_gui_with_response(post_processed_note)
                         else:
                             update_gui_with_response(medical_note)
 
                     else: # If pre-processing is not enabled thhen just generate the note
-                        medical_note = send_text_to_chatgpt(f"{app_settings.AISCRIBE} {formatted_message} {app_settings.AISCRIBE2}")
+                        medical_note = send_text_to_chatgpt(f"{app_settings.AISCRIBE} {formatted_message} {app_settings.AISCRIBE2}", "Writing note", start_note_stream())
 
                         if app_settings.editable_settings["Use Post-Processing"]:
-                            post_processed_note = send_text_to_chatgpt(f"{app_settings.editable_settings['Post-Processing']}\nNotes:{medical_note}")
+                            post_processed_note = send_text_to_chatgpt(f"{app_settings.editable_settings['Post-Processing']}\nNotes:{medical_note}", "Reviewing note", start_note_stream())
                             update_gui_with_response(post_processed_note)
                         else:
                             update_gui_with_response(medical_note)
                 else: # do not generate note just send text directly to AI 
-                    ai_response = send_text_to_chatgpt(formatted_message)
+                    ai_response = send_text_to_chatgpt(formatted_message, on_token=start_note_stream())
                     update_gui_with_response(ai_response)
 
                 return True
@@ -946,6 +1279,8 @@ def generate_note_thread(text: str):
         """
         global GENERATION_THREAD_ID
 
+        # Keep the text streamed so far, stop repainting
+        note_stream.stop()
         try:
             kill_thread(thread_id)
         except Exception as e:
@@ -955,7 +1290,7 @@ def generate_note_thread(text: str):
         finally:
             GENERATION_THREAD_ID = None
 
-    loading_window = LoadingWindow(root, "Generating Note.", "Generating Note. Please wait.", on_cancel=lambda: cancel_note_generation(GENERATION_THREAD_ID))
+    loading_window = LoadingWindow(root, "Generating Note.", "Generating Note. Please wait.", on_cancel=lambda: cancel_note_generation(GENERATION_THREAD_ID), progress_channel=progress_channel)
     
 
     def check_thread_status(thread, loading_window):
@@ -1261,6 +1596,9 @@ circle = blinking_circle_canvas.create_oval(5, 5, 15, 15, fill='white')
 response_display = CustomTextBox(root, height=13, state="disabled")
 response_display.grid(row=2, column=1, columnspan=8, padx=5, pady=15, sticky='nsew')
 
+# Generated text is streamed into the response display as it arrives
+note_stream = StreamingDisplay(root, response_display)
+
 # Insert placeholder text
 response_display.scrolled_text.configure(state='normal')
 response_display.scrolled_text.insert("1.0", "Medical Note")
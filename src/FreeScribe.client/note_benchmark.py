@@ -0,0 +1,283 @@
+"""
+Benchmark of note generation from long synthetic transcripts.
+
+Generates doctor-patient conversations of a given length in which facts (medications
+and doses, vital signs, symptoms) are seeded between small talk, then writes a note
+from each transcript twice:
+
+- single: one fact extraction prompt, the transcript cut to what fits in the context
+  window, as happened before transcripts were split.
+- map-reduce: facts extracted from overlapping windows of the whole transcript and
+  merged, see utils/note_planner.py.
+
+For each run the table shows the transcript size, the number of windows and LLM calls,
+the time taken and the recall: the share of seeded facts found in the extracted facts
+and in the final note, which is limited by --max-tokens.
+
+The notes are written by a local GGUF model (--model), an OpenAI compatible server
+(--endpoint) or, without either, a fake model that copies the lines holding numbers at
+a fixed rate, which measures the planning and the number of calls without an LLM.
+
+Example:
+    python note_benchmark.py --minutes 10,30,60
+    python note_benchmark.py --model ./models/gemma-2-2b-it-Q8_0.gguf --minutes 5,20 --context-size 4096
+    python note_benchmark.py --endpoint http://localhost:1337/v1 --api-model gemma-2-2b-it --minutes 30
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+import urllib.request
+
+from utils.note_planner import DEFAULT_MAX_PARALLEL, TokenBudget, estimate_tokens, extract_facts, split_into_windows
+
+# Default prompts of the settings
+PRE_PROCESSING = ("Please break down the conversation into a list of facts. Take the conversation and transform "
+                  "it to a easy to read list:\n\n")
+AISCRIBE = ("AI, please transform the following conversation into a concise SOAP note. Do not assume any medical "
+            "data, vital signs, or lab values. Base the note strictly on the information provided in the "
+            "conversation. Here's the conversation:")
+AISCRIBE2 = ("Remember, the Subjective section should reflect the patient's perspective and complaints as mentioned "
+             "in the conversation. Do not add any information that did not occur and do not make assumptions.")
+
+WORDS_PER_MINUTE = 150
+MEDICATIONS = ["metformin", "lisinopril", "atorvastatin", "amlodipine", "levothyroxine", "omeprazole",
+               "sertraline", "gabapentin", "hydrochlorothiazide", "losartan", "montelukast", "tamsulosin"]
+SYMPTOMS = ["headaches", "chest tightness", "night sweats", "ankle swelling", "heartburn", "dizziness",
+            "shortness of breath", "joint pain", "blurred vision", "numbness in the feet"]
+SMALL_TALK = [
+    "Doctor: How was the drive in today?",
+    "Patient: Not bad, the traffic was light for once.",
+    "Doctor: Good to hear. How has the family been?",
+    "Patient: Everyone is well, my daughter just started school again.",
+    "Doctor: Let me just pull up your chart here.",
+    "Patient: Take your time, I know the system can be slow.",
+    "Doctor: Alright, I have it now. Let's go over a few things.",
+    "Patient: Sure, I wrote some questions down so I would not forget them.",
+    "Doctor: That's always helpful. We'll get to them.",
+    "Patient: The weather has been strange lately, hasn't it?",
+]
+
+
+def synthetic_transcript(minutes, seed=0):
+    """
+    Generate a doctor-patient conversation with facts seeded between small talk.
+
+    :param minutes: Length of the conversation at 150 words per minute.
+    :param seed: Seed for the random generator so runs are repeatable.
+    :return: The transcript and the seeded facts, each a tuple of its sentence and the
+        words that must appear in a note mentioning it.
+    :rtype: tuple[str, list[tuple[str, str]]]
+    """
+    rng = random.Random(seed)
+    target_words = int(minutes * WORDS_PER_MINUTE)
+    lines = []
+    facts = []
+    words = 0
+    while words < target_words:
+        if rng.random() < 0.25:
+            kind = rng.choice(("medication", "vital", "symptom"))
+            if kind == "medication":
+                drug = rng.choice(MEDICATIONS)
+                dose = rng.choice((5, 10, 20, 25, 40, 50, 100, 250, 500, 1000))
+                line = f"Patient: I take {drug} {dose} milligrams every morning."
+                fact = (line, f"{drug}")
+            elif kind == "vital":
+                systolic = rng.randint(105, 175)
+                diastolic = rng.randint(60, 105)
+                line = f"Doctor: Your blood pressure today is {systolic} over {diastolic}."
+                fact = (line, f"{systolic}")
+            else:
+                symptom = rng.choice(SYMPTOMS)
+                days = rng.randint(2, 30)
+                line = f"Patient: I have had {symptom} for about {days} days now."
+                fact = (line, symptom)
+            facts.append(fact)
+        else:
+            line = rng.choice(SMALL_TALK)
+        lines.append(line)
+        words += len(line.split())
+    return "\n".join(lines), facts
+
+
+def fact_recall(note, facts):
+    """
+    Share of the seeded facts whose key words appear in the note.
+    """
+    if not facts:
+        return 1.0
+    note = note.lower()
+    keys = {key.lower() for _, key in facts}
+    return sum(1 for key in keys if key in note) / len(keys)
+
+
+class FakeModel:
+    """
+    Stand-in for an LLM: answers with the lines of the prompt that hold numbers or
+    symptoms, at a fixed rate of tokens per second.
+    """
+
+    def __init__(self, max_tokens, tokens_per_second):
+        self.max_tokens = max_tokens
+        self.tokens_per_second = tokens_per_second
+
+    def count_tokens(self, text):
+        return estimate_tokens(text)
+
+    def generate(self, prompt, label):
+        lines = []
+        tokens = 0
+        for line in prompt.splitlines():
+            line = line.strip()
+            if not (re.search(r"\d", line) or any(symptom in line for symptom in SYMPTOMS)) or line in lines:
+                continue
+            tokens += estimate_tokens(line)
+            if tokens > self.max_tokens:
+                break
+            lines.append(line)
+        if self.tokens_per_second:
+            time.sleep(tokens / self.tokens_per_second)
+        return "\n".join(lines)
+
+
+class LocalModel:
+    """
+    A local GGUF model loaded with llama.cpp.
+    """
+
+    def __init__(self, path, context_size, max_tokens, threads):
+        from Model import Model
+
+        self.model = Model(path, context_size=context_size, gpu_layers=0, n_threads=threads)
+        self.max_tokens = max_tokens
+
+    def count_tokens(self, text):
+        return self.model.count_tokens(text)
+
+    def generate(self, prompt, label):
+        return self.model.generate_response(prompt, max_tokens=self.max_tokens, progress_label=label)
+
+
+class RemoteModel:
+    """
+    A model of an OpenAI compatible server.
+    """
+
+    def __init__(self, endpoint, model, max_tokens, api_key=None):
+        self.url = endpoint.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.max_tokens = max_tokens
+        self.api_key = api_key
+
+    def count_tokens(self, text):
+        return estimate_tokens(text)
+
+    def generate(self, prompt, label):
+        payload = {"model": self.model, "messages": [{"role": "user", "content": prompt}],
+                   "max_tokens": self.max_tokens, "temperature": 0.1}
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode(), headers=headers)
+        with urllib.request.urlopen(request, timeout=600) as response:
+            return json.load(response)["choices"][0]["message"]["content"]
+
+
+class CountingGenerator:
+    """
+    Wraps the generate callable of a model to count the calls.
+    """
+
+    def __init__(self, generate):
+        self.generate = generate
+        self.calls = 0
+
+    def __call__(self, prompt, label):
+        self.calls += 1
+        return self.generate(prompt, label)
+
+
+def run_single(transcript, model, budget):
+    """
+    Write a note the way it was done before: one prompt, the transcript cut to fit.
+    """
+    generate = CountingGenerator(model.generate)
+    window = split_into_windows(transcript, budget.count_tokens, budget.room_for(PRE_PROCESSING))[0]
+    facts = generate(f"{PRE_PROCESSING} {window}", "Extracting facts")
+    note = generate(f"{AISCRIBE} {facts} {AISCRIBE2}", "Writing note")
+    return facts, note, 1, generate.calls
+
+
+def run_map_reduce(transcript, model, budget, max_parallel):
+    """
+    Write a note from facts extracted from every window of the transcript.
+    """
+    generate = CountingGenerator(model.generate)
+    windows = len(split_into_windows(transcript, budget.count_tokens, budget.room_for(PRE_PROCESSING)))
+    facts = extract_facts(transcript, generate, budget, PRE_PROCESSING,
+                          target_tokens=budget.room_for(AISCRIBE, AISCRIBE2), max_parallel=max_parallel)
+    note = generate(f"{AISCRIBE} {facts} {AISCRIBE2}", "Writing note")
+    return facts, note, windows, generate.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark note generation from long synthetic transcripts.")
+    parser.add_argument('--minutes', default="10,30,60", help="Comma separated lengths of the transcripts in minutes.")
+    parser.add_argument('--model', help="Path of a GGUF model to run locally with llama.cpp.")
+    parser.add_argument('--endpoint', help="OpenAI compatible API URL, e.g. http://localhost:1337/v1.")
+    parser.add_argument('--api-model', default="gpt-4", help="Model name sent to --endpoint.")
+    parser.add_argument('--api-key', help="Sent as a Bearer token to --endpoint.")
+    parser.add_argument('--context-size', type=int, default=4096, help="Context window in tokens.")
+    parser.add_argument('--max-tokens', type=int, default=400, help="Tokens generated per call, the max_length setting.")
+    parser.add_argument('--threads', type=int, help="CPU threads of the local model.")
+    parser.add_argument('--parallel', type=int, default=None,
+                        help=f"Windows sent at the same time, default 1 for a local model and {DEFAULT_MAX_PARALLEL} otherwise.")
+    parser.add_argument('--fake-tokens-per-second', type=float, default=200.0,
+                        help="Generation rate of the fake model used without --model or --endpoint, 0 for no delay.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic transcripts.")
+    parser.add_argument('--json', dest="json_path", help="Write the results as JSON to this file, '-' for stdout.")
+    args = parser.parse_args()
+
+    if args.model:
+        model = LocalModel(args.model, args.context_size, args.max_tokens, args.threads)
+        max_parallel = args.parallel or 1
+    elif args.endpoint:
+        model = RemoteModel(args.endpoint, args.api_model, args.max_tokens, args.api_key)
+        max_parallel = args.parallel or DEFAULT_MAX_PARALLEL
+    else:
+        model = FakeModel(args.max_tokens, args.fake_tokens_per_second)
+        max_parallel = args.parallel or DEFAULT_MAX_PARALLEL
+    budget = TokenBudget(model.count_tokens, args.context_size, args.max_tokens)
+
+    results = []
+    print(f"{'minutes':>7} {'tokens':>7} {'mode':>10} {'windows':>7} {'calls':>5} {'seconds':>8} "
+          f"{'facts':>6} {'note':>6}")
+    for minutes in [float(value) for value in args.minutes.split(",")]:
+        transcript, facts = synthetic_transcript(minutes, args.seed)
+        tokens = budget.count_tokens(transcript)
+        for mode, run in (("single", lambda: run_single(transcript, model, budget)),
+                          ("map-reduce", lambda: run_map_reduce(transcript, model, budget, max_parallel))):
+            started = time.perf_counter()
+            extracted, note, windows, calls = run()
+            seconds = time.perf_counter() - started
+            facts_recall = fact_recall(extracted, facts)
+            note_recall = fact_recall(note, facts)
+            results.append({"minutes": minutes, "transcript_tokens": tokens, "mode": mode, "windows": windows,
+                            "calls": calls, "seconds": seconds, "facts_recall": facts_recall,
+                            "note_recall": note_recall})
+            print(f"{minutes:>7g} {tokens:>7} {mode:>10} {windows:>7} {calls:>5} {seconds:>8.2f} "
+                  f"{facts_recall:>6.0%} {note_recall:>6.0%}")
+
+    if args.json_path == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+CPU benchmark of the local LLM's generation speed with and without speculative decoding.
+
+Writes a SOAP note from each of a few representative clinical transcripts with the
+model loaded normally, then with prompt lookup decoding and, with --draft-model, with a
+draft model. Sampling is greedy so every configuration must write the same notes; the
+table shows the decoding rate in tokens per second after the first token, the speedup
+over normal decoding and whether the notes matched.
+
+The prompt cache is disabled so every configuration evaluates the same prompts.
+
+Example:
+    python speculative_benchmark.py --model ./models/gemma-2-2b-it-Q8_0.gguf
+    python speculative_benchmark.py --model ./models/gemma-2-2b-it-Q8_0.gguf --draft-tokens 2,4,8
+    python speculative_benchmark.py --model ./models/gemma-2-9b-it-Q4_K_M.gguf --draft-model ./models/gemma-2-2b-it-Q8_0.gguf
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+from Model import Model
+from utils.token_stream import generation_history
+
+AISCRIBE = ("AI, please transform the following conversation into a concise SOAP note. Do not assume any medical "
+            "data, vital signs, or lab values. Base the note strictly on the information provided in the "
+            "conversation. Here's the conversation:")
+AISCRIBE2 = ("Remember, the Subjective section should reflect the patient's perspective and complaints as mentioned "
+             "in the conversation. Do not add any information that did not occur and do not make assumptions.")
+
+TRANSCRIPTS = [
+    """Doctor: Good morning, what brings you in today?
+Patient: I've had a cough for about two weeks now, and it's getting worse at night.
+Doctor: Is it a dry cough or are you bringing anything up?
+Patient: Mostly dry, but the last few days there's been some yellow phlegm.
+Doctor: Any fever or chills?
+Patient: I had a fever of 38.2 on Saturday, but it's been normal since.
+Doctor: Any shortness of breath or chest pain?
+Patient: A little short of breath when I climb stairs, no chest pain.
+Doctor: Do you smoke?
+Patient: I quit five years ago. I smoked about a pack a day for twenty years.
+Doctor: Your oxygen saturation today is 96 percent and your temperature is 37.1. I can hear some crackles at the base of the right lung.
+Patient: Is that serious?
+Doctor: It could be a mild pneumonia. I'd like to get a chest X-ray and start you on amoxicillin 1000 milligrams three times a day for seven days.
+Patient: Okay. Should I stay home from work?
+Doctor: Rest for a few days, drink plenty of fluids, and come back if the shortness of breath gets worse or the fever returns.""",
+    """Doctor: How have your blood sugars been since we increased the metformin?
+Patient: Better, I think. My morning readings are usually between 7 and 8 now.
+Doctor: That's an improvement from the 10s you were seeing. Are you taking the metformin 1000 milligrams twice a day with meals?
+Patient: Yes, with breakfast and dinner. My stomach was upset the first week but it settled.
+Doctor: Good. Your A1C came back at 7.4, down from 8.1 three months ago.
+Patient: That's good news.
+Doctor: It is. Your blood pressure today is 138 over 86, which is a bit high. Are you still taking the lisinopril 10 milligrams?
+Patient: Every morning. I did run out for about four days last week.
+Doctor: That could explain part of it. Let's keep the same dose and recheck in a month. How about your feet, any numbness or tingling?
+Patient: Some tingling in my toes at night.
+Doctor: I'll examine your feet and order a urine test for kidney function. Keep walking thirty minutes a day, that's helping.""",
+    """Doctor: I understand you've been feeling down lately. Can you tell me about it?
+Patient: For the last couple of months I just haven't felt like myself. I'm tired all the time and I don't enjoy things anymore.
+Doctor: How is your sleep?
+Patient: I fall asleep okay but I wake up at 4 in the morning and can't get back to sleep.
+Doctor: How about your appetite?
+Patient: I've lost about 5 kilograms without trying.
+Doctor: Have you had any thoughts of harming yourself?
+Patient: No, nothing like that. I just feel flat.
+Doctor: Has anything changed at work or at home?
+Patient: My mother passed away in the spring and work has been very stressful.
+Doctor: I'm sorry to hear about your mother. Your PHQ-9 score today is 16, which suggests moderate to severe depression.
+Patient: What can we do about it?
+Doctor: I'd recommend starting sertraline 50 milligrams once a day and a referral for counselling. We'll follow up in four weeks to see how you're doing.
+Patient: Okay, I'm willing to try that.""",
+]
+
+
+def load_transcripts(path):
+    """
+    Load the .txt files of a directory, or the built-in transcripts without one.
+
+    :rtype: list[str]
+    """
+    if not path:
+        return TRANSCRIPTS
+    files = sorted(glob.glob(os.path.join(path, "*.txt")))
+    if not files:
+        raise SystemExit(f"No .txt transcripts found in {path}")
+    transcripts = []
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            transcripts.append(f.read())
+    return transcripts
+
+
+def run_configuration(name, args, transcripts, speculative_decoding=False, draft_model_path=None, num_draft_tokens=None):
+    """
+    Load the model in one configuration and write a note from every transcript.
+
+    :return: The notes and the decoding rates in tokens per second.
+    """
+    model = Model(args.model, context_size=args.context_size, gpu_layers=0, n_threads=args.threads,
+                  prompt_cache_mb=0, speculative_decoding=speculative_decoding,
+                  draft_model_path=draft_model_path, num_draft_tokens=num_draft_tokens)
+    notes = []
+    rates = []
+    try:
+        for index, transcript in enumerate(transcripts, 1):
+            for repeat in range(args.repeats):
+                label = f"{name} #{index}"
+                note = model.generate_response(f"{AISCRIBE} {transcript} {AISCRIBE2}", max_tokens=args.max_tokens,
+                                               temperature=0.0, top_p=1.0, repeat_penalty=1.0, progress_label=label)
+                if repeat == 0:
+                    notes.append(note)
+                rate = generation_history()[-1]["tokens_per_second"]
+                if rate is not None:
+                    rates.append(rate)
+    finally:
+        model.close()
+    return notes, rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local LLM with and without speculative decoding.")
+    parser.add_argument('--model', required=True, help="Path of the GGUF model.")
+    parser.add_argument('--draft-model', help="Path of a small GGUF model sharing the vocabulary to propose tokens.")
+    parser.add_argument('--draft-tokens', default="2,4",
+                        help="Comma separated numbers of tokens proposed per step to compare.")
+    parser.add_argument('--transcripts', help="Directory of .txt transcripts. Built-in clinical conversations if not set.")
+    parser.add_argument('--context-size', type=int, default=4096, help="Context window in tokens.")
+    parser.add_argument('--max-tokens', type=int, default=400, help="Tokens generated per note.")
+    parser.add_argument('--threads', type=int, help="CPU threads, all cores by default.")
+    parser.add_argument('--repeats', type=int, default=1, help="Notes written from each transcript.")
+    parser.add_argument('--json', dest="json_path", help="Write the results as JSON to this file, '-' for stdout.")
+    args = parser.parse_args()
+
+    transcripts = load_transcripts(args.transcripts)
+    configurations = [("normal", {})]
+    for tokens in [int(value) for value in args.draft_tokens.split(",")]:
+        configurations.append((f"lookup-{tokens}", {"speculative_decoding": True, "num_draft_tokens": tokens}))
+        if args.draft_model:
+            configurations.append((f"draft-{tokens}", {"speculative_decoding": True, "num_draft_tokens": tokens,
+                                                       "draft_model_path": args.draft_model}))
+
+    results = []
+    baseline_notes = None
+    baseline_rate = None
+    for name, options in configurations:
+        started = time.perf_counter()
+        notes, rates = run_configuration(name, args, transcripts, **options)
+        rate = statistics.median(rates) if rates else 0.0
+        if baseline_notes is None:
+            baseline_notes, baseline_rate = notes, rate
+        results.append({
+            "configuration": name,
+            "tokens_per_second": rate,
+            "speedup": rate / baseline_rate if baseline_rate else None,
+            "same_notes": notes == baseline_notes,
+            "seconds": time.perf_counter() - started,
+        })
+
+    print(f"\n{'configuration':>14} {'tokens/s':>9} {'speedup':>8} {'same notes':>11}")
+    for result in results:
+        speedup = f"{result['speedup']:.2f}x" if result["speedup"] else "-"
+        print(f"{result['configuration']:>14} {result['tokens_per_second']:>9.1f} {speedup:>8} "
+              f"{'yes' if result['same_notes'] else 'no':>11}")
+
+    if args.json_path == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
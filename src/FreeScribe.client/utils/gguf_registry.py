@@ -0,0 +1,382 @@
+"""
+Registry of the local GGUF models in the models folder.
+
+Only the header of each GGUF file is read, through a memory map, to learn the model's
+architecture, trained context length, quantization and chat template. The tensors are
+never touched, so scanning a folder of multi-gigabyte models takes milliseconds. The
+metadata is cached on disk keyed by the file's size and modification time, a model is
+only parsed again when the file changes.
+
+The GGUF layout is described at https://github.com/ggerganov/ggml/blob/master/docs/gguf.md
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+from utils.file_utils import get_resource_path
+
+DEFAULT_MODELS_DIR = "./models"
+DEFAULT_MODEL = "gemma-2-2b-it-Q8_0.gguf"
+CACHE_FILE_NAME = "gguf_metadata_cache.json"
+GGUF_MAGIC = b"GGUF"
+GGUF_SUFFIX = ".gguf"
+# Context used when the model does not declare one, the previous fixed context
+FALLBACK_CONTEXT_SIZE = 4096
+# Largest default context, the KV cache grows with the context size
+MAX_DEFAULT_CONTEXT_SIZE = 8192
+
+# Value types of the metadata, with the struct format of the fixed size ones
+_UINT8, _INT8, _UINT16, _INT16, _UINT32, _INT32, _FLOAT32, _BOOL, _STRING, _ARRAY, _UINT64, _INT64, _FLOAT64 = range(13)
+_SCALAR_FORMATS = {
+    _UINT8: "<B", _INT8: "<b", _UINT16: "<H", _INT16: "<h", _UINT32: "<I", _INT32: "<i",
+    _FLOAT32: "<f", _BOOL: "<?", _UINT64: "<Q", _INT64: "<q", _FLOAT64: "<d",
+}
+
+# general.file_type, the quantization of most of the tensors (llama_ftype of llama.cpp)
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1", 10: "Q2_K",
+    11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M", 16: "Q5_K_S",
+    17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S", 22: "IQ3_XS",
+    23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M", 28: "IQ2_S",
+    29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16",
+}
+
+# Chat format of llama_cpp for models without an embedded chat template
+ARCHITECTURE_CHAT_FORMATS = {
+    "gemma": "gemma",
+    "gemma2": "gemma",
+    "llama": "llama-2",
+    "mistral": "mistral-instruct",
+    "qwen2": "chatml",
+    "phi3": "chatml",
+}
+
+
+class GGUFError(ValueError):
+    """
+    Raised when a file is not a valid GGUF model.
+    """
+
+
+class ModelInfo:
+    """
+    Metadata of a GGUF model read from its header.
+
+    :ivar filename: File name of the model in the models folder.
+    :ivar path: Path of the model file.
+    :ivar size: Size of the file in bytes.
+    :ivar name: Name of the model from its metadata, None if it has none.
+    :ivar architecture: Architecture of the model, e.g. "gemma2" or "llama".
+    :ivar context_length: Context length the model was trained with, None if unknown.
+    :ivar quantization: Quantization of the weights, e.g. "Q8_0", None if unknown.
+    :ivar chat_template: The Jinja chat template embedded in the model, None if it has none.
+    """
+
+    FIELDS = ("filename", "path", "size", "name", "architecture", "context_length", "quantization", "chat_template")
+
+    def __init__(self, filename, path, size, name=None, architecture=None, context_length=None,
+                 quantization=None, chat_template=None):
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.name = name
+        self.architecture = architecture
+        self.context_length = context_length
+        self.quantization = quantization
+        self.chat_template = chat_template
+
+    @property
+    def default_context_size(self):
+        """
+        Context size to load the model with: its trained context, capped to bound the memory used.
+        """
+        if not self.context_length:
+            return FALLBACK_CONTEXT_SIZE
+        return min(self.context_length, MAX_DEFAULT_CONTEXT_SIZE)
+
+    @property
+    def default_chat_format(self):
+        """
+        The chat_format of llama_cpp for the model.
+
+        None when the model embeds a chat template, llama_cpp then formats the messages
+        with that template. Otherwise the format is chosen by the architecture.
+        """
+        if self.chat_template:
+            return None
+        return ARCHITECTURE_CHAT_FORMATS.get(self.architecture)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return (f"ModelInfo({self.filename!r}, architecture={self.architecture!r}, "
+                f"context_length={self.context_length!r}, quantization={self.quantization!r})")
+
+
+def read_gguf_metadata(path):
+    """
+    Read the metadata key-value pairs of a GGUF file without reading its tensors.
+
+    Arrays, e.g. the tokenizer's vocabulary, are skipped and read as None.
+
+    :param path: Path of the GGUF file.
+    :type path: str
+    :return: The metadata keys and their values.
+    :rtype: dict
+    :raises GGUFError: If the file is not a valid GGUF file.
+    """
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can not be mapped
+            raise GGUFError(f"{path} is empty")
+        try:
+            return _HeaderReader(data).read_metadata()
+        except struct.error:
+            raise GGUFError(f"{path} has a truncated GGUF header")
+        finally:
+            data.close()
+
+
+class _HeaderReader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read_metadata(self):
+        if self.data[:4] != GGUF_MAGIC:
+            raise GGUFError("Not a GGUF file")
+        self.offset = 4
+        version = self._unpack("<I")
+        if version == 1:
+            # Counts and lengths were 32-bit in version 1
+            self._count_format = "<I"
+        elif version in (2, 3):
+            self._count_format = "<Q"
+        else:
+            raise GGUFError(f"Unsupported GGUF version {version}")
+        self._unpack(self._count_format)  # tensor count
+        kv_count = self._unpack(self._count_format)
+
+        metadata = {}
+        for _ in range(kv_count):
+            key = self._string()
+            value_type = self._unpack("<I")
+            metadata[key] = self._value(value_type)
+        return metadata
+
+    def _unpack(self, fmt):
+        value, = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def _string(self):
+        length = self._unpack(self._count_format)
+        end = self.offset + length
+        if end > len(self.data):
+            raise struct.error("string past the end of the file")
+        value = self.data[self.offset:end].decode("utf-8", errors="replace")
+        self.offset = end
+        return value
+
+    def _value(self, value_type):
+        if value_type in _SCALAR_FORMATS:
+            return self._unpack(_SCALAR_FORMATS[value_type])
+        if value_type == _STRING:
+            return self._string()
+        if value_type == _ARRAY:
+            self._skip_array()
+            return None
+        raise GGUFError(f"Unknown GGUF value type {value_type}")
+
+    def _skip_array(self):
+        item_type = self._unpack("<I")
+        count = self._unpack(self._count_format)
+        if item_type in _SCALAR_FORMATS:
+            self.offset += count * struct.calcsize(_SCALAR_FORMATS[item_type])
+        elif item_type == _STRING:
+            length_size = struct.calcsize(self._count_format)
+            for _ in range(count):
+                length, = struct.unpack_from(self._count_format, self.data, self.offset)
+                self.offset += length_size + length
+        else:
+            for _ in range(count):
+                self._value(item_type)
+
+
+def model_info_from_metadata(filename, path, size, metadata):
+    """
+    Build the ModelInfo of a model from its GGUF metadata.
+    """
+    architecture = metadata.get("general.architecture")
+    file_type = metadata.get("general.file_type")
+    return ModelInfo(
+        filename=filename,
+        path=path,
+        size=size,
+        name=metadata.get("general.name"),
+        architecture=architecture,
+        context_length=metadata.get(f"{architecture}.context_length"),
+        quantization=FILE_TYPES.get(file_type, str(file_type)) if file_type is not None else None,
+        chat_template=metadata.get("tokenizer.chat_template"),
+    )
+
+
+def read_model_info(path):
+    """
+    Read the metadata of a GGUF model file anywhere on disk.
+
+    :param path: Path of the model file.
+    :rtype: ModelInfo
+    :raises GGUFError: If the file is not a valid GGUF file.
+    :raises OSError: If the file can not be read.
+    """
+    return model_info_from_metadata(os.path.basename(path), path, os.path.getsize(path), read_gguf_metadata(path))
+
+
+class ModelRegistry:
+    """
+    The GGUF models of a folder and their metadata.
+
+    :param directory: The folder holding the models.
+    :type directory: str
+    :param cache_path: Path of the metadata cache. Defaults to a file in the user data dir.
+    :type cache_path: str or None
+
+    Example
+    -------
+    >>> registry = ModelRegistry()
+    >>> [model.filename for model in registry.models()]
+    ['gemma-2-2b-it-Q8_0.gguf']
+    >>> registry.get('gemma-2-2b-it-Q8_0.gguf').default_context_size
+    8192
+    """
+
+    def __init__(self, directory=DEFAULT_MODELS_DIR, cache_path=None):
+        self.directory = directory
+        self.cache_path = cache_path or get_resource_path(CACHE_FILE_NAME)
+        self._lock = threading.Lock()
+        self._cache = None
+
+    def models(self):
+        """
+        Scan the folder for GGUF models.
+
+        Files whose header can not be read are skipped.
+
+        :return: The models, sorted by file name.
+        :rtype: list[ModelInfo]
+        """
+        try:
+            filenames = sorted(name for name in os.listdir(self.directory) if name.lower().endswith(GGUF_SUFFIX))
+        except FileNotFoundError:
+            return []
+
+        models = []
+        with self._lock:
+            cache = self._load_cache()
+            changed = False
+            for filename in filenames:
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry = cache.get(filename)
+                if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                    try:
+                        info = model_info_from_metadata(filename, path, stat.st_size, read_gguf_metadata(path))
+                        entry = dict(info.to_dict(), mtime=stat.st_mtime)
+                    except (GGUFError, OSError) as e:
+                        print(f"Skipping model {filename}: {e}")
+                        # Remembered so the file is not parsed again until it changes
+                        entry = {"size": stat.st_size, "mtime": stat.st_mtime, "error": str(e)}
+                    cache[filename] = entry
+                    changed = True
+                if "error" in entry:
+                    continue
+                fields = {field: entry[field] for field in ModelInfo.FIELDS if field != "path"}
+                models.append(ModelInfo(path=path, **fields))
+
+            # Forget the models removed from the folder
+            for filename in set(cache) - set(filenames):
+                del cache[filename]
+                changed = True
+            if changed:
+                self._save_cache(cache)
+        return models
+
+    def filenames(self):
+        """
+        The file names of the models in the folder, sorted.
+
+        :rtype: list[str]
+        """
+        return [model.filename for model in self.models()]
+
+    def get(self, filename):
+        """
+        Look up a model by file name.
+
+        :return: The model's metadata, None if the folder has no such valid model.
+        :rtype: ModelInfo or None
+        """
+        for model in self.models():
+            if model.filename == filename:
+                return model
+        return None
+
+    def resolve(self, filename=None):
+        """
+        The model to load for a selected file name.
+
+        :param filename: The selected model, e.g. the "Model" setting.
+        :return: The selected model if the folder has it, otherwise the default model or
+            the first model of the folder. None if the folder has no valid model.
+        :rtype: ModelInfo or None
+        """
+        models = {model.filename: model for model in self.models()}
+        for candidate in (filename, DEFAULT_MODEL):
+            if candidate in models:
+                return models[candidate]
+        return next(iter(models.values()), None)
+
+    def _load_cache(self):
+        if self._cache is None:
+            try:
+                with open(self.cache_path, "r", encoding="utf-8") as f:
+                    self._cache = json.load(f)
+            except (OSError, ValueError):
+                self._cache = {}
+        return self._cache
+
+    def _save_cache(self, cache):
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            print(f"Failed to save the model metadata cache: {e}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    The registry of the models folder, shared by the settings window and the model loader.
+
+    :rtype: ModelRegistry
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
@@ -0,0 +1,185 @@
+"""
+One-time calibration of the llama.cpp thread counts and batch size for this computer.
+
+Generation speed depends on the number of threads decoding one token at a time, which
+is usually best at the number of physical cores and worse with every logical one.
+Prompt evaluation processes batches of tokens and depends on the threads used for
+batches and the batch size. Both vary several-fold with the cores, caches and memory
+bandwidth of a machine, so they are measured rather than guessed:
+
+- generation: the time to decode single tokens for each candidate ``n_threads``.
+- prompt evaluation: the time to evaluate a fixed prompt for each ``n_batch`` and
+  candidate ``n_threads_batch`` (the grid of the two).
+
+The model is loaded once per batch size, the thread counts are switched on the loaded
+context. The best configuration is stored in the settings under a key naming the
+machine, the model file and whether layers are offloaded to the GPU.
+"""
+
+import os
+import platform
+import time
+
+import llama_cpp
+from llama_cpp import Llama
+
+SETTINGS_KEY = "Local LLM Tuning"
+BATCH_SIZES = (128, 256, 512)
+# The batch size and thread count used before tuning, measured for comparison
+DEFAULT_BATCH_SIZE = 512
+PROMPT_TOKENS = 512
+GENERATED_TOKENS = 16
+# Tokens evaluated after loading so the first measurement does not include warm-up
+WARMUP_TOKENS = 8
+
+# Evaluated to measure the speed, repeated to the length of the prompt
+_CALIBRATION_TEXT = (
+    "Doctor: Good morning, what brings you in today? Patient: I've had a cough for about two weeks "
+    "and it's worse at night. Doctor: Any fever, chills or shortness of breath? Patient: A fever of "
+    "38.2 on Saturday and I get winded on the stairs. Doctor: Your oxygen saturation is 96 percent and "
+    "I can hear crackles at the right base. We'll get a chest X-ray and start amoxicillin. "
+)
+
+
+def thread_candidates(cpu_count=None):
+    """
+    Thread counts worth measuring on a machine.
+
+    Without a portable way to count physical cores the candidates span a quarter of
+    the logical cores to all of them, which includes the physical core count of
+    machines with and without simultaneous multithreading.
+
+    :param cpu_count: Number of logical cores, defaults to os.cpu_count().
+    :rtype: list[int]
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return sorted({max(1, cpu_count * share // 4) for share in (1, 2, 3, 4)})
+
+
+def machine_id():
+    """
+    Identifies this computer and its processor in the tuning settings.
+    """
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}"
+
+
+def tuning_key(model_path, gpu_layers):
+    """
+    Key of a model's tuning in the settings.
+
+    :param model_path: Path of the model file.
+    :param gpu_layers: Layers offloaded to the GPU, any offload is tuned separately from the CPU.
+    :rtype: str
+    """
+    size = os.path.getsize(model_path) if os.path.exists(model_path) else 0
+    device = "gpu" if gpu_layers else "cpu"
+    return f"{machine_id()}|{os.path.basename(model_path)}|{size}|{device}"
+
+
+def find_tuning(settings, model_path, gpu_layers):
+    """
+    Look up the stored tuning of a model on this computer.
+
+    :param settings: The editable settings.
+    :type settings: dict
+    :return: The tuning, with the keys n_threads, n_threads_batch and n_batch, None if
+        the model was not tuned on this computer.
+    :rtype: dict or None
+    """
+    return (settings.get(SETTINGS_KEY) or {}).get(tuning_key(model_path, gpu_layers))
+
+
+def store_tuning(settings, model_path, gpu_layers, tuning):
+    """
+    Store the tuning of a model on this computer in the editable settings.
+    """
+    tunings = dict(settings.get(SETTINGS_KEY) or {})
+    tunings[tuning_key(model_path, gpu_layers)] = tuning
+    settings[SETTINGS_KEY] = tunings
+
+
+def calibrate(model_path, gpu_layers=0, batch_sizes=BATCH_SIZES, thread_counts=None):
+    """
+    Measure the prompt evaluation and generation speed of a model over the candidate
+    thread counts and batch sizes.
+
+    :param model_path: Path of the GGUF model.
+    :param gpu_layers: Layers to offload to the GPU, -1 for all.
+    :param batch_sizes: Candidate values of n_batch.
+    :param thread_counts: Candidate values of n_threads and n_threads_batch, by default
+        from :func:`thread_candidates`.
+    :return: The best n_threads, n_threads_batch and n_batch with their measured speeds
+        in tokens per second, and the speeds of the configuration used before tuning.
+    :rtype: dict
+    """
+    thread_counts = sorted(thread_counts or thread_candidates())
+    started = time.monotonic()
+    generation = {}
+    prompt = {}
+    tokens = None
+
+    for n_batch in batch_sizes:
+        llm = Llama(
+            model_path=model_path,
+            n_ctx=PROMPT_TOKENS + GENERATED_TOKENS + WARMUP_TOKENS,
+            n_gpu_layers=gpu_layers,
+            n_batch=n_batch,
+            n_threads=thread_counts[-1],
+            n_threads_batch=thread_counts[-1],
+            verbose=False,
+        )
+        try:
+            if tokens is None:
+                text = _CALIBRATION_TEXT
+                tokens = llm.tokenize(text.encode("utf-8"))
+                while len(tokens) < PROMPT_TOKENS + GENERATED_TOKENS:
+                    text += _CALIBRATION_TEXT
+                    tokens = llm.tokenize(text.encode("utf-8"))
+            llm.reset()
+            llm.eval(tokens[:WARMUP_TOKENS])
+
+            for n_threads_batch in thread_counts:
+                llama_cpp.llama_set_n_threads(llm.ctx, thread_counts[-1], n_threads_batch)
+                llm.reset()
+                seconds = _timed(llm.eval, tokens[:PROMPT_TOKENS])
+                prompt[(n_threads_batch, n_batch)] = PROMPT_TOKENS / seconds
+                print(f"Tuning: prompt n_threads_batch={n_threads_batch} n_batch={n_batch}: "
+                      f"{prompt[(n_threads_batch, n_batch)]:.1f} tokens/s")
+
+            if n_batch == batch_sizes[-1]:
+                # Decoding one token at a time does not depend on the batch size
+                for n_threads in thread_counts:
+                    llama_cpp.llama_set_n_threads(llm.ctx, n_threads, thread_counts[-1])
+                    llm.reset()
+                    llm.eval(tokens[:WARMUP_TOKENS])
+                    seconds = _timed(lambda: [llm.eval([token]) for token in
+                                              tokens[WARMUP_TOKENS:WARMUP_TOKENS + GENERATED_TOKENS]])
+                    generation[n_threads] = GENERATED_TOKENS / seconds
+                    print(f"Tuning: generation n_threads={n_threads}: {generation[n_threads]:.1f} tokens/s")
+        finally:
+            llm.close()
+
+    n_threads = max(generation, key=generation.get)
+    n_threads_batch, n_batch = max(prompt, key=prompt.get)
+    default_batch = DEFAULT_BATCH_SIZE if DEFAULT_BATCH_SIZE in batch_sizes else batch_sizes[-1]
+    tuning = {
+        "n_threads": n_threads,
+        "n_threads_batch": n_threads_batch,
+        "n_batch": n_batch,
+        "generation_tokens_per_second": round(generation[n_threads], 2),
+        "prompt_tokens_per_second": round(prompt[(n_threads_batch, n_batch)], 2),
+        "untuned_generation_tokens_per_second": round(generation[thread_counts[-1]], 2),
+        "untuned_prompt_tokens_per_second": round(prompt[(thread_counts[-1], default_batch)], 2),
+        "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    print(f"Tuned {os.path.basename(model_path)} in {time.monotonic() - started:.0f}s: n_threads={n_threads}, "
+          f"n_threads_batch={n_threads_batch}, n_batch={n_batch}, generation "
+          f"{tuning['untuned_generation_tokens_per_second']} -> {tuning['generation_tokens_per_second']} tokens/s, "
+          f"prompt {tuning['untuned_prompt_tokens_per_second']} -> {tuning['prompt_tokens_per_second']} tokens/s")
+    return tuning
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return max(time.perf_counter() - start, 1e-6)
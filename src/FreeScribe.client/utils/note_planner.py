@@ -0,0 +1,277 @@
+"""
+Token-aware planning of note generation for transcripts longer than the context window.
+
+The size of every prompt is checked before it is sent: from its length when that is
+far from the limit, with the model's tokenizer when it is close. When the transcript
+and its instructions do not fit in the context window next to the tokens to generate,
+the transcript is split at sentence boundaries into overlapping windows. Facts are
+extracted from every window, in parallel for a remote server or one after the other
+for the local model, whose prompt cache then only evaluates the shared instructions
+once. The lists of facts are merged until they fit in the prompt of the note
+(map-reduce), so a long encounter is never silently truncated.
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Tokens kept free for the chat template and special tokens around a prompt
+TEMPLATE_MARGIN_TOKENS = 64
+# Characters per token assumed when the model's tokenizer is not available, typical of
+# English text with the tokenizers of current models
+CHARS_PER_TOKEN_ESTIMATE = 4
+# Characters per token of conversation text with any tokenizer, assumed to decide from
+# the length of a text alone whether it is far below or far above a limit
+MIN_CHARS_PER_TOKEN = 2
+MAX_CHARS_PER_TOKEN = 8
+# Tokens of transcript repeated at the start of the next window, so a statement cut
+# by a window boundary is complete in one of them
+DEFAULT_OVERLAP_TOKENS = 128
+# Windows sent at the same time to a remote server
+DEFAULT_MAX_PARALLEL = 4
+MERGE_FACTS_PROMPT = ("The following lists of facts were extracted from consecutive parts of the same "
+                      "conversation. Merge them into one easy to read list of facts, keeping every fact "
+                      "and removing the duplicates:\n\n")
+
+# Sentence ends and line breaks, kept so the windows keep the lines of the transcript
+_SENTENCE_END = re.compile(r"((?<=[.!?])\s+|\s*\n\s*)")
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a text by its length.
+
+    :param text: The text.
+    :type text: str
+    :rtype: int
+    """
+    return len(text) // CHARS_PER_TOKEN_ESTIMATE + 1
+
+
+def within_tokens(text, count_tokens, limit):
+    """
+    Whether a text takes at most limit tokens.
+
+    The text is only counted when its length does not settle it, so a text far below or
+    far above the limit is not tokenized.
+
+    :param text: The text.
+    :param count_tokens: Callable returning the number of tokens of a text.
+    :param limit: Most tokens the text may take.
+    :rtype: bool
+    """
+    if len(text) <= limit * MIN_CHARS_PER_TOKEN:
+        return True
+    if len(text) > limit * MAX_CHARS_PER_TOKEN:
+        return False
+    return count_tokens(text) <= limit
+
+
+class TokenBudget:
+    """
+    The room for the prompt in a model's context window.
+
+    :param count_tokens: Callable returning the number of tokens of a text, e.g. the
+        model's tokenizer or :func:`estimate_tokens`.
+    :param context_size: Size of the context window in tokens.
+    :type context_size: int
+    :param max_tokens: Tokens reserved for the generated text.
+    :type max_tokens: int
+
+    Example
+    -------
+    >>> budget = TokenBudget(estimate_tokens, context_size=4096, max_tokens=400)
+    >>> budget.prompt_tokens
+    3632
+    >>> budget.fits("Please break down the conversation into a list of facts.")
+    True
+    """
+
+    def __init__(self, count_tokens, context_size, max_tokens):
+        self.count_tokens = count_tokens
+        self.context_size = context_size
+        self.max_tokens = max_tokens
+
+    @property
+    def prompt_tokens(self):
+        """
+        Largest prompt that leaves room for the generated text.
+        """
+        return self.context_size - self.max_tokens - TEMPLATE_MARGIN_TOKENS
+
+    def fits(self, prompt):
+        """
+        Whether a prompt fits in the context window next to the generated text.
+        """
+        return within_tokens(prompt, self.count_tokens, self.prompt_tokens)
+
+    def room_for(self, *instructions):
+        """
+        Tokens left for the text inserted between instructions.
+
+        :param instructions: The fixed parts of the prompt.
+        :return: The number of tokens, at least 1.
+        :rtype: int
+        """
+        used = sum(self.count_tokens(text) for text in instructions if text)
+        return max(1, self.prompt_tokens - used)
+
+
+def split_into_windows(text, count_tokens, window_tokens, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """
+    Split a text into windows of at most window_tokens tokens at sentence boundaries.
+
+    The last sentences of a window, up to overlap_tokens tokens, are repeated at the
+    start of the next one. Sentences longer than a window are split between words.
+
+    :param text: The text to split, e.g. a transcript.
+    :param count_tokens: Callable returning the number of tokens of a text.
+    :param window_tokens: Largest window in tokens.
+    :param overlap_tokens: Tokens repeated between consecutive windows.
+    :return: The windows, in order. A single window holding the text if it fits.
+    :rtype: list[str]
+    """
+    if within_tokens(text, count_tokens, window_tokens):
+        return [text]
+    # The overlap must leave room for new text in every window
+    overlap_tokens = min(overlap_tokens, window_tokens // 4)
+
+    # Tuples of a sentence, its token count and the separator that followed it
+    units = []
+    parts = _SENTENCE_END.split(text)
+    for sentence, separator in zip(parts[::2], parts[1::2] + [""]):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        separator = "\n" if "\n" in separator else " "
+        tokens = count_tokens(sentence)
+        if tokens <= window_tokens:
+            units.append((sentence, tokens, separator))
+        else:
+            pieces = _split_words(sentence, count_tokens, window_tokens)
+            units.extend((piece, piece_tokens, " ") for piece, piece_tokens in pieces[:-1])
+            units.append(pieces[-1] + (separator,))
+
+    windows = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        tokens = unit[1]
+        # +1 for the separator joining the units
+        if current and current_tokens + tokens + 1 > window_tokens:
+            windows.append(_join(current))
+            # Carry the last units over to the next window
+            overlap = []
+            overlap_size = 0
+            for carried in reversed(current):
+                carried_tokens = carried[1]
+                if overlap_size + carried_tokens + 1 > overlap_tokens or overlap_size + carried_tokens + tokens + 2 > window_tokens:
+                    break
+                overlap.insert(0, carried)
+                overlap_size += carried_tokens + 1
+            current = overlap
+            current_tokens = overlap_size
+        current.append(unit)
+        current_tokens += tokens + 1
+    if current:
+        windows.append(_join(current))
+    return windows
+
+
+def _join(units):
+    return "".join(sentence + separator for sentence, _, separator in units).strip()
+
+
+def _split_words(sentence, count_tokens, window_tokens):
+    # Words are counted one at a time, the sum is close to the count of the joined words
+    pieces = []
+    words = []
+    piece_tokens = 0
+    for word in sentence.split():
+        tokens = count_tokens(" " + word)
+        if words and piece_tokens + tokens > window_tokens:
+            pieces.append((" ".join(words), piece_tokens))
+            words = []
+            piece_tokens = 0
+        words.append(word)
+        piece_tokens += tokens
+    if words:
+        pieces.append((" ".join(words), piece_tokens))
+    return pieces
+
+
+def extract_facts(transcript, generate, budget, instructions, target_tokens=None, max_parallel=1,
+                  overlap_tokens=DEFAULT_OVERLAP_TOKENS, label="Extracting facts"):
+    """
+    Extract the facts of a transcript, splitting it when it does not fit in the context window.
+
+    A transcript that fits is sent in a single prompt. Otherwise facts are extracted
+    from overlapping windows of it and merged by :func:`merge_facts`.
+
+    :param transcript: The transcript.
+    :param generate: Callable generating the response to a prompt, called with the
+        prompt and the label of the stage.
+    :param budget: The TokenBudget of the model.
+    :param instructions: The fact extraction prompt placed before the transcript.
+    :param target_tokens: Most tokens the merged facts may take, e.g. the room in the
+        prompt of the note. Defaults to the room next to the instructions.
+    :param max_parallel: Windows processed at the same time, 1 for the local model.
+    :param overlap_tokens: Tokens repeated between consecutive windows.
+    :param label: Label of the stage shown with the progress.
+    :return: The facts.
+    :rtype: str
+    """
+    windows = split_into_windows(transcript, budget.count_tokens, budget.room_for(instructions), overlap_tokens)
+    if len(windows) == 1:
+        return generate(f"{instructions} {transcript}", label)
+
+    print(f"Transcript of {budget.count_tokens(transcript)} tokens exceeds the {budget.prompt_tokens} token "
+          f"prompt budget, extracting facts from {len(windows)} windows")
+    prompts = [f"{instructions} {window}" for window in windows]
+    labels = [f"{label} ({index} of {len(windows)})" for index in range(1, len(windows) + 1)]
+    fact_lists = _generate_all(generate, prompts, labels, max_parallel)
+    return merge_facts(fact_lists, generate, budget, target_tokens or budget.room_for(instructions), max_parallel)
+
+
+def merge_facts(fact_lists, generate, budget, target_tokens, max_parallel=1):
+    """
+    Merge lists of facts until they fit in target_tokens tokens.
+
+    Consecutive lists are grouped as long as a group fits in one merge prompt, and each
+    group is merged by the model. This is repeated until the joined lists fit.
+
+    :param fact_lists: The lists of facts, in the order of the transcript.
+    :param generate: Callable generating the response to a prompt and a label.
+    :param budget: The TokenBudget of the model.
+    :param target_tokens: Most tokens the merged facts may take.
+    :param max_parallel: Groups merged at the same time.
+    :return: The merged facts.
+    :rtype: str
+    """
+    room = budget.room_for(MERGE_FACTS_PROMPT)
+    round_number = 1
+    while budget.count_tokens("\n\n".join(fact_lists)) > target_tokens and len(fact_lists) > 1:
+        groups = []
+        for facts in fact_lists:
+            if groups and budget.count_tokens("\n\n".join(groups[-1] + [facts])) <= room:
+                groups[-1].append(facts)
+            else:
+                groups.append([facts])
+        if len(groups) == len(fact_lists):
+            # No two lists fit in one prompt, merging would not make progress
+            break
+        prompts = [MERGE_FACTS_PROMPT + "\n\n".join(group) for group in groups]
+        labels = [f"Merging facts (round {round_number}, {index} of {len(groups)})" for index in range(1, len(groups) + 1)]
+        fact_lists = _generate_all(generate, prompts, labels, max_parallel)
+        round_number += 1
+
+    merged = "\n\n".join(fact_lists)
+    if budget.count_tokens(merged) > target_tokens:
+        print(f"The facts take {budget.count_tokens(merged)} tokens, more than the {target_tokens} left for them")
+    return merged
+
+
+def _generate_all(generate, prompts, labels, max_parallel):
+    if max_parallel <= 1 or len(prompts) == 1:
+        return [generate(prompt, label) for prompt, label in zip(prompts, labels)]
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        return list(pool.map(generate, prompts, labels))
@@ -0,0 +1,225 @@
+"""
+Progress reporting for long running transcription and note generation jobs.
+
+Speech-to-text engines and LLM backends publish the amount of work done (audio seconds
+decoded or tokens generated) into a :class:`ProgressChannel`. The UI polls the channel
+to render percent complete, the measured rate and an ETA.
+"""
+
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+UNIT_SECONDS = "s"
+UNIT_TOKENS = "tokens"
+
+# Whisper reports its progress in mel frames, 100 frames per second of audio
+WHISPER_FRAMES_PER_SECOND = 100
+
+
+class ProgressChannel:
+    """
+    Thread-safe progress channel shared between a worker and the UI.
+
+    Workers call :meth:`start` when a stage begins, :meth:`update` as work completes and
+    :meth:`finish` at the end. Readers call :meth:`snapshot` at any time.
+
+    Example
+    -------
+    >>> channel = ProgressChannel()
+    >>> channel.start("Transcribing", total=60.0, unit=UNIT_SECONDS)
+    >>> channel.update(advance=30.0)
+    >>> channel.snapshot()["percent"]
+    50.0
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._label = ""
+        self._unit = UNIT_SECONDS
+        self._total = None
+        self._upper_bound = False
+        self._done = 0.0
+        self._started_at = None
+        self._finished_at = None
+
+    def start(self, label: str, total: float = None, unit: str = UNIT_SECONDS, upper_bound: bool = False):
+        """
+        Begin a new stage of work, resetting the counters.
+
+        :param label: Description of the stage, e.g. "Transcribing".
+        :type label: str
+        :param total: Total amount of work if known, None for an indeterminate stage.
+        :type total: float or None
+        :param unit: Unit of work, :data:`UNIT_SECONDS` of audio or :data:`UNIT_TOKENS`.
+        :type unit: str
+        :param upper_bound: Whether the total is only the most work the stage can take,
+            e.g. the max_tokens of a generation, which usually stops earlier.
+        :type upper_bound: bool
+        """
+        with self._lock:
+            self._label = label
+            self._unit = unit
+            self._total = total
+            self._upper_bound = upper_bound
+            self._done = 0.0
+            self._started_at = time.monotonic()
+            self._finished_at = None
+
+    def update(self, done: float = None, advance: float = None):
+        """
+        Publish progress for the current stage.
+
+        :param done: Absolute amount of work completed.
+        :type done: float or None
+        :param advance: Amount of work completed since the last update.
+        :type advance: float or None
+        """
+        with self._lock:
+            if done is not None:
+                self._done = done
+            if advance is not None:
+                self._done += advance
+
+    def finish(self):
+        """
+        Mark the current stage as complete and log the measured rate.
+        """
+        with self._lock:
+            if self._started_at is None or self._finished_at is not None:
+                return
+            self._finished_at = time.monotonic()
+
+        snapshot = self.snapshot()
+        if snapshot["unit"] == UNIT_SECONDS:
+            print(f"{snapshot['label']}: {snapshot['done']:.1f} s of audio in {snapshot['elapsed']:.1f} s ({snapshot['rate']:.2f}x real-time)")
+        else:
+            print(f"{snapshot['label']}: {int(snapshot['done'])} tokens in {snapshot['elapsed']:.1f} s ({snapshot['rate']:.2f} tokens/s)")
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current state of the channel.
+
+        :return: Dictionary with the label, unit, done, total, upper_bound (whether the
+            total is a maximum), elapsed seconds, rate (units per second), percent (None
+            if the total is unknown) and eta in seconds (None if it can not be estimated
+            yet, the longest it can take when the total is an upper bound).
+        :rtype: dict
+        """
+        with self._lock:
+            if self._started_at is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self._finished_at or time.monotonic()) - self._started_at
+
+            rate = self._done / elapsed if elapsed > 0 else 0.0
+
+            percent = None
+            eta = None
+            if self._total:
+                percent = min(100.0, 100.0 * self._done / self._total)
+                if rate > 0:
+                    eta = max(0.0, (self._total - self._done) / rate)
+
+            return {
+                "label": self._label,
+                "unit": self._unit,
+                "done": self._done,
+                "total": self._total,
+                "upper_bound": self._upper_bound,
+                "elapsed": elapsed,
+                "rate": rate,
+                "percent": percent,
+                "eta": eta,
+                "finished": self._finished_at is not None,
+            }
+
+
+# The channel and label tracking the whisper transcription running on each thread
+_whisper_tracking = threading.local()
+_whisper_hook_lock = threading.Lock()
+_whisper_hook_installed = False
+
+
+class _ChannelProgressBar:
+    """
+    Stand-in for the tqdm progress bar of a whisper transcription, forwarding its
+    updates to a channel.
+    """
+
+    def __init__(self, channel, label, total=None):
+        self.channel = channel
+        channel.start(label, total=total / WHISPER_FRAMES_PER_SECOND if total else None, unit=UNIT_SECONDS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def update(self, n=1):
+        self.channel.update(advance=n / WHISPER_FRAMES_PER_SECOND)
+
+
+def _install_whisper_hook():
+    # Replaces the tqdm module of whisper.transcribe once for the life of the process.
+    # Each call picks the bar of its own thread, so concurrent transcriptions (e.g. the
+    # realtime segments and the final pass) never swap the module back and forth.
+    global _whisper_hook_installed
+    with _whisper_hook_lock:
+        if _whisper_hook_installed:
+            return
+        # whisper.transcribe is shadowed by the function of the same name, get the module itself
+        transcribe_module = importlib.import_module("whisper.transcribe")
+        original_tqdm = transcribe_module.tqdm
+
+        class _TrackingTqdmModule:
+            @staticmethod
+            def tqdm(*args, **kwargs):
+                tracking = getattr(_whisper_tracking, "current", None)
+                if tracking is None:
+                    return original_tqdm.tqdm(*args, **kwargs)
+                channel, label = tracking
+                return _ChannelProgressBar(channel, label, total=kwargs.get("total"))
+
+        transcribe_module.tqdm = _TrackingTqdmModule
+        _whisper_hook_installed = True
+
+
+@contextmanager
+def track_whisper_progress(channel: ProgressChannel, label: str = "Transcribing"):
+    """
+    Publish the progress of the openai-whisper ``transcribe`` calls made on this thread
+    into a channel.
+
+    Whisper only reports progress through a tqdm progress bar, so its bar is replaced by
+    one that forwards the updates of the tracked thread to the channel. Transcriptions
+    on other threads keep their normal bar.
+
+    :param channel: The channel to publish into.
+    :type channel: ProgressChannel
+    :param label: Label for the transcription stage.
+    :type label: str
+    """
+    _install_whisper_hook()
+    previous = getattr(_whisper_tracking, "current", None)
+    _whisper_tracking.current = (channel, label)
+    try:
+        yield channel
+    finally:
+        _whisper_tracking.current = previous
+        channel.finish()
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Format a duration in seconds as m:ss.
+
+    :param seconds: The duration to format.
+    :type seconds: float
+    :return: The formatted duration.
+    :rtype: str
+    """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes}:{seconds:02d}"
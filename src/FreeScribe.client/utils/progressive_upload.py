@@ -0,0 +1,221 @@
+"""
+Progressive upload of a recording to the Speech2Text server while it is being made.
+
+The recorded 16 kHz samples are appended to a ``/v1/uploads`` session in the background
+every few seconds. The server decodes complete regions of the audio as they arrive, so
+when the recording stops only the last few seconds are left to upload and transcribe.
+Each append names the byte offset it starts at: an append retried after a network drop
+is applied once, and when the server reports a different offset the upload resumes
+from there.
+"""
+
+import threading
+import time
+
+import requests
+
+from utils.request_utils import DEFAULT_TIMEOUT
+from utils.transcription_jobs import (DEFAULT_POLL_INTERVAL, JobApiUnavailableError, TranscriptionJobError,
+                                      jobs_url, wait_for_job)
+
+UPLOADS_PATH = "v1/uploads"
+# Seconds between appends while recording
+DEFAULT_INTERVAL = 5
+# Largest single append, the server accepts up to 16 MiB
+MAX_APPEND_BYTES = 4 * 1024 * 1024
+# Attempts to send the rest of the audio once the recording stopped
+MAX_FINISH_ATTEMPTS = 5
+
+
+class ProgressiveUploadError(TranscriptionJobError):
+    """
+    Raised when the upload can not be completed, the caller should upload the recording instead.
+    """
+
+
+def uploads_url(endpoint):
+    """
+    URL of the progressive upload API next to a /whisperaudio endpoint.
+
+    :param endpoint: The configured Whisper endpoint, e.g. ``https://localhost:2224/whisperaudio``.
+    :type endpoint: str
+    :return: The upload API URL, e.g. ``https://localhost:2224/v1/uploads``.
+    :rtype: str
+    """
+    return jobs_url(endpoint)[:-len("v1/jobs")] + UPLOADS_PATH
+
+
+class ProgressiveUpload:
+    """
+    Streams a recording to the server's upload API while it is being recorded.
+
+    The session is created with the first append, so a recording that is abandoned
+    early costs no request.
+
+    :param endpoint: The configured Whisper endpoint.
+    :type endpoint: str
+    :param options: Optional request fields of the transcription, e.g. "language".
+    :type options: dict
+    :param interval: Seconds between appends.
+    :param kwargs: Other arguments of requests, e.g. headers and verify.
+    """
+
+    def __init__(self, endpoint, options=None, interval=DEFAULT_INTERVAL, **kwargs):
+        self.endpoint = endpoint
+        self.url = uploads_url(endpoint)
+        self.options = options or {}
+        self.interval = interval
+        self.kwargs = kwargs
+        self.upload_url = None
+        # Set when the server has no upload API or lost the upload
+        self.failed = None
+        self._lock = threading.Lock()
+        # Audio not yet confirmed by the server, starting at byte _offset
+        self._pending = bytearray()
+        self._offset = 0
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="progressive-upload", daemon=True)
+        self._thread.start()
+
+    @property
+    def offset(self):
+        """
+        Bytes of audio the server has confirmed.
+        """
+        return self._offset
+
+    def feed(self, data):
+        """
+        Queue recorded 16-bit samples for upload.
+
+        :param data: Raw 16 kHz mono 16-bit little-endian samples.
+        :type data: bytes
+        """
+        with self._lock:
+            self._pending += data
+
+    def finish(self, poll_interval=DEFAULT_POLL_INTERVAL, on_progress=None, should_cancel=None):
+        """
+        Send the rest of the recording, close the upload and wait for its transcript.
+
+        :param poll_interval: Seconds between polls of the job's status.
+        :param on_progress: Optional callable called with the seconds of audio transcribed
+            and the total seconds of audio each time the job is polled.
+        :param should_cancel: Optional callable, the transcription is abandoned when it returns True.
+        :return: The transcribed text.
+        :rtype: str
+        :raises JobApiUnavailableError: If the server has no upload API.
+        :raises ProgressiveUploadError: If the audio could not be uploaded, the caller
+            should upload the recording instead.
+        :raises TranscriptionJobError: If the transcription failed or was canceled.
+        """
+        self._stop()
+        for attempt in range(1, MAX_FINISH_ATTEMPTS + 1):
+            if self._flush() or self.failed is not None:
+                break
+            if should_cancel is not None and should_cancel():
+                self.abort()
+                raise TranscriptionJobError("Transcription canceled")
+            time.sleep(min(attempt, 5))
+        self._raise_if_failed()
+        if self._pending:
+            self.abort()
+            raise ProgressiveUploadError("Could not upload the rest of the recording")
+
+        headers = dict(self.kwargs.get("headers") or {}, **{"Upload-Offset": str(self._offset)})
+        kwargs = dict(self.kwargs, headers=headers)
+        for attempt in range(1, MAX_FINISH_ATTEMPTS + 1):
+            try:
+                response = requests.post(self.upload_url + "/finish", timeout=DEFAULT_TIMEOUT, **kwargs)
+                break
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A finish whose response was lost is answered with the same job
+                if attempt == MAX_FINISH_ATTEMPTS:
+                    self.abort()
+                    raise ProgressiveUploadError(f"Could not finish the upload: {e}")
+                time.sleep(min(attempt, 5))
+        if response.status_code in (404, 409):
+            self.abort()
+            raise ProgressiveUploadError(f"The server could not finish the upload: {response.text}")
+        response.raise_for_status()
+        job = response.json()
+        print(f"Finished progressive upload of {self._offset} bytes as transcription job {job['id']}")
+
+        try:
+            return wait_for_job(f"{jobs_url(self.endpoint)}/{job['id']}", job, poll_interval, on_progress,
+                                should_cancel, **self.kwargs)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """
+        Stop uploading and remove the upload from the server.
+        """
+        self._stop()
+        if self.upload_url is None:
+            return
+        try:
+            requests.delete(self.upload_url, timeout=DEFAULT_TIMEOUT, **self.kwargs)
+        except requests.RequestException as e:
+            print(f"Failed to delete progressive upload: {e}")
+        self.upload_url = None
+
+    def _stop(self):
+        self._closed.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            if self.failed is not None:
+                return
+            self._flush()
+
+    def _flush(self):
+        # Send the pending audio, returns whether all of it was confirmed
+        try:
+            if self.upload_url is None and not self._create():
+                return False
+            while self.failed is None:
+                with self._lock:
+                    offset = self._offset
+                    chunk = bytes(self._pending[:MAX_APPEND_BYTES])
+                if not chunk:
+                    return True
+                headers = dict(self.kwargs.get("headers") or {}, **{
+                    "Upload-Offset": str(offset), "Content-Type": "application/octet-stream"})
+                response = requests.patch(self.upload_url, data=chunk, timeout=DEFAULT_TIMEOUT,
+                                          **dict(self.kwargs, headers=headers))
+                if response.status_code in (200, 409):
+                    # 409: the server has a different offset, resume from there
+                    self._confirm(response.json()["offset"])
+                elif response.status_code == 404:
+                    self.failed = ProgressiveUploadError("The server no longer has the upload")
+                else:
+                    response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Progressive upload failed ({e}), retrying")
+        return False
+
+    def _create(self):
+        response = requests.post(self.url, json=self.options, timeout=DEFAULT_TIMEOUT, **self.kwargs)
+        if response.status_code in (404, 405):
+            self.failed = JobApiUnavailableError(f"The server has no upload API at {self.url}")
+            return False
+        response.raise_for_status()
+        self.upload_url = f"{self.url}/{response.json()['id']}"
+        return True
+
+    def _confirm(self, offset):
+        with self._lock:
+            if offset < self._offset:
+                # The server lost audio that is no longer buffered
+                self.failed = ProgressiveUploadError(f"The server's upload went back to offset {offset}")
+                return
+            del self._pending[:offset - self._offset]
+            self._offset = offset
+
+    def _raise_if_failed(self):
+        if self.failed is not None:
+            self.abort()
+            raise self.failed
@@ -0,0 +1,115 @@
+"""
+Requests to the Speech2Text server that retry while it is busy.
+
+A server whose queue is full answers 429 (or 503 behind a proxy) with a Retry-After
+header. The request is sent again after that delay, jittered so clients rejected at
+the same time spread their retries, for up to DEFAULT_MAX_ATTEMPTS attempts.
+"""
+
+import random
+import time
+
+import requests
+
+# Connect and read timeouts of the short requests to the speech to text server, e.g.
+# polling a job or appending to an upload
+DEFAULT_TIMEOUT = (10, 600)
+# Requests waiting for a transcription only time out connecting: decoding a long
+# recording can take longer than any fixed read timeout
+TRANSCRIPTION_TIMEOUT = (10, None)
+# Retries of a request the server rejected as busy
+DEFAULT_MAX_ATTEMPTS = 5
+# Wait used when a busy response does not include a usable Retry-After header
+DEFAULT_RETRY_AFTER = 5
+MAX_RETRY_AFTER = 120
+
+
+class ServerBusyError(requests.HTTPError):
+    """
+    Raised when the server is still busy after all retries.
+    """
+
+
+def retry_after_delay(response, attempt):
+    """
+    Compute how long to wait before retrying a busy (429 / 503) response.
+
+    The server's Retry-After is honored and jittered by up to 50% so clients rejected
+    at the same time do not all retry at the same moment. Without a Retry-After the
+    delay backs off exponentially.
+
+    :param response: The busy response.
+    :type response: requests.Response
+    :param attempt: The number of the attempt that was rejected, starting at 1.
+    :type attempt: int
+    :return: Seconds to wait.
+    :rtype: float
+    """
+    return jittered_delay(response.headers.get("Retry-After"), attempt)
+
+
+def jittered_delay(retry_after, attempt):
+    """
+    Compute the wait before retrying from the server's Retry-After value.
+
+    :param retry_after: Seconds the server asked to wait, None or invalid to back off exponentially.
+    :param attempt: The number of the attempt that was rejected, starting at 1.
+    :type attempt: int
+    :return: Seconds to wait, jittered by up to 50%.
+    :rtype: float
+    """
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = DEFAULT_RETRY_AFTER * 2 ** (attempt - 1)
+    delay = min(max(delay, 0), MAX_RETRY_AFTER)
+    return delay + random.uniform(0, delay / 2)
+
+
+def post_with_backoff(url, files=None, timeout=TRANSCRIPTION_TIMEOUT, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                      on_busy=None, on_retry=None, should_cancel=None, **kwargs):
+    """
+    POST a request, retrying while the server answers that it is busy.
+
+    :param url: The URL to post to.
+    :type url: str
+    :param files: Files to upload, they are rewound before each retry.
+    :type files: dict
+    :param timeout: Connect and read timeouts passed to requests, by default no read
+        timeout as the response waits for the transcription.
+    :param max_attempts: Maximum number of attempts.
+    :type max_attempts: int
+    :param on_busy: Optional callable called with the delay in seconds when the server is busy.
+    :param on_retry: Optional callable called when the request is sent again after the delay.
+    :param should_cancel: Optional callable, retrying stops when it returns True.
+    :param kwargs: Other arguments of requests.post, e.g. headers and verify.
+    :return: The response of the last attempt.
+    :rtype: requests.Response
+    :raises ServerBusyError: If the server is still busy after the last attempt.
+    """
+    attempt = 1
+    while True:
+        response = requests.post(url, files=files, timeout=timeout, **kwargs)
+        if response.status_code not in (429, 503):
+            return response
+
+        if attempt >= max_attempts or (should_cancel is not None and should_cancel()):
+            raise ServerBusyError(f"Server busy (HTTP Status {response.status_code}), try again later", response=response)
+
+        delay = retry_after_delay(response, attempt)
+        print(f"Server busy, retrying in {delay:.1f}s (attempt {attempt} of {max_attempts})")
+        if on_busy is not None:
+            on_busy(delay)
+
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline:
+            if should_cancel is not None and should_cancel():
+                raise ServerBusyError("Request canceled while the server was busy", response=response)
+            time.sleep(max(0, min(0.5, deadline - time.monotonic())))
+
+        for f in (files or {}).values():
+            if hasattr(f, "seek"):
+                f.seek(0)
+        attempt += 1
+        if on_retry is not None:
+            on_retry()
@@ -0,0 +1,138 @@
+"""
+Streaming of generated tokens from the LLM backends.
+
+OpenAI style endpoints stream a chat completion as server-sent events when the request
+sets ``"stream": true``, the local model yields the same deltas from
+``create_chat_completion(stream=True)``. Each generation records its time to first
+token and its decoding rate in tokens per second.
+"""
+
+import collections
+import json
+import threading
+import time
+
+# Generations kept in the history
+HISTORY_SIZE = 100
+
+_history = collections.deque(maxlen=HISTORY_SIZE)
+_history_lock = threading.Lock()
+
+
+class StreamError(RuntimeError):
+    """
+    Raised when the server reports an error in the middle of a stream.
+    """
+
+
+def iter_chat_deltas(response):
+    """
+    Yield the text of each delta of a streamed chat completion.
+
+    :param response: A requests response of a ``"stream": true`` chat completion,
+        requested with ``stream=True``.
+    :return: Generator of the non-empty content strings, in order.
+    :raises StreamError: If the server sends an error event.
+    """
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            # Blank separators, comments and event names
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        event = json.loads(data)
+        if "error" in event:
+            error = event["error"]
+            raise StreamError(error.get("message", str(error)) if isinstance(error, dict) else str(error))
+        for choice in event.get("choices", []):
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                yield content
+
+
+class GenerationStats:
+    """
+    Timing of one generation: the time to its first token and its decoding rate.
+
+    Create it right before the request is sent, call :meth:`token` for every token
+    received and :meth:`finish` at the end.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self.finished_at = None
+        self.tokens = 0
+
+    def token(self, count=1):
+        """
+        Count generated tokens.
+        """
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.tokens += count
+
+    def finish(self):
+        """
+        Mark the end of the generation.
+        """
+        self.finished_at = time.monotonic()
+
+    @property
+    def time_to_first_token(self):
+        """
+        Seconds from the request to the first token, None if no token was generated.
+        """
+        return None if self.first_token_at is None else self.first_token_at - self.started
+
+    @property
+    def tokens_per_second(self):
+        """
+        Decoding rate after the first token, None if it can not be measured.
+        """
+        if self.first_token_at is None or self.finished_at is None or self.tokens < 2:
+            return None
+        elapsed = self.finished_at - self.first_token_at
+        return (self.tokens - 1) / elapsed if elapsed > 0 else None
+
+    def summary(self):
+        """
+        One line description of the generation for the log.
+        """
+        if self.time_to_first_token is None:
+            return f"{self.label}: no tokens generated"
+        text = f"{self.label}: first token after {self.time_to_first_token:.2f}s, {self.tokens} tokens"
+        if self.tokens_per_second is not None:
+            text += f" at {self.tokens_per_second:.1f} tokens/s"
+        return text
+
+
+def record_generation(stats, backend):
+    """
+    Add a finished generation to the history and print its timing.
+
+    :param stats: The GenerationStats of the generation.
+    :param backend: Name of the backend that generated it, e.g. "local" or "api".
+    """
+    entry = {
+        "label": stats.label,
+        "backend": backend,
+        "time_to_first_token": stats.time_to_first_token,
+        "tokens": stats.tokens,
+        "tokens_per_second": stats.tokens_per_second,
+    }
+    with _history_lock:
+        _history.append(entry)
+    print(f"{stats.summary()} ({backend})")
+
+
+def generation_history():
+    """
+    The timing of recent generations, oldest first.
+
+    :rtype: list[dict]
+    """
+    with _history_lock:
+        return list(_history)
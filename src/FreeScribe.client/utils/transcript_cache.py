@@ -0,0 +1,197 @@
+"""
+Content-addressed on-disk cache for speech-to-text transcripts.
+
+Entries are keyed by a SHA-256 of the audio bytes combined with the engine, model
+and transcription parameters, so re-uploading the same recording or retrying after
+an LLM failure returns the previous transcript instead of transcribing again.
+
+The cache is safe to share between processes: entries are written atomically with
+``os.replace`` and eviction runs under a file lock. Least recently used entries are
+evicted once the total size exceeds the configured budget.
+
+Entries hold the plain text of the transcript, so the cache is only used when the user
+enables it. The directory is created by the first entry stored.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+from filelock import FileLock, Timeout
+
+from utils.file_utils import get_resource_path
+
+DEFAULT_CACHE_DIR_NAME = "transcript_cache"
+DEFAULT_MAX_SIZE_BYTES = 256 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+ENTRY_SUFFIX = ".json"
+LOCK_FILE_NAME = ".lock"
+LOCK_TIMEOUT = 5
+
+
+class TranscriptCache:
+    """
+    On-disk LRU cache mapping audio content to transcribed text.
+
+    :param cache_dir: Directory holding the cache entries. Defaults to a folder in the user data dir.
+    :type cache_dir: str or None
+    :param max_size_bytes: Total size budget for the cache entries.
+    :type max_size_bytes: int
+
+    :ivar hits: Number of lookups answered from the cache in this process.
+    :type hits: int
+    :ivar misses: Number of lookups that were not in the cache in this process.
+    :type misses: int
+    :ivar evictions: Number of entries evicted by this process.
+    :type evictions: int
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES):
+        self.cache_dir = cache_dir or get_resource_path(DEFAULT_CACHE_DIR_NAME)
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+        self._file_lock = FileLock(os.path.join(self.cache_dir, LOCK_FILE_NAME), timeout=LOCK_TIMEOUT)
+
+    @staticmethod
+    def make_key(audio_path: str, engine: str, model: str, **params) -> str:
+        """
+        Build the cache key for an audio file and the settings used to transcribe it.
+
+        :param audio_path: Path to the audio file.
+        :type audio_path: str
+        :param engine: Name of the speech-to-text engine (e.g. local whisper or the remote endpoint).
+        :type engine: str
+        :param model: Name of the model used by the engine.
+        :type model: str
+        :param params: Any additional transcription parameters that affect the output.
+        :return: Hex digest identifying the audio and transcription settings.
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        with open(audio_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        settings = json.dumps({"engine": engine, "model": model, "params": params}, sort_keys=True)
+        digest.update(settings.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a transcript in the cache.
+
+        A hit refreshes the entry's modification time so it is evicted last.
+
+        :param key: Cache key from :meth:`make_key`.
+        :type key: str
+        :return: The cached transcript, or None on a miss.
+        :rtype: str or None
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = json.load(f)["text"]
+            os.utime(path, None)
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            # A concurrent eviction or a half-written entry from a crashed process is just a miss
+            self._record("misses")
+            return None
+
+        self._record("hits")
+        return text
+
+    def put(self, key: str, text: str, **metadata):
+        """
+        Store a transcript in the cache and evict old entries if over budget.
+
+        :param key: Cache key from :meth:`make_key`.
+        :type key: str
+        :param text: The transcript to store.
+        :type text: str
+        :param metadata: Extra information stored alongside the transcript.
+        """
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file and rename so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"text": text, **metadata}, f)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in its size budget.
+        """
+        try:
+            with self._file_lock:
+                entries = []
+                total_size = 0
+                for directory, _, files in os.walk(self.cache_dir):
+                    for name in files:
+                        if not name.endswith(ENTRY_SUFFIX):
+                            continue
+                        path = os.path.join(directory, name)
+                        try:
+                            stat = os.stat(path)
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, path))
+                        total_size += stat.st_size
+
+                entries.sort()
+                for _, size, path in entries:
+                    if total_size <= self.max_size_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total_size -= size
+                    self._record("evictions")
+        except Timeout:
+            # Another process is already evicting
+            pass
+
+    def clear(self):
+        """
+        Remove every entry from the cache.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        with self._file_lock:
+            for directory, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith(ENTRY_SUFFIX):
+                        try:
+                            os.remove(os.path.join(directory, name))
+                        except FileNotFoundError:
+                            pass
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters for this process.
+        """
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def _record(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _entry_path(self, key: str) -> str:
+        # Shard by the first two hex characters to keep directories small
+        return os.path.join(self.cache_dir, key[:2], key + ENTRY_SUFFIX)
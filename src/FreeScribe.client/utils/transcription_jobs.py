@@ -0,0 +1,189 @@
+"""
+Client of the Speech2Text server's asynchronous job API.
+
+Long recordings are uploaded once to ``/v1/jobs`` and the returned job is polled until
+its transcript can be fetched, instead of holding one HTTP request open for the whole
+decode. Proxies no longer time the request out, and a dropped connection while polling
+is retried without losing the transcription.
+"""
+
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+from utils.request_utils import DEFAULT_TIMEOUT, post_with_backoff
+
+JOBS_PATH = "v1/jobs"
+DEFAULT_POLL_INTERVAL = 2
+# Consecutive failed polls tolerated before giving up, e.g. while the network is down
+MAX_POLL_FAILURES = 30
+# Seconds a job may stay in the same status and progress before it is abandoned, e.g.
+# a job stuck running on a server process that died. Long enough for a queued job to
+# wait behind the transcriptions of other clients.
+STALLED_JOB_TIMEOUT = 15 * 60
+# Added to the stall timeout per second of audio: a server that decodes the audio in
+# one piece only reports progress once it is done
+STALLED_JOB_SECONDS_PER_AUDIO_SECOND = 2
+# Statuses of a proxy that can not reach the server, the job itself is unaffected
+TRANSIENT_STATUSES = (502, 503, 504)
+
+
+class TranscriptionJobError(RuntimeError):
+    """
+    Raised when a job fails or can no longer be followed.
+    """
+
+
+class JobApiUnavailableError(TranscriptionJobError):
+    """
+    Raised when the server does not offer the job API.
+    """
+
+
+def jobs_url(endpoint):
+    """
+    URL of the job API next to a /whisperaudio endpoint.
+
+    :param endpoint: The configured Whisper endpoint, e.g. ``https://localhost:2224/whisperaudio``.
+    :type endpoint: str
+    :return: The job API URL, e.g. ``https://localhost:2224/v1/jobs``.
+    :rtype: str
+    """
+    parts = urlsplit(endpoint)
+    path = parts.path.rstrip("/")
+    if path.endswith("whisperaudio"):
+        path = path[:-len("whisperaudio")]
+    else:
+        path += "/"
+    return urlunsplit(parts._replace(path=path + JOBS_PATH, query="", fragment=""))
+
+
+def transcribe_with_job(endpoint, files, poll_interval=DEFAULT_POLL_INTERVAL, on_busy=None, on_retry=None,
+                        on_progress=None, should_cancel=None, **kwargs):
+    """
+    Transcribe a recording through the job API: submit it, poll the job and fetch the result.
+
+    :param endpoint: The configured Whisper endpoint.
+    :type endpoint: str
+    :param files: The audio file to upload, as for requests.post.
+    :type files: dict
+    :param poll_interval: Seconds between polls of the job's status.
+    :param on_busy: Optional callable called with the delay in seconds when the server is busy.
+    :param on_retry: Optional callable called when the upload is sent again after the delay.
+    :param on_progress: Optional callable called with the seconds of audio transcribed and
+        the total seconds of audio each time the job is polled.
+    :param should_cancel: Optional callable, the job is abandoned when it returns True.
+    :param kwargs: Other arguments of requests, e.g. headers and verify.
+    :return: The transcribed text.
+    :rtype: str
+    :raises JobApiUnavailableError: If the server has no job API, the caller should fall back to /whisperaudio.
+    :raises TranscriptionJobError: If the job failed, was canceled or could not be followed.
+    """
+    url = jobs_url(endpoint)
+    try:
+        # The job is answered once uploaded, without waiting for the transcription
+        response = post_with_backoff(url, files=files, timeout=DEFAULT_TIMEOUT, on_busy=on_busy, on_retry=on_retry,
+                                     should_cancel=should_cancel, **kwargs)
+    except requests.ConnectionError as e:
+        # Servers without the job API may answer 404 and close the connection before
+        # the upload is complete
+        raise JobApiUnavailableError(f"Could not submit a job to {url}: {e}")
+    if response.status_code in (404, 405):
+        raise JobApiUnavailableError(f"The server has no job API at {url}")
+    response.raise_for_status()
+    job = response.json()
+    print(f"Submitted transcription job {job['id']}")
+    return wait_for_job(f"{url}/{job['id']}", job, poll_interval, on_progress, should_cancel, **kwargs)
+
+
+def wait_for_job(job_url, job, poll_interval=DEFAULT_POLL_INTERVAL, on_progress=None, should_cancel=None,
+                 stall_timeout=STALLED_JOB_TIMEOUT, **kwargs):
+    """
+    Poll a submitted job until it is finished, fetch its result and delete it from the server.
+
+    :param job_url: URL of the job.
+    :type job_url: str
+    :param job: The job's status as returned when it was submitted.
+    :type job: dict
+    :param poll_interval: Seconds between polls of the job's status.
+    :param on_progress: Optional callable called with the seconds of audio transcribed and
+        the total seconds of audio each time the job is polled.
+    :param should_cancel: Optional callable, the job is abandoned when it returns True.
+    :param stall_timeout: Seconds the job may stay in the same status and progress
+        before it is abandoned, plus twice the seconds of audio, None to wait as long as
+        it takes.
+    :param kwargs: Other arguments of requests, e.g. headers and verify.
+    :return: The transcribed text.
+    :rtype: str
+    :raises TranscriptionJobError: If the job failed, was canceled, stalled or could not be followed.
+    """
+    state = (job["status"], job["progress"])
+    changed_at = time.monotonic()
+    while job["status"] not in ("done", "failed"):
+        if on_progress is not None:
+            on_progress(job["progress"] * job["duration"], job["duration"])
+        if stall_timeout is not None:
+            stalled = time.monotonic() - changed_at
+            if stalled > stall_timeout + STALLED_JOB_SECONDS_PER_AUDIO_SECOND * job["duration"]:
+                _delete(job_url, kwargs)
+                raise TranscriptionJobError(f"Transcription job made no progress for {stalled / 60:.0f} minutes")
+        _wait(poll_interval, should_cancel, job_url, kwargs)
+        job = _get_json(job_url, kwargs)
+        if (job["status"], job["progress"]) != state:
+            state = (job["status"], job["progress"])
+            changed_at = time.monotonic()
+
+    if job["status"] == "failed":
+        raise TranscriptionJobError(f"Transcription job failed: {job.get('error')}")
+    if on_progress is not None:
+        on_progress(job["duration"], job["duration"])
+
+    result = _get_json(job_url + "/result", kwargs)
+    try:
+        # The result has been fetched, the server does not need to keep it
+        requests.delete(job_url, timeout=DEFAULT_TIMEOUT, **kwargs)
+    except requests.RequestException as e:
+        print(f"Failed to delete transcription job {job['id']}: {e}")
+    return result["text"]
+
+
+def _wait(delay, should_cancel, job_url, kwargs):
+    deadline = time.monotonic() + delay
+    while time.monotonic() < deadline:
+        if should_cancel is not None and should_cancel():
+            _delete(job_url, kwargs)
+            raise TranscriptionJobError("Transcription job canceled")
+        time.sleep(max(0, min(0.5, deadline - time.monotonic())))
+
+
+def _delete(job_url, kwargs):
+    # Abandon a job, the server stops keeping it
+    try:
+        requests.delete(job_url, timeout=DEFAULT_TIMEOUT, **kwargs)
+    except requests.RequestException:
+        pass
+
+
+def _get_json(url, kwargs):
+    # GET a job resource, retrying while the server or the network is unreachable
+    failures = 0
+    while True:
+        try:
+            response = requests.get(url, timeout=DEFAULT_TIMEOUT, **kwargs)
+            if response.status_code not in TRANSIENT_STATUSES:
+                break
+            error = f"HTTP Status {response.status_code}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = str(e)
+
+        failures += 1
+        if failures >= MAX_POLL_FAILURES:
+            raise TranscriptionJobError(f"Lost contact with the transcription job: {error}")
+        print(f"Polling the transcription job failed ({error}), retrying")
+        time.sleep(DEFAULT_POLL_INTERVAL * min(failures, 5))
+
+    if response.status_code == 404:
+        raise TranscriptionJobError("The transcription job no longer exists on the server")
+    response.raise_for_status()
+    return response.json()
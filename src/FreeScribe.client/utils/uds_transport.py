@@ -0,0 +1,185 @@
+"""
+Unix domain socket transport to a Speech2Text server running on the same host.
+
+Instead of uploading a WAV file as a multipart HTTP request, each transcription is
+sent as one binary frame holding a small JSON header and the raw 16 kHz PCM samples.
+Connections are kept open and reused by later requests of the same thread. The
+framing matches ``utils/uds_server.py`` of the Whisper servers.
+"""
+
+import json
+import socket
+import struct
+import threading
+import time
+import wave
+
+from utils.request_utils import DEFAULT_MAX_ATTEMPTS, TRANSCRIPTION_TIMEOUT, ServerBusyError, jittered_delay
+
+MAGIC = b"FSW1"
+REQUEST_HEADER = struct.Struct("!4sIQ")
+RESPONSE_HEADER = struct.Struct("!4sHI")
+SAMPLE_RATE = 16000
+
+
+class UnixSocketError(RuntimeError):
+    """
+    Raised when the server answers a frame with an error.
+    """
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def unix_sockets_supported():
+    """
+    Whether this platform supports Unix domain sockets.
+
+    :rtype: bool
+    """
+    return hasattr(socket, "AF_UNIX")
+
+
+def read_pcm_wav(path):
+    """
+    Read the samples of a WAV file that can be sent without conversion.
+
+    :param path: Path of the WAV file.
+    :type path: str
+    :return: The raw 16-bit samples if the file is 16 kHz mono 16-bit PCM, None otherwise.
+    :rtype: bytes or None
+    """
+    try:
+        with wave.open(path, 'rb') as wf:
+            if wf.getframerate() != SAMPLE_RATE or wf.getnchannels() != 1 or wf.getsampwidth() != 2:
+                return None
+            return wf.readframes(wf.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+
+class UnixSocketTranscriber:
+    """
+    Sends transcription requests to the server's Unix domain socket.
+
+    :param path: Path of the server's socket.
+    :type path: str
+    :param timeout: Seconds to wait for a response, None to wait as long as the
+        transcription takes.
+    :type timeout: float or None
+    """
+
+    def __init__(self, path, timeout=TRANSCRIPTION_TIMEOUT[1]):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def transcribe(self, pcm, encoding="s16le", options=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                   on_busy=None, on_retry=None, should_cancel=None):
+        """
+        Transcribe raw 16 kHz mono samples, retrying while the server is busy.
+
+        :param pcm: The raw samples.
+        :type pcm: bytes
+        :param encoding: Encoding of the samples, "s16le" or "f32le".
+        :param options: Optional request fields, e.g. "language".
+        :type options: dict
+        :param max_attempts: Maximum number of attempts.
+        :param on_busy: Optional callable called with the delay in seconds when the server is busy.
+        :param on_retry: Optional callable called when the request is sent again after the delay.
+        :param should_cancel: Optional callable, retrying stops when it returns True.
+        :return: The transcribed text.
+        :rtype: str
+        :raises ServerBusyError: If the server is still busy after the last attempt.
+        :raises UnixSocketError: If the server rejects the request.
+        :raises OSError: If the socket can not be reached.
+        """
+        header = dict(options or {}, sample_rate=SAMPLE_RATE, encoding=encoding)
+        attempt = 1
+        while True:
+            status, body = self._exchange(header, pcm)
+            if status == 200:
+                return body["text"]
+            if status not in (429, 503):
+                raise UnixSocketError(f"Error (Status {status}): {body.get('error')}", status)
+
+            if attempt >= max_attempts or (should_cancel is not None and should_cancel()):
+                raise ServerBusyError(f"Server busy (Status {status}), try again later")
+
+            delay = jittered_delay(body.get("retry_after"), attempt)
+            print(f"Server busy, retrying in {delay:.1f}s (attempt {attempt} of {max_attempts})")
+            if on_busy is not None:
+                on_busy(delay)
+
+            deadline = time.monotonic() + delay
+            while time.monotonic() < deadline:
+                if should_cancel is not None and should_cancel():
+                    raise ServerBusyError("Request canceled while the server was busy")
+                time.sleep(max(0, min(0.5, deadline - time.monotonic())))
+
+            attempt += 1
+            if on_retry is not None:
+                on_retry()
+
+    def close(self):
+        """
+        Close the connection of the calling thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            self._local.connection = None
+            connection.close()
+
+    def _exchange(self, header, pcm):
+        header = json.dumps(header).encode()
+        frame = REQUEST_HEADER.pack(MAGIC, len(header), len(pcm))
+
+        # A kept-alive connection may have been closed by a server restart, retry once
+        # on a fresh connection
+        for reuse in (True, False):
+            connection = getattr(self._local, "connection", None) if reuse else None
+            fresh = connection is None
+            if fresh:
+                connection = self._connect()
+            try:
+                connection.sendall(frame)
+                connection.sendall(header)
+                connection.sendall(pcm)
+                status, body = self._read_response(connection)
+            except (ConnectionError, EOFError):
+                self.close()
+                if fresh:
+                    raise
+                continue
+            except (OSError, UnixSocketError):
+                self.close()
+                raise
+            return status, body
+
+    def _connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect(self.path)
+        except OSError:
+            connection.close()
+            raise
+        self._local.connection = connection
+        return connection
+
+    def _read_response(self, connection):
+        magic, status, length = RESPONSE_HEADER.unpack(self._read_exactly(connection, RESPONSE_HEADER.size))
+        if magic != MAGIC:
+            raise UnixSocketError("Invalid response from the server", 502)
+        return status, json.loads(self._read_exactly(connection, length))
+
+    @staticmethod
+    def _read_exactly(connection, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise EOFError("The server closed the connection")
+            data += chunk
+        return bytes(data)
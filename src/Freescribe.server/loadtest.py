@@ -0,0 +1,376 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Load test and benchmark client for the Whisper servers.
+
+Replays a local corpus of WAV files, or synthetic speech-like audio, against a running
+server and reports the throughput, the p50/p95/p99 latency and the error rates as a
+summary table and optionally as JSON. Only the standard library is used and nothing
+leaves the machine, so it runs fully offline against a locally launched server.
+
+Two kinds of load are supported:
+
+- closed loop (default): --concurrency clients each send their next request as soon
+  as the previous one is answered.
+- open loop (--rate): requests arrive at the given average rate (Poisson arrivals)
+  whether or not earlier ones are done, up to --concurrency in flight. Latency is
+  measured from the scheduled arrival so queueing in the client is not hidden.
+
+With --sweep or several --rate values the test is repeated at each level and a table
+of the aggregate throughput against the request latency is printed, e.g. to compare a
+server with and without --batch-size.
+
+Every request carries slightly different audio so the server's result cache does not
+answer repeated uploads.
+
+Example:
+    python loadtest.py --url http://localhost:8000/whisperaudio --concurrency 4 --requests 5
+    python loadtest.py --audio-seconds 3 --sweep 1,2,4,8,16
+    python loadtest.py --corpus ./recordings --rate 0.5,1,2 --duration 120 --json results.json
+"""
+
+import argparse
+import glob
+import io
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import struct
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+SAMPLE_RATE = 16000
+
+
+def synthetic_wav(seconds, seed=0):
+    """
+    Generate speech-like audio: bursts of harmonic tones separated by short pauses.
+
+    :param seconds: Duration of the audio.
+    :param seed: Seed for the random generator so runs are repeatable.
+    :return: The audio as 16 kHz mono 16-bit WAV bytes.
+    """
+    rng = random.Random(seed)
+    samples = []
+    while len(samples) < seconds * SAMPLE_RATE:
+        # A "syllable" of 100-300 ms with a random fundamental
+        length = int(rng.uniform(0.1, 0.3) * SAMPLE_RATE)
+        pitch = rng.uniform(100, 250)
+        for i in range(length):
+            t = i / SAMPLE_RATE
+            envelope = math.sin(math.pi * i / length)
+            value = sum(math.sin(2 * math.pi * pitch * h * t) / h for h in (1, 2, 3))
+            samples.append(int(8000 * envelope * value / 2))
+        # Pause between syllables
+        samples.extend([0] * int(rng.uniform(0.02, 0.2) * SAMPLE_RATE))
+
+    samples = samples[:int(seconds * SAMPLE_RATE)]
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(struct.pack(f"<{len(samples)}h", *samples))
+    return buffer.getvalue()
+
+
+class AudioClip:
+    """
+    A WAV file held in memory.
+
+    :param name: Name shown in errors, e.g. the file name.
+    :param data: The WAV file bytes.
+    """
+
+    def __init__(self, name, data):
+        self.name = name
+        with wave.open(io.BytesIO(data), 'rb') as wf:
+            self.params = wf.getparams()
+            self.frames = wf.readframes(wf.getnframes())
+        self.seconds = self.params.nframes / self.params.framerate
+
+    def unique_wav(self, counter):
+        """
+        Returns the clip with its last sample replaced by the counter, so the server's
+        result cache sees different audio for every request.
+        """
+        frame_size = self.params.sampwidth * self.params.nchannels
+        frames = self.frames
+        if len(frames) >= frame_size:
+            marker = counter.to_bytes(8, "little")[:frame_size].ljust(frame_size, b"\0")
+            frames = frames[:-frame_size] + marker
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wf:
+            wf.setparams(self.params)
+            wf.writeframes(frames)
+        return buffer.getvalue()
+
+
+def load_corpus(path):
+    """
+    Load every WAV file under a directory, or a single WAV file.
+
+    :return: The clips sorted by file name.
+    :rtype: list[AudioClip]
+    """
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, "**", "*.wav"), recursive=True))
+    else:
+        files = [path]
+
+    clips = []
+    for file in files:
+        with open(file, 'rb') as f:
+            data = f.read()
+        try:
+            clips.append(AudioClip(os.path.basename(file), data))
+        except (wave.Error, EOFError) as e:
+            print(f"Skipping {file}: {e}", file=sys.stderr)
+    if not clips:
+        raise SystemExit(f"No usable WAV files found in {path}")
+    return clips
+
+
+def encode_multipart(field_name, filename, data):
+    """
+    Encode a single file as a multipart/form-data body.
+
+    :return: Tuple of the body and the content type header.
+    """
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f"Content-Disposition: form-data; name=\"{field_name}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: audio/wav\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def send_request(url, audio, timeout, field_name="audio", headers=None):
+    """
+    Upload one audio file.
+
+    :return: Tuple of (seconds until the response was read, error kind or None). The
+        error kind is the HTTP status code, or the exception name for network errors.
+    """
+    body, content_type = encode_multipart(field_name, "audio.wav", audio)
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type, **(headers or {})},
+                                     method="POST")
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+        return time.monotonic() - start, None
+    except urllib.error.HTTPError as e:
+        return time.monotonic() - start, str(e.code)
+    except Exception as e:
+        return time.monotonic() - start, e.__class__.__name__
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class _Recorder:
+    # Collects the outcome of every request of a run from the client threads
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.audio_seconds = 0.0
+        self.errors = {}
+
+    def record(self, latency, error, seconds):
+        with self.lock:
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            else:
+                self.latencies.append(latency)
+                self.audio_seconds += seconds
+
+    def summary(self, mode, level, duration):
+        latencies = self.latencies
+        failed = sum(self.errors.values())
+        total = len(latencies) + failed
+        return {
+            "mode": mode,
+            "concurrency" if mode == "closed" else "rate": level,
+            "requests": total,
+            "succeeded": len(latencies),
+            "errors": failed,
+            "error_rate": failed / total if total else 0.0,
+            "errors_by_kind": dict(sorted(self.errors.items())),
+            "duration": duration,
+            "throughput": len(latencies) / duration if duration else 0.0,
+            "audio_seconds_per_second": self.audio_seconds / duration if duration else 0.0,
+            "latency_mean": statistics.mean(latencies) if latencies else 0.0,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99),
+            "latency_max": max(latencies) if latencies else 0.0,
+        }
+
+
+class _Workload:
+    # Hands out the clips in turn, each with unique audio
+
+    def __init__(self, clips):
+        self._clips = itertools.cycle(clips)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            clip = next(self._clips)
+            counter = next(self._counter)
+        return clip, clip.unique_wav(counter)
+
+
+def run_load_test(url, concurrency, requests_per_client, clips, timeout, field_name="audio", headers=None):
+    """
+    Run a closed-loop load test: each client sends its next request once the previous one is answered.
+
+    :param clips: The AudioClips to send in turn.
+    :return: Dictionary with the throughput, latency and error results.
+    """
+    recorder = _Recorder()
+    workload = _Workload(clips)
+
+    def client():
+        for _ in range(requests_per_client):
+            clip, audio = workload.next()
+            latency, error = send_request(url, audio, timeout, field_name, headers)
+            recorder.record(latency, error, clip.seconds)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary("closed", concurrency, time.monotonic() - start)
+
+
+def run_open_loop(url, rate, duration, max_in_flight, clips, timeout, field_name="audio", headers=None, seed=0):
+    """
+    Run an open-loop load test: requests arrive at an average rate with exponential gaps.
+
+    :param rate: Average arrivals per second.
+    :param duration: Seconds during which requests arrive.
+    :param max_in_flight: Maximum number of requests sent at once, later arrivals wait.
+    :return: Dictionary with the throughput, latency and error results.
+    """
+    recorder = _Recorder()
+    workload = _Workload(clips)
+    rng = random.Random(seed)
+
+    def arrival(scheduled):
+        clip, audio = workload.next()
+        _, error = send_request(url, audio, timeout, field_name, headers)
+        # Measured from the scheduled arrival so waiting for a free client slot counts
+        recorder.record(time.monotonic() - scheduled, error, clip.seconds)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        scheduled = start
+        while True:
+            scheduled += rng.expovariate(rate)
+            if scheduled - start > duration:
+                break
+            time.sleep(max(0.0, scheduled - time.monotonic()))
+            executor.submit(arrival, scheduled)
+    return recorder.summary("open", rate, time.monotonic() - start)
+
+
+def print_table(results):
+    """
+    Print the throughput, latency and error rate of each run as a table.
+    """
+    level_name = "clients" if results[0]["mode"] == "closed" else "req/s in"
+    print(f"{level_name:>9} {'reqs':>6} {'req/s':>8} {'audio s/s':>10} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'errors':>8}")
+    for result in results:
+        level = result.get("concurrency", result.get("rate"))
+        print(f"{level:>9g} {result['requests']:>6} {result['throughput']:>8.2f} {result['audio_seconds_per_second']:>10.1f} "
+              f"{result['latency_p50']:>8.3f} {result['latency_p95']:>8.3f} {result['latency_p99']:>8.3f} "
+              f"{result['error_rate']:>7.1%}")
+    for result in results:
+        if result["errors_by_kind"]:
+            kinds = ", ".join(f"{kind}: {count}" for kind, count in result["errors_by_kind"].items())
+            level = result.get("concurrency", result.get("rate"))
+            print(f"Errors at {level:g}: {kinds}")
+
+
+def _parse_levels(text, cast):
+    return [cast(level) for level in text.split(",") if level.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a Whisper server with concurrent clients.")
+    parser.add_argument('--url', default="http://localhost:8000/whisperaudio", help="Endpoint to test.")
+    parser.add_argument('--corpus', help="WAV file or directory of WAV files to replay. Synthetic audio is used if not set.")
+    parser.add_argument('--audio-seconds', type=float, default=5.0, help="Length of the synthetic audio.")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="Closed loop: number of concurrent clients. Open loop: maximum requests in flight.")
+    parser.add_argument('--requests', type=int, default=5, help="Closed loop: requests sent by each client.")
+    parser.add_argument('--sweep', help="Closed loop: comma separated concurrency levels to run one after the other, e.g. 1,2,4,8.")
+    parser.add_argument('--rate', help="Open loop: average arrivals per second, or comma separated rates to sweep, e.g. 0.5,1,2.")
+    parser.add_argument('--duration', type=float, default=60.0, help="Open loop: seconds during which requests arrive.")
+    parser.add_argument('--timeout', type=float, default=300.0, help="Request timeout in seconds.")
+    parser.add_argument('--api-key', help="Sent as a Bearer token.")
+    parser.add_argument('--json', dest="json_path", help="Write the results as JSON to this file, '-' for stdout.")
+    args = parser.parse_args()
+
+    if args.corpus:
+        clips = load_corpus(args.corpus)
+    else:
+        clips = [AudioClip("synthetic.wav", synthetic_wav(args.audio_seconds))]
+    field_name = "file" if args.url.rstrip("/").endswith("/v1/audio/transcriptions") else "audio"
+    headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else None
+
+    results = []
+    if args.rate:
+        for rate in _parse_levels(args.rate, float):
+            results.append(run_open_loop(args.url, rate, args.duration, args.concurrency, clips, args.timeout,
+                                         field_name, headers))
+    else:
+        levels = _parse_levels(args.sweep, int) if args.sweep else [args.concurrency]
+        for level in levels:
+            results.append(run_load_test(args.url, level, args.requests, clips, args.timeout, field_name, headers))
+
+    if args.json_path:
+        report = {
+            "url": args.url,
+            "corpus": args.corpus,
+            "clips": len(clips),
+            "audio_seconds": sum(clip.seconds for clip in clips),
+            "runs": results,
+        }
+        if args.json_path == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+            return
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    print_table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Benchmark of the realtime latency while a long bulk recording is transcribed.
+
+Runs a fake Whisper server in this process: its transcribe only sleeps for the audio
+duration divided by --speed, so no model is needed and the numbers only reflect the
+scheduling of the priority classes. For each --chunk-seconds value (the server's
+--preempt-chunk-seconds) one long recording is posted to /whisperaudio in the bulk
+class, and while it is transcribed realtime segments are posted one after the other.
+The table shows the latency of the realtime segments and the time the bulk recording
+took. With 0 the bulk recording is transcribed in one go and a segment waits for all
+of it, with chunking it waits for at most one chunk.
+
+Example:
+    python priority_benchmark.py
+    python priority_benchmark.py --bulk-seconds 600 --speed 20 --chunk-seconds 0,15,30
+"""
+
+import argparse
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from loadtest import AudioClip, percentile, send_request, synthetic_wav
+from utils.audio_utils import audio_duration
+from utils.whisper_handler import WhisperRequestHandler, serve_requests
+
+
+class FakeRequestHandler(WhisperRequestHandler):
+    # Seconds of audio "transcribed" per second
+    speed = 50.0
+
+    def transcribe(self, audio, options):
+        time.sleep(audio_duration(audio) / self.speed)
+        return ""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_benchmark(chunk_seconds, bulk_audio, segment, speed, interval, timeout):
+    """
+    Transcribe one bulk recording on a fresh fake server with one worker and measure
+    the latency of the realtime segments sent meanwhile.
+
+    :param chunk_seconds: The server's --preempt-chunk-seconds.
+    :param bulk_audio: The bulk recording as WAV bytes.
+    :param segment: The realtime segment as an AudioClip.
+    :param interval: Seconds between the answer to a segment and the next one.
+    :return: Dict with the chunk seconds, realtime latencies, errors and bulk seconds.
+    """
+    FakeRequestHandler.speed = speed
+    FakeRequestHandler.preempt_chunk_seconds = chunk_seconds
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeRequestHandler)
+    server = threading.Thread(target=serve_requests, args=(httpd, FakeRequestHandler, 1, None, None, 1, 0), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/whisperaudio"
+
+    bulk = {}
+
+    def send_bulk():
+        bulk["seconds"], bulk["error"] = send_request(url, bulk_audio, timeout, headers={"X-Priority": "bulk"})
+
+    bulk_thread = threading.Thread(target=send_bulk)
+    bulk_thread.start()
+    # Wait until the bulk recording occupies the worker
+    while FakeRequestHandler.worker_pool is None or not FakeRequestHandler.worker_pool.stats()["active"]:
+        time.sleep(0.01)
+
+    latencies = []
+    errors = 0
+    counter = 0
+    while bulk_thread.is_alive():
+        latency, error = send_request(url, segment.unique_wav(counter), timeout, headers={"X-Priority": "realtime"})
+        counter += 1
+        if error:
+            errors += 1
+        else:
+            latencies.append(latency)
+        time.sleep(interval)
+    bulk_thread.join()
+
+    httpd.shutdown()
+    server.join()
+    FakeRequestHandler.worker_pool = None
+    return {"chunk_seconds": chunk_seconds, "latencies": latencies, "errors": errors,
+            "bulk_seconds": bulk["seconds"], "bulk_error": bulk["error"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the realtime latency during a bulk transcription on a fake server.")
+    parser.add_argument('--bulk-seconds', type=float, default=300.0, help="Length of the bulk recording.")
+    parser.add_argument('--segment-seconds', type=float, default=5.0, help="Length of each realtime segment.")
+    parser.add_argument('--speed', type=float, default=50.0, help="Seconds of audio the fake server transcribes per second.")
+    parser.add_argument('--chunk-seconds', default="0,30",
+                        help="Comma separated --preempt-chunk-seconds values to compare, 0 for no chunking.")
+    parser.add_argument('--interval', type=float, default=0.2, help="Seconds between realtime segments.")
+    parser.add_argument('--timeout', type=float, default=300.0, help="Request timeout in seconds.")
+    args = parser.parse_args()
+
+    bulk_audio = synthetic_wav(args.bulk_seconds)
+    segment = AudioClip("segment.wav", synthetic_wav(args.segment_seconds, seed=1))
+
+    print(f"{args.bulk_seconds:g} s bulk recording, {args.segment_seconds:g} s realtime segments, "
+          f"fake server at {args.speed:g}x real-time with 1 worker")
+    print(f"{'chunk s':>8} {'segments':>9} {'p50 s':>8} {'max s':>8} {'errors':>7} {'bulk s':>8}")
+    for chunk_seconds in [float(value) for value in args.chunk_seconds.split(",") if value.strip()]:
+        result = run_benchmark(chunk_seconds, bulk_audio, segment, args.speed, args.interval, args.timeout)
+        latencies = result["latencies"]
+        bulk = f"{result['bulk_seconds']:.2f}" if result["bulk_error"] is None else result["bulk_error"]
+        print(f"{chunk_seconds:>8g} {len(latencies):>9} {percentile(latencies, 50):>8.3f} "
+              f"{max(latencies, default=0.0):>8.3f} {result['errors']:>7} {bulk:>8}")
+
+
+if __name__ == '__main__':
+    main()
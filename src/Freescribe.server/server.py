@@ -1,53 +1,49 @@
 # Copyright (c) 2023 Braedon Hendy
 # This software is released under the GNU General Public License v3.0
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import whisper
-import cgi
-import json
 import os
-import tempfile
+
+import torch
+import whisper
+from utils.whisper_handler import WhisperRequestHandler, build_arg_parser, run_server, server_options
 
 # Initialize Whisper model
-model = whisper.load_model("medium")
-
-class RequestHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.path == '/whisperaudio':
-            ctype, pdict = cgi.parse_header(self.headers.get('content-type'))
-            if ctype == 'multipart/form-data':
-                pdict['boundary'] = bytes(pdict['boundary'], "utf-8")
-                fields = cgi.parse_multipart(self.rfile, pdict)
-                audio_data = fields.get('audio')[0]
-
-                # Save the audio file temporarily
-                with tempfile.NamedTemporaryFile(delete=False) as temp_audio_file:
-                    temp_audio_file.write(audio_data)
-                    temp_file_path = temp_audio_file.name
-
-                try:
-                    # Process the file with Whisper
-                    result = model.transcribe(temp_file_path)
-
-                    # Send response
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    response_data = json.dumps({"text": result["text"]})
-                    self.wfile.write(response_data.encode())
-                finally:
-                    # Clean up the temporary file
-                    os.remove(temp_file_path)
-            else:
-                self.send_error(400, "Invalid content type")
-        else:
-            self.send_error(404, "File not found")
-
-def run(server_class=HTTPServer, handler_class=RequestHandler, port=8000):
-    server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    print(f'Server running at http://localhost:{port}/')
-    httpd.serve_forever()
+MODEL_NAME = "medium"
+model = whisper.load_model(MODEL_NAME)
+
+class RequestHandler(WhisperRequestHandler):
+    supports_batching = True
+    model_name = MODEL_NAME
+
+    def transcribe(self, audio, options):
+        # Process the audio with Whisper
+        result = model.transcribe(audio)
+        return result["text"]
+
+    def transcribe_segments(self, audio, options):
+        result = model.transcribe(audio, language=options.get("language") or None)
+        return result["language"], result["segments"]
+
+    def transcribe_batch(self, audios, options):
+        # Pad every segment to one 30 second window and decode them in a single pass
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(audio)), model.dims.n_mels)
+            for audio in audios
+        ]).to(model.device)
+        results = whisper.decode(model, mels, whisper.DecodingOptions(fp16=model.device.type == "cuda"))
+        return [result.text for result in results]
+
+def run(handler_class=RequestHandler):
+    parser = build_arg_parser("Whisper speech to text server", device=model.device.type)
+    args = parser.parse_args()
+    if args.processes > 1 and model.device.type != "cpu":
+        parser.error("--processes is only supported when the model runs on the CPU")
+
+    def after_fork(index):
+        # The model was loaded before forking and is shared copy-on-write, split the cores between the processes
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.processes))
+
+    run_server(handler_class, after_fork=after_fork, **server_options(args))
 
 if __name__ == '__main__':
     run()
@@ -1,60 +1,93 @@
 # Copyright (c) 2023 Braedon Hendy
 # This software is released under the GNU General Public License v3.0
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from faster_whisper import WhisperModel
-import cgi
-import json
 import os
-import tempfile
-
-# Initialize Whisper model
-model_size = "medium.en"
-
-class RequestHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.path == '/whisperaudio':
-            ctype, pdict = cgi.parse_header(self.headers.get('content-type'))
-            if ctype == 'multipart/form-data':
-                pdict['boundary'] = bytes(pdict['boundary'], "utf-8")
-                fields = cgi.parse_multipart(self.rfile, pdict)
-                audio_data = fields.get('audio')[0]
-
-                # Save the audio file temporarily
-                with tempfile.NamedTemporaryFile(delete=False) as temp_audio_file:
-                    temp_audio_file.write(audio_data)
-                    temp_file_path = temp_audio_file.name
-
-                try:
-                    # Process the file with Whisper
-                    model = WhisperModel(model_size, device="cuda", compute_type="float16")
-                    # or run on GPU with INT8
-                    # model = WhisperModel(model_size, device="cuda", compute_type="int8_float16")
-                    # or run on CPU with INT8
-                    # model = WhisperModel(model_size, device="cpu", compute_type="int8")
-                    segments, info = model.transcribe(temp_file_path, beam_size=5)
-                    print("Detected language '%s' with probability %f" % (info.language, info.language_probability))
-                    transcription = "".join(segment.text for segment in segments)
-
-                    # Send response
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    response_data = json.dumps({"text": transcription})
-                    self.wfile.write(response_data.encode())
-                finally:
-                    # Clean up the temporary file
-                    os.remove(temp_file_path)
+from contextlib import ExitStack
+
+import numpy as np
+from faster_whisper import WhisperModel
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+from utils.model_registry import add_model_registry_args, registry_from_args
+from utils.whisper_handler import WhisperRequestHandler, build_arg_parser, run_server, server_options
+
+# Default Whisper model, run on GPU with FLOAT16.
+# Use "medium.en:int8_float16:cuda" to run on GPU with INT8 or "medium.en:int8:cpu" to run on CPU with INT8.
+DEFAULT_MODELS = "medium.en:float16:cuda"
+
+class RequestHandler(WhisperRequestHandler):
+    supports_batching = True
+    supports_builtin_vad = True
+    # CTranslate2 starts its thread pools when a model is loaded, they do not survive fork()
+    preload_before_fork = False
+
+    def transcribe(self, audio, options):
+        # Process the audio with the requested resident Whisper model
+        with self.model_registry.use(options.get("model"), options.get("compute_type")) as model:
+            segments, info = model.transcribe(audio, beam_size=5, vad_filter=self.vad_mode == "builtin")
+            print("Detected language '%s' with probability %f" % (info.language, info.language_probability))
+            self.record_builtin_vad(info)
+            return "".join(segment.text for segment in segments)
+
+    def transcribe_segments(self, audio, options):
+        # Keep the model borrowed while the lazily decoded segments are streamed
+        stack = ExitStack()
+        model = stack.enter_context(self.model_registry.use(options.get("model"), options.get("compute_type")))
+        try:
+            segments, info = model.transcribe(audio, beam_size=5, language=options.get("language") or None,
+                                              vad_filter=self.vad_mode == "builtin")
+        except BaseException:
+            stack.close()
+            raise
+        print("Detected language '%s' with probability %f" % (info.language, info.language_probability))
+        self.record_builtin_vad(info)
+
+        def decode():
+            with stack:
+                for segment in segments:
+                    yield {"start": segment.start, "end": segment.end, "text": segment.text}
+
+        return info.language, decode()
+
+    def record_builtin_vad(self, info):
+        if self.vad_mode == "builtin":
+            # faster-whisper removed the non-speech and already maps the timestamps back
+            self.vad_skipped_seconds = info.duration - info.duration_after_vad
+
+    def transcribe_batch(self, audios, options):
+        with self.model_registry.use(options.get("model"), options.get("compute_type")) as model:
+            # Pad every segment to one 30 second window and run the encoder once for the batch
+            features = np.stack([pad_or_trim(model.feature_extractor(audio)) for audio in audios])
+            encoder_output = model.encode(features)
+
+            if model.model.is_multilingual:
+                # Most likely language token of each segment, e.g. "<|en|>"
+                languages = [results[0][0][2:-2] for results in model.model.detect_language(encoder_output)]
             else:
-                self.send_error(400, "Invalid content type")
-        else:
-            self.send_error(404, "File not found")
-
-def run(server_class=HTTPServer, handler_class=RequestHandler, port=8000):
-    server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    print(f'Server running at http://localhost:{port}/')
-    httpd.serve_forever()
+                languages = ["en"] * len(audios)
+            print("Detected languages %s for a batch of %d segments" % (", ".join(languages), len(audios)))
+
+            tokenizers = [Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language=language)
+                          for language in languages]
+            prompts = [list(tokenizer.sot_sequence) + [tokenizer.no_timestamps] for tokenizer in tokenizers]
+            results = model.model.generate(encoder_output, prompts, beam_size=5, max_length=model.max_length,
+                                           suppress_blank=True, suppress_tokens=[-1])
+            return [tokenizer.decode(result.sequences_ids[0]).strip() for tokenizer, result in zip(tokenizers, results)]
+
+def run(handler_class=RequestHandler):
+    parser = build_arg_parser("faster-whisper speech to text server", device="cuda")
+    add_model_registry_args(parser, DEFAULT_MODELS)
+    args = parser.parse_args()
+
+    # Split the cores between the pre-forked processes, 0 lets CTranslate2 choose
+    cpu_threads = max(1, (os.cpu_count() or 1) // args.processes) if args.processes > 1 else 0
+
+    def load_model(spec):
+        # num_workers lets each inference worker transcribe with the same model in parallel
+        return WhisperModel(spec.size, device=spec.device, compute_type=spec.compute_type, num_workers=args.workers,
+                            cpu_threads=cpu_threads)
+
+    run_server(handler_class, model_registry=registry_from_args(args, load_model), **server_options(args))
 
 if __name__ == '__main__':
     run()
@@ -1,57 +1,39 @@
 # Copyright (c) 2023 Braedon Hendy
 # This software is released under the GNU General Public License v3.0
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
 import whisperx
-import cgi
-import json
-import os
-import tempfile
-
-# Initialize Whisper model
-model_size = "medium.en"
-
-class RequestHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.path == '/whisperaudio':
-            ctype, pdict = cgi.parse_header(self.headers.get('content-type'))
-            if ctype == 'multipart/form-data':
-                pdict['boundary'] = bytes(pdict['boundary'], "utf-8")
-                fields = cgi.parse_multipart(self.rfile, pdict)
-                audio_data = fields.get('audio')[0]
-
-                # Save the audio file temporarily
-                with tempfile.NamedTemporaryFile(delete=False) as temp_audio_file:
-                    temp_audio_file.write(audio_data)
-                    temp_file_path = temp_audio_file.name
-
-                try:
-                    # Process the file with Whisper
-                    model = whisperx.load_model(model_size, device="cuda", compute_type="float16")
-                    audio = whisperx.load_audio(temp_file_path)
-                    result = model.transcribe(audio)
-                    text_segments = [segment['text'] for segment in result['segments']]                    
-                    transcription = " ".join(text_segments)
-
-                    # Send response
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    response_data = json.dumps({"text": transcription})
-                    self.wfile.write(response_data.encode())
-                finally:
-                    # Clean up the temporary file
-                    os.remove(temp_file_path)
-            else:
-                self.send_error(400, "Invalid content type")
-        else:
-            self.send_error(404, "File not found")
-
-def run(server_class=HTTPServer, handler_class=RequestHandler, port=8000):
-    server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    print(f'Server running at http://localhost:{port}/')
-    httpd.serve_forever()
+from utils.model_registry import add_model_registry_args, registry_from_args
+from utils.whisper_handler import WhisperRequestHandler, build_arg_parser, run_server, server_options
+
+# Default Whisper model, run on GPU with FLOAT16. Use "medium.en:int8:cpu" to run on CPU with INT8.
+DEFAULT_MODELS = "medium.en:float16:cuda"
+
+class RequestHandler(WhisperRequestHandler):
+    # WhisperX already batches the VAD chunks of each request, segments from different
+    # requests are not batched together
+    # CTranslate2 starts its thread pools when a model is loaded, they do not survive fork()
+    preload_before_fork = False
+
+    def transcribe(self, audio, options):
+        # Process the audio with the requested resident Whisper model
+        with self.model_registry.use(options.get("model"), options.get("compute_type")) as model:
+            result = model.transcribe(audio)
+            text_segments = [segment['text'] for segment in result['segments']]
+            return " ".join(text_segments)
+
+    def transcribe_segments(self, audio, options):
+        with self.model_registry.use(options.get("model"), options.get("compute_type")) as model:
+            result = model.transcribe(audio, language=options.get("language") or None)
+            return result["language"], result["segments"]
+
+def load_model(spec):
+    return whisperx.load_model(spec.size, device=spec.device, compute_type=spec.compute_type)
+
+def run(handler_class=RequestHandler):
+    parser = build_arg_parser("WhisperX speech to text server", device="cuda")
+    add_model_registry_args(parser, DEFAULT_MODELS)
+    args = parser.parse_args()
+    run_server(handler_class, model_registry=registry_from_args(args, load_model), **server_options(args))
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,148 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Admission control for the Whisper servers.
+
+Requests are only queued while the number of waiting requests and the amount of
+waiting audio stay under their limits. Beyond that the server answers 429 with a
+Retry-After estimated from the measured throughput, instead of letting clients hang.
+"""
+
+import math
+import threading
+
+# Smoothing factor of the throughput moving average
+THROUGHPUT_SMOOTHING = 0.2
+# Retry-After used before any throughput has been measured
+DEFAULT_RETRY_AFTER = 5
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 120
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request does not fit in the queue.
+
+    :ivar retry_after: Seconds the client should wait before retrying.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """
+    An admitted request. Call :meth:`start` when its inference starts.
+    """
+
+    def __init__(self, controller, audio_seconds):
+        self.controller = controller
+        self.audio_seconds = audio_seconds
+        self.started = False
+
+    def start(self):
+        self.controller._start(self)
+
+
+class AdmissionController:
+    """
+    Bounds the queue of a server by request count and queued audio duration.
+
+    :param workers: Number of inference workers, used to estimate the throughput.
+    :param max_queue_depth: Maximum number of requests waiting for a worker, None or 0 for no limit.
+    :param max_queued_audio_seconds: Maximum seconds of audio waiting for a worker, None or 0 for no limit.
+    """
+
+    def __init__(self, workers, max_queue_depth=None, max_queued_audio_seconds=None):
+        self.workers = workers
+        self.max_queue_depth = max_queue_depth or None
+        self.max_queued_audio_seconds = max_queued_audio_seconds or None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._queued_audio_seconds = 0.0
+        self._running_audio_seconds = 0.0
+        self._real_time_factor = None
+        self.rejected = 0
+
+    def admit(self, audio_seconds):
+        """
+        Admit a request into the queue.
+
+        :param audio_seconds: Duration of the request's audio.
+        :return: The ticket of the admitted request, release it with :meth:`release`.
+        :rtype: AdmissionTicket
+        :raises AdmissionRejected: If the queue is full.
+        """
+        with self._lock:
+            # Always admit into an empty queue so a single long file is never refused
+            if self._queued > 0:
+                if self.max_queue_depth is not None and self._queued >= self.max_queue_depth:
+                    self.rejected += 1
+                    raise AdmissionRejected("Too many queued requests", self._retry_after())
+                if (self.max_queued_audio_seconds is not None
+                        and self._queued_audio_seconds + audio_seconds > self.max_queued_audio_seconds):
+                    self.rejected += 1
+                    raise AdmissionRejected("Too much queued audio", self._retry_after())
+
+            self._queued += 1
+            self._queued_audio_seconds += audio_seconds
+            return AdmissionTicket(self, audio_seconds)
+
+    def release(self, ticket, service_seconds=None):
+        """
+        Remove a finished request and update the throughput estimate.
+
+        :param ticket: The ticket returned by :meth:`admit`.
+        :param service_seconds: Time the inference took, None if it did not run.
+        """
+        with self._lock:
+            if ticket.started:
+                self._running_audio_seconds -= ticket.audio_seconds
+            else:
+                self._queued -= 1
+                self._queued_audio_seconds -= ticket.audio_seconds
+
+            if service_seconds and ticket.audio_seconds > 0:
+                real_time_factor = ticket.audio_seconds / service_seconds
+                if self._real_time_factor is None:
+                    self._real_time_factor = real_time_factor
+                else:
+                    self._real_time_factor += THROUGHPUT_SMOOTHING * (real_time_factor - self._real_time_factor)
+
+    def stats(self):
+        """
+        Returns the current queue size and throughput estimate.
+        """
+        with self._lock:
+            return {
+                "queued": self._queued,
+                "queued_audio_seconds": self._queued_audio_seconds,
+                "running_audio_seconds": self._running_audio_seconds,
+                "throughput_audio_seconds_per_second": self._throughput(),
+                "rejected": self.rejected,
+            }
+
+    def _start(self, ticket):
+        with self._lock:
+            if ticket.started:
+                return
+            ticket.started = True
+            self._queued -= 1
+            self._queued_audio_seconds -= ticket.audio_seconds
+            self._running_audio_seconds += ticket.audio_seconds
+
+    def _throughput(self):
+        # Seconds of audio the server transcribes per second of wall time
+        if self._real_time_factor is None:
+            return None
+        return self._real_time_factor * self.workers
+
+    def _retry_after(self):
+        # Time to drain the current backlog at the measured throughput
+        throughput = self._throughput()
+        if not throughput:
+            return DEFAULT_RETRY_AFTER
+        backlog = self._queued_audio_seconds + self._running_audio_seconds
+        return int(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(backlog / throughput))))
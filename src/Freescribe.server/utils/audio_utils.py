@@ -0,0 +1,99 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+In-memory audio decoding for the Whisper servers.
+
+Uploaded audio is decoded straight from the request buffer into the 16 kHz mono
+float32 array all the Whisper backends accept, without writing a temporary file.
+16-bit PCM WAV at 16 kHz (what the client sends) is decoded with numpy alone, other
+formats are piped through ffmpeg.
+"""
+
+import struct
+import subprocess
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+WAVE_FORMAT_PCM = 1
+
+
+class AudioDecodeError(ValueError):
+    """Raised when uploaded audio can not be decoded."""
+
+
+def decode_audio(data, sample_rate=SAMPLE_RATE):
+    """
+    Decode an audio file held in memory.
+
+    :param data: The encoded audio file.
+    :type data: bytes or bytearray
+    :param sample_rate: The sample rate to resample to.
+    :return: Mono float32 samples in [-1, 1].
+    :rtype: np.ndarray
+    :raises AudioDecodeError: If the audio can not be decoded.
+    """
+    samples = _decode_pcm_wav(data, sample_rate)
+    if samples is None:
+        samples = _decode_ffmpeg(data, sample_rate)
+    return samples
+
+
+def audio_duration(samples, sample_rate=SAMPLE_RATE):
+    """
+    Duration in seconds of decoded audio.
+    """
+    return len(samples) / sample_rate
+
+
+def _decode_pcm_wav(data, sample_rate):
+    # Fast path for 16-bit PCM WAV already at the target rate, None if not applicable.
+    # The RIFF chunks are walked by hand so the samples are read straight out of the
+    # upload buffer without copying it.
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+
+    view = memoryview(data)
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = bytes(view[offset:offset + 4])
+        chunk_size = struct.unpack_from("<I", data, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b"fmt " and chunk_size >= 16:
+            fmt = struct.unpack_from("<HHIIHH", data, body)
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            audio_format, channels, rate, _, _, bits_per_sample = fmt
+            if audio_format != WAVE_FORMAT_PCM or bits_per_sample != 16 or rate != sample_rate:
+                return None
+            # Streamed WAVs may have a placeholder size, clamp to what was uploaded
+            end = min(body + chunk_size, len(data))
+            end -= (end - body) % (2 * channels)
+            samples = np.frombuffer(view[body:end], dtype=np.int16)
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1)
+            return samples.astype(np.float32) / 32768.0
+        # Chunks are padded to an even size
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _decode_ffmpeg(data, sample_rate):
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+        "pipe:1",
+    ]
+    try:
+        result = subprocess.run(cmd, input=data, capture_output=True, check=True)
+    except FileNotFoundError:
+        raise AudioDecodeError("ffmpeg is required to decode this audio format")
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode(errors='replace').strip().splitlines()
+        raise AudioDecodeError(f"Failed to decode audio: {stderr[-1] if stderr else e}")
+
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
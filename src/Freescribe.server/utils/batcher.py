@@ -0,0 +1,119 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Cross-request dynamic batching for the Whisper servers.
+
+Short realtime segments from several clients arrive at nearly the same time. Instead
+of decoding each one alone, the batcher holds the first request for a short window,
+collects the requests that arrive meanwhile and hands them to the model as a single
+batched encoder/decoder pass. Each request gets its own result back through a future.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class _Item:
+    def __init__(self, key, payload):
+        self.key = key
+        self.payload = payload
+        self.future = Future()
+
+
+class DynamicBatcher:
+    """
+    Groups concurrently submitted items into batches.
+
+    Items are only batched with items of the same key, e.g. the same model. A batch is
+    dispatched when it is full or when the window since its first item has elapsed.
+
+    :param process_batch: Callable taking a key and a list of payloads and returning a
+        future resolved with one result per payload, in order. It is called on the
+        batcher thread so it should only queue the work.
+    :param max_batch_size: Maximum number of items in a batch.
+    :param max_wait: Seconds to wait for more items after the first one of a batch.
+    :param name: Name of the batcher thread.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait=0.02, name="batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, payload):
+        """
+        Add an item to the next batch of its key.
+
+        :return: A future resolved with the item's result.
+        :rtype: concurrent.futures.Future
+        """
+        item = _Item(key, payload)
+        self._queue.put(item)
+        return item.future
+
+    def shutdown(self):
+        """
+        Dispatch the pending items and stop the batcher thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        pending = {}
+        deadlines = {}
+        while True:
+            timeout = None
+            if deadlines:
+                timeout = max(0.0, min(deadlines.values()) - time.monotonic())
+
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                for key in list(pending):
+                    self._dispatch(key, pending.pop(key))
+                return
+
+            if item:
+                batch = pending.setdefault(item.key, [])
+                if not batch:
+                    deadlines[item.key] = time.monotonic() + self.max_wait
+                batch.append(item)
+                if len(batch) >= self.max_batch_size:
+                    del deadlines[item.key]
+                    self._dispatch(item.key, pending.pop(item.key))
+
+            now = time.monotonic()
+            for key in [key for key, deadline in deadlines.items() if deadline <= now]:
+                del deadlines[key]
+                self._dispatch(key, pending.pop(key))
+
+    def _dispatch(self, key, items):
+        try:
+            future = self.process_batch(key, [item.payload for item in items])
+        except BaseException as e:
+            for item in items:
+                item.future.set_exception(e)
+            return
+
+        def distribute(batch_future):
+            error = batch_future.exception()
+            if error is None:
+                results = batch_future.result()
+                if len(results) != len(items):
+                    error = RuntimeError(f"Batch returned {len(results)} results for {len(items)} items")
+            for i, item in enumerate(items):
+                if error is None:
+                    item.future.set_result(results[i])
+                else:
+                    item.future.set_exception(error)
+
+        future.add_done_callback(distribute)
@@ -0,0 +1,134 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Files of a bulk transcription request.
+
+A bulk request uploads many recordings at once, either as several file parts of one
+multipart/form-data body or as a zip or tar archive. The files are listed up front and
+read one at a time as they are scheduled, so an archive is never extracted in full.
+Results are streamed back as newline-delimited JSON, one line per file in the order
+the files finish.
+"""
+
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+# Most files accepted in one request
+MAX_FILES = 1000
+# Largest extracted size of a single file of an archive
+MAX_EXTRACTED_FILE_BYTES = 1024 * 1024 * 1024
+CONTENT_TYPE = "application/x-ndjson"
+ZIP_TYPES = ("application/zip", "application/x-zip-compressed")
+TAR_TYPES = ("application/x-tar", "application/gzip", "application/x-gzip", "application/x-gtar")
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+class BulkError(ValueError):
+    """Raised when the files of a bulk request can not be read."""
+
+
+class BulkFile:
+    """
+    One file of a bulk request.
+
+    :ivar name: File name, with its path inside the archive for archived files.
+    """
+
+    def __init__(self, name, read):
+        self.name = name
+        self._read = read
+
+    def read(self):
+        """
+        Returns the contents of the file.
+
+        :raises BulkError: If it can not be extracted from its archive.
+        """
+        try:
+            return self._read()
+        except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+            raise BulkError(f"Could not extract {self.name}: {e}")
+
+
+def list_files(parts):
+    """
+    List the files of the file parts of a multipart body, expanding archives.
+
+    :param parts: The MultipartPart objects holding files.
+    :return: The files, in upload order and archive order.
+    :rtype: list[BulkFile]
+    :raises BulkError: If an archive is invalid or there are too many files.
+    """
+    files = []
+    for part in parts:
+        name = part.filename or part.name
+        if is_zip(part):
+            files.extend(_zip_files(part.data, name))
+        elif is_tar(part):
+            files.extend(_tar_files(part.data, name))
+        else:
+            files.append(BulkFile(name, lambda data=part.data: data))
+        if len(files) > MAX_FILES:
+            raise BulkError(f"Bulk requests are limited to {MAX_FILES} files")
+    return files
+
+
+def is_zip(part):
+    """
+    Whether a part holds a zip archive, by its content type or file name.
+    """
+    return part.content_type in ZIP_TYPES or (part.filename or "").lower().endswith(".zip")
+
+
+def is_tar(part):
+    """
+    Whether a part holds a tar archive, optionally compressed.
+    """
+    return part.content_type in TAR_TYPES or (part.filename or "").lower().endswith(TAR_SUFFIXES)
+
+
+def ndjson_line(data):
+    """
+    Encode one line of the streamed response.
+    """
+    return json.dumps(data).encode() + b"\n"
+
+
+def _is_hidden(path):
+    # Resource forks and dot files added by archivers, e.g. __MACOSX/ and .DS_Store
+    return any(part.startswith(".") or part == "__MACOSX" for part in path.split("/"))
+
+
+def _zip_files(data, name):
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile as e:
+        raise BulkError(f"{name} is not a valid zip archive: {e}")
+    files = []
+    for info in archive.infolist():
+        if info.is_dir() or _is_hidden(info.filename):
+            continue
+        if info.file_size > MAX_EXTRACTED_FILE_BYTES:
+            raise BulkError(f"{info.filename} of {name} is too large")
+        files.append(BulkFile(f"{name}/{info.filename}", lambda info=info: archive.read(info)))
+    return files
+
+
+def _tar_files(data, name):
+    try:
+        archive = tarfile.open(fileobj=io.BytesIO(data), mode="r:*")
+        members = archive.getmembers()
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise BulkError(f"{name} is not a valid tar archive: {e}")
+    files = []
+    for member in members:
+        if not member.isfile() or _is_hidden(os.path.normpath(member.name)):
+            continue
+        if member.size > MAX_EXTRACTED_FILE_BYTES:
+            raise BulkError(f"{member.name} of {name} is too large")
+        files.append(BulkFile(f"{name}/{member.name}", lambda member=member: archive.extractfile(member).read()))
+    return files
@@ -0,0 +1,207 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Persistent store of asynchronous transcription jobs.
+
+A long recording posted to /whisperaudio holds the connection open for the whole
+decode, proxies time it out and a dropped connection loses the result. With the job
+API the client uploads the audio once, gets a job id back immediately and polls the
+job until its result can be fetched. Jobs and their results are kept in a local
+SQLite database, so they outlive the client's connection and are visible to every
+pre-forked process, until they expire.
+
+Each job records the process that runs it. Jobs left unfinished by a process that died
+are failed when it is restarted, and those of the whole server on its next start, so
+clients polling them get an answer.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+DEFAULT_TTL_HOURS = 24
+# Expired jobs are purged at most this often
+PURGE_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    duration REAL NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    pid INTEGER
+)
+"""
+
+
+def default_data_dir():
+    """
+    Directory of the server's job database and uploaded audio: WHISPER_DATA_DIR if set,
+    else the user's application data directory of the platform.
+    """
+    if os.environ.get('WHISPER_DATA_DIR'):
+        return os.environ['WHISPER_DATA_DIR']
+    if sys.platform == "win32":
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser("~/.local/share")
+    return os.path.join(base, "FreeScribe", "server")
+
+
+class JobStore:
+    """
+    SQLite backed table of transcription jobs, safe to use from several threads and processes.
+
+    :param path: Path of the database file.
+    :param ttl_seconds: Seconds a job is kept after it was last updated.
+    """
+
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_HOURS * 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._last_purge = 0.0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            db.execute(_SCHEMA)
+            # Databases created before jobs recorded their process
+            if "pid" not in [row[1] for row in db.execute("PRAGMA table_info(jobs)")]:
+                db.execute("ALTER TABLE jobs ADD COLUMN pid INTEGER")
+
+    def create(self, duration, status=QUEUED, result=None):
+        """
+        Add a job.
+
+        :param duration: Seconds of audio to transcribe.
+        :param status: Initial status, DONE with a result for jobs answered from the cache.
+        :param result: JSON serializable result of a job created DONE.
+        :return: The id of the job, owned by this process.
+        """
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connection() as db:
+            db.execute("INSERT INTO jobs (id, status, created, updated, duration, progress, result, pid) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (job_id, status, now, now, duration, 1.0 if status == DONE else 0.0,
+                        None if result is None else json.dumps(result), os.getpid()))
+        return job_id
+
+    def set_progress(self, job_id, progress):
+        """
+        Mark a job running and record the fraction of its audio transcribed.
+        """
+        self._update(job_id, status=RUNNING, progress=progress)
+
+    def finish(self, job_id, result):
+        """
+        Store the JSON serializable result of a job.
+        """
+        self._update(job_id, status=DONE, progress=1.0, result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        """
+        Mark a job failed with an error message.
+        """
+        self._update(job_id, status=FAILED, error=str(error))
+
+    def get(self, job_id):
+        """
+        Look up a job.
+
+        :return: Dict with the id, status, created, duration, progress and the result or
+            error of finished jobs, None if there is no such job.
+        """
+        with self._connection() as db:
+            row = db.execute("SELECT id, status, created, duration, progress, result, error FROM jobs WHERE id = ?",
+                             (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {"id": row[0], "status": row[1], "created": row[2], "duration": row[3], "progress": row[4]}
+        if row[5] is not None:
+            job["result"] = json.loads(row[5])
+        if row[6] is not None:
+            job["error"] = row[6]
+        return job
+
+    def delete(self, job_id):
+        """
+        Remove a job.
+
+        :return: Whether the job existed.
+        """
+        with self._connection() as db:
+            return db.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount > 0
+
+    def fail_unfinished(self, error, pid=None):
+        """
+        Fail the jobs left queued or running by a previous run of the server, or by a
+        process that died.
+
+        :param pid: The process whose jobs are failed, None for the jobs of every process.
+        :return: The number of jobs failed.
+        """
+        query = "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status IN (?, ?)"
+        params = (FAILED, error, time.time(), QUEUED, RUNNING)
+        if pid is not None:
+            query += " AND pid = ?"
+            params += (pid,)
+        with self._connection() as db:
+            return db.execute(query, params).rowcount
+
+    def purge_expired(self):
+        """
+        Remove the jobs not updated within the time to live.
+        """
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        with self._connection() as db:
+            db.execute("DELETE FROM jobs WHERE updated < ?", (now - self.ttl_seconds,))
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connection() as db:
+            db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _connection(self):
+        # One connection per thread, and per process since the pid is part of the key
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(os.getpid())
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connections[os.getpid()] = connection
+        return connection
+
+
+def add_job_store_args(parser):
+    """
+    Add the job API options to a server's argument parser.
+    """
+    parser.add_argument('--jobs-db', default=os.environ.get('WHISPER_JOBS_DB', os.path.join(default_data_dir(), 'jobs.sqlite3')),
+                        help="SQLite database of the asynchronous job API (/v1/jobs), empty to disable the job API. "
+                             "Defaults to jobs.sqlite3 in WHISPER_DATA_DIR or the user's application data directory.")
+    parser.add_argument('--job-ttl-hours', type=float, default=float(os.environ.get('WHISPER_JOB_TTL_HOURS', DEFAULT_TTL_HOURS)),
+                        help="Hours finished jobs and their results are kept.")
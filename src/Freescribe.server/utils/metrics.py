@@ -0,0 +1,237 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Prometheus text format metrics for the Whisper servers.
+
+A small dependency free implementation of counters, histograms and callback gauges.
+Recording a value takes a lock and a bisect, so it is cheap enough for the inference
+path; all formatting happens when /metrics is scraped.
+"""
+
+import bisect
+import os
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets in seconds for request latency and queue wait
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Buckets in seconds for the duration of the uploaded audio
+AUDIO_DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+# Buckets for processing time divided by audio duration, below 1 is faster than real time
+REAL_TIME_FACTOR_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+# Buckets for the number of requests decoded together
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+# Buckets in seconds for model load time
+MODEL_LOAD_BUCKETS = (1, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{_escape_label(value)}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, optionally split by labels.
+    """
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets, optionally split by labels.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per bucket counts, the last one is +Inf, then the sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            all_series = {key: list(series) for key, series in self._series.items()}
+
+        lines = []
+        for key, series in sorted(all_series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Value read from a callback when the metrics are scraped. Omitted if the callback
+    returns None. With labelnames the callback returns a dict mapping tuples of label
+    values to values.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _samples(self):
+        value = self.callback()
+        if value is None:
+            return []
+        if not self.labelnames:
+            return [f"{self.name} {_format_value(value)}"]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(value.items()) if value is not None]
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together on /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Add a metric, replacing one with the same name.
+
+        :return: The metric.
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def process_rss_bytes():
+    """
+    Resident set size of the server process, None if it can not be determined.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "whisper_requests_total", "Requests handled, by endpoint and HTTP status.", ("endpoint", "status")))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "whisper_request_duration_seconds", "Time from receiving a request to sending its response, including upload and queueing.",
+    LATENCY_BUCKETS, ("endpoint",)))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    "whisper_queue_wait_seconds", "Time transcriptions waited for a free inference worker, by priority class.",
+    LATENCY_BUCKETS, ("priority",)))
+INFERENCE_DURATION = REGISTRY.register(Histogram(
+    "whisper_inference_duration_seconds", "Time spent transcribing on an inference worker.", LATENCY_BUCKETS))
+AUDIO_DURATION = REGISTRY.register(Histogram(
+    "whisper_audio_duration_seconds", "Duration of the transcribed audio.", AUDIO_DURATION_BUCKETS))
+REAL_TIME_FACTOR = REGISTRY.register(Histogram(
+    "whisper_real_time_factor", "Inference time divided by audio duration, below 1 is faster than real time.",
+    REAL_TIME_FACTOR_BUCKETS))
+VAD_SKIPPED = REGISTRY.register(Histogram(
+    "whisper_vad_skipped_seconds", "Seconds of non-speech removed by voice activity detection before decoding.",
+    AUDIO_DURATION_BUCKETS))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "whisper_batch_size", "Number of requests decoded together in one inference pass.", BATCH_SIZE_BUCKETS))
+MODEL_LOADS = REGISTRY.register(Counter(
+    "whisper_model_loads_total", "Models loaded into memory, by model.", ("model",)))
+MODEL_LOAD_DURATION = REGISTRY.register(Histogram(
+    "whisper_model_load_duration_seconds", "Time taken to load a model.", MODEL_LOAD_BUCKETS, ("model",)))
+MODEL_UNLOADS = REGISTRY.register(Counter(
+    "whisper_model_unloads_total", "Models unloaded to stay within the memory budget, by model.", ("model",)))
+REGISTRY.register(Gauge(
+    "process_resident_memory_bytes", "Resident memory size in bytes.", process_rss_bytes))
@@ -0,0 +1,289 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Process-lifetime registry of loaded Whisper models.
+
+Models are loaded once at startup instead of on every request. Several model sizes
+and compute types can be resident at the same time and requests pick one by name.
+When loading another model would exceed the memory budget, the least recently used
+model that is not currently transcribing is unloaded. When every model that would have
+to go is transcribing, the load waits for them to be released, and fails with
+ModelBusyError after MODEL_WAIT_SECONDS instead of going past the budget.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from utils import metrics
+
+# Approximate resident size of the float16 weights in MB, by model family
+FLOAT16_MODEL_SIZES_MB = {
+    "tiny": 75,
+    "base": 145,
+    "small": 485,
+    "medium": 1530,
+    "large": 3100,
+    "distil-small": 340,
+    "distil-medium": 790,
+    "distil-large": 1510,
+}
+
+# Size of each compute type relative to float16
+COMPUTE_TYPE_SCALE = {
+    "float32": 2.0,
+    "float16": 1.0,
+    "bfloat16": 1.0,
+    "int8_float32": 0.5,
+    "int8_float16": 0.5,
+    "int8_bfloat16": 0.5,
+    "int8": 0.5,
+}
+
+# Longest wait for resident models to be released so another one fits in the budget
+MODEL_WAIT_SECONDS = 60
+# Retry-After sent to clients whose model did not fit
+MODEL_BUSY_RETRY_AFTER = 5
+
+
+class UnknownModelError(ValueError):
+    """Raised when a request selects a model that the server was not configured with."""
+
+
+class ModelBusyError(RuntimeError):
+    """
+    Raised when a model does not fit in the memory budget because the resident models stay in use.
+
+    :ivar retry_after: Seconds the client should wait before retrying.
+    """
+
+    def __init__(self, message, retry_after=MODEL_BUSY_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelSpec:
+    """
+    A model size on a device with a compute type, written as ``size:compute_type:device``.
+
+    The compute type and device are optional, e.g. ``small.en:int8:cpu``, ``medium.en``.
+
+    :param size: Model size or path, e.g. "medium.en".
+    :param compute_type: CTranslate2 compute type, e.g. "float16" or "int8".
+    :param device: "cuda" or "cpu".
+    """
+
+    def __init__(self, size, compute_type=None, device="cuda"):
+        self.size = size
+        self.device = device
+        self.compute_type = compute_type or ("float16" if device == "cuda" else "int8")
+
+    @classmethod
+    def parse(cls, text, default_device="cuda"):
+        parts = text.strip().split(":")
+        size = parts[0]
+        compute_type = parts[1] if len(parts) > 1 and parts[1] else None
+        device = parts[2] if len(parts) > 2 and parts[2] else default_device
+        return cls(size, compute_type, device)
+
+    @property
+    def key(self):
+        return f"{self.size}:{self.compute_type}:{self.device}"
+
+    def estimated_size_mb(self):
+        """
+        Rough memory footprint of the model used for the memory budget.
+        """
+        name = os.path.basename(self.size.rstrip("/\\")).replace(".en", "")
+        family = max((f for f in FLOAT16_MODEL_SIZES_MB if name.startswith(f)), key=len, default=None)
+        base_size = FLOAT16_MODEL_SIZES_MB[family] if family else FLOAT16_MODEL_SIZES_MB["medium"]
+        return base_size * COMPUTE_TYPE_SCALE.get(self.compute_type, 1.0)
+
+    def __repr__(self):
+        return f"ModelSpec({self.key})"
+
+
+class _Entry:
+    def __init__(self, spec, model):
+        self.spec = spec
+        self.model = model
+        self.in_use = 0
+
+
+class ModelRegistry:
+    """
+    LRU registry of loaded models under a memory budget.
+
+    :param loader: Callable taking a ModelSpec and returning the loaded model.
+    :param specs: The models requests are allowed to select. The first one is the default.
+    :param memory_budget_mb: Total estimated size of resident models, None for no limit.
+    """
+
+    def __init__(self, loader, specs, memory_budget_mb=None):
+        if not specs:
+            raise ValueError("At least one model must be configured")
+        self.loader = loader
+        self.specs = list(specs)
+        self.memory_budget_mb = memory_budget_mb
+        self._models = OrderedDict()
+        self._lock = threading.Condition()
+        # Estimated size in MB of the models being loaded, by key
+        self._loading = {}
+
+    @property
+    def default_spec(self):
+        return self.specs[0]
+
+    def preload(self):
+        """
+        Load as many configured models as fit in the memory budget, default model first.
+        """
+        used_mb = 0.0
+        for spec in self.specs:
+            size_mb = spec.estimated_size_mb()
+            if self.memory_budget_mb is not None and used_mb + size_mb > self.memory_budget_mb and used_mb > 0:
+                print(f"Not preloading {spec.key}, it does not fit in the {self.memory_budget_mb} MB budget")
+                continue
+            with self.use(spec.size, spec.compute_type):
+                pass
+            used_mb += size_mb
+
+    def resolve(self, size=None, compute_type=None):
+        """
+        Find the configured model matching a request.
+
+        :param size: Requested model size, None for the default model.
+        :param compute_type: Requested compute type, None for any.
+        :return: The matching ModelSpec.
+        :raises UnknownModelError: If no configured model matches.
+        """
+        if not size and not compute_type:
+            return self.default_spec
+
+        for spec in self.specs:
+            if (not size or spec.size == size) and (not compute_type or spec.compute_type == compute_type):
+                return spec
+
+        available = ", ".join(spec.key for spec in self.specs)
+        raise UnknownModelError(f"Model '{size or ''}:{compute_type or ''}' is not available. Available models: {available}")
+
+    @contextmanager
+    def use(self, size=None, compute_type=None):
+        """
+        Borrow a model for the duration of a transcription, loading it if needed.
+
+        Models that are borrowed are never evicted.
+
+        :param size: Requested model size, None for the default model.
+        :param compute_type: Requested compute type, None for any.
+        """
+        spec = self.resolve(size, compute_type)
+        entry = self._acquire(spec)
+        try:
+            yield entry.model
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                self._lock.notify_all()
+
+    def loaded(self):
+        """
+        Returns the keys of the resident models, least recently used first.
+        """
+        with self._lock:
+            return list(self._models)
+
+    def _acquire(self, spec):
+        size_mb = spec.estimated_size_mb()
+        deadline = None
+        with self._lock:
+            while True:
+                entry = self._models.get(spec.key)
+                if entry is not None:
+                    self._models.move_to_end(spec.key)
+                    entry.in_use += 1
+                    return entry
+                if spec.key in self._loading:
+                    # Another request is already loading this model
+                    self._lock.wait()
+                    continue
+                if self._evict_for(size_mb):
+                    break
+                # The models that would have to be unloaded are transcribing, wait for one to be released
+                if deadline is None:
+                    deadline = time.monotonic() + MODEL_WAIT_SECONDS
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ModelBusyError(f"Model {spec.key} does not fit in the {self.memory_budget_mb} MB budget "
+                                         f"while the loaded models are in use")
+                self._lock.wait(remaining)
+
+            self._loading[spec.key] = size_mb
+
+        try:
+            start = time.monotonic()
+            model = self.loader(spec)
+            load_time = time.monotonic() - start
+            print(f"Loaded model {spec.key} in {load_time:.1f}s")
+            metrics.MODEL_LOADS.inc(model=spec.key)
+            metrics.MODEL_LOAD_DURATION.observe(load_time, model=spec.key)
+        except BaseException:
+            with self._lock:
+                self._loading.pop(spec.key, None)
+                self._lock.notify_all()
+            raise
+
+        with self._lock:
+            entry = _Entry(spec, model)
+            entry.in_use += 1
+            self._models[spec.key] = entry
+            self._loading.pop(spec.key, None)
+            self._lock.notify_all()
+            return entry
+
+    def _evict_for(self, size_mb):
+        # Called with the lock held. Unloads idle models, least recently used first, until
+        # a model of size_mb fits next to the resident and loading ones. Returns whether it fits.
+        if self.memory_budget_mb is None:
+            return True
+
+        def used_mb():
+            return sum(entry.spec.estimated_size_mb() for entry in self._models.values()) + sum(self._loading.values())
+
+        for key in list(self._models):
+            if used_mb() + size_mb <= self.memory_budget_mb:
+                break
+            entry = self._models[key]
+            if entry.in_use:
+                continue
+            del self._models[key]
+            metrics.MODEL_UNLOADS.inc(model=key)
+            print(f"Unloaded model {key} to stay within the {self.memory_budget_mb} MB budget")
+        # A model larger than the whole budget is still loaded when nothing else is
+        return used_mb() + size_mb <= self.memory_budget_mb or not (self._models or self._loading)
+
+
+def add_model_registry_args(parser, default_models):
+    """
+    Add the model registry options to a server's argument parser.
+
+    :param parser: The argparse parser.
+    :param default_models: Default value of --models.
+    """
+    parser.add_argument('--models', default=os.environ.get('WHISPER_MODELS', default_models),
+                        help="Comma separated models to serve as size[:compute_type[:device]], e.g. "
+                             "'medium.en:float16:cuda,small.en:int8:cpu'. The first one is the default.")
+    parser.add_argument('--model-memory-budget', type=float, default=os.environ.get('WHISPER_MODEL_MEMORY_BUDGET'),
+                        help="Memory budget in MB for resident models. Least recently used models are unloaded beyond it.")
+
+
+def registry_from_args(args, loader):
+    """
+    Build a ModelRegistry from the parsed --models and --model-memory-budget options.
+    """
+    specs = [ModelSpec.parse(text) for text in args.models.split(",") if text.strip()]
+    budget = float(args.model_memory_budget) if args.model_memory_budget else None
+    return ModelRegistry(loader, specs, budget)
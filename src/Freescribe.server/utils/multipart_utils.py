@@ -0,0 +1,221 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Streaming multipart/form-data parser.
+
+Replaces the deprecated ``cgi.parse_multipart`` which reads the entire body into memory,
+spools file fields to temporary files and then copies them again. The request body is
+read in fixed size chunks and each part's payload is appended to a single buffer as it
+arrives, so an uploaded file costs one in-memory copy and no disk writes.
+"""
+
+from email.message import Message
+
+READ_CHUNK_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+
+
+class MultipartError(ValueError):
+    """Raised when a request body is not valid multipart/form-data."""
+
+
+class MultipartPart:
+    """
+    One field of a multipart/form-data body.
+
+    :ivar name: The form field name.
+    :ivar filename: The uploaded file name, None for plain fields.
+    :ivar content_type: The Content-Type of the part, None if not given.
+    :ivar data: The payload of the part.
+    :vartype data: bytearray
+    """
+
+    def __init__(self, headers):
+        disposition = _parse_header_params(headers.get("content-disposition", ""))
+        self.headers = headers
+        self.name = disposition.get_param("name")
+        self.filename = disposition.get_param("filename")
+        self.content_type = headers.get("content-type")
+        self.data = bytearray()
+
+    def text(self, encoding="utf-8"):
+        """
+        Returns the payload decoded as text.
+        """
+        return self.data.decode(encoding)
+
+    def __repr__(self):
+        return f"MultipartPart(name={self.name!r}, filename={self.filename!r}, size={len(self.data)})"
+
+
+class MultipartParser:
+    """
+    Incremental multipart/form-data parser.
+
+    Feed the body with :meth:`feed` as it is read from the socket and call :meth:`close`
+    at the end. Completed parts are available in :attr:`parts`. An optional callback
+    receives each part as soon as it is complete.
+
+    :param boundary: The boundary from the Content-Type header.
+    :param on_part: Optional callable called with each completed MultipartPart.
+    """
+
+    _PREAMBLE, _HEADERS, _BODY, _END = range(4)
+
+    def __init__(self, boundary, on_part=None):
+        if not boundary:
+            raise MultipartError("Missing multipart boundary")
+        self._delimiter = b"--" + boundary.encode("latin-1")
+        self._body_delimiter = b"\r\n" + self._delimiter
+        self._buffer = bytearray()
+        self._state = self._PREAMBLE
+        self._part = None
+        self.on_part = on_part
+        self.parts = []
+
+    def feed(self, chunk):
+        """
+        Parse the next chunk of the body.
+        """
+        self._buffer += chunk
+        while self._step():
+            pass
+
+    def close(self):
+        """
+        Finish parsing.
+
+        :raises MultipartError: If the body ended before the closing boundary.
+        """
+        if self._state != self._END:
+            raise MultipartError("Incomplete multipart body")
+        return self.parts
+
+    def _step(self):
+        # Process as much of the buffer as possible, returns True if progress was made
+        buffer = self._buffer
+
+        if self._state == self._PREAMBLE:
+            index = buffer.find(self._delimiter)
+            if index < 0:
+                # Keep a possible partial delimiter at the end of the buffer
+                del buffer[:max(0, len(buffer) - len(self._delimiter))]
+                return False
+            return self._consume_delimiter(index + len(self._delimiter))
+
+        if self._state == self._HEADERS:
+            index = buffer.find(b"\r\n\r\n")
+            if index < 0:
+                if len(buffer) > MAX_HEADER_SIZE:
+                    raise MultipartError("Multipart part headers too large")
+                return False
+            self._part = MultipartPart(_parse_headers(bytes(buffer[:index])))
+            del buffer[:index + 4]
+            self._state = self._BODY
+            return True
+
+        if self._state == self._BODY:
+            index = buffer.find(self._body_delimiter)
+            if index < 0:
+                # Everything except a possible partial delimiter belongs to the part
+                safe = len(buffer) - len(self._body_delimiter) + 1
+                if safe > 0:
+                    self._part.data += buffer[:safe]
+                    del buffer[:safe]
+                return False
+
+            self._part.data += buffer[:index]
+            del buffer[:index]
+            if self._delimiter_end(len(self._body_delimiter)) is None:
+                # Wait for the bytes telling whether this delimiter closes the body
+                return False
+
+            self.parts.append(self._part)
+            if self.on_part is not None:
+                self.on_part(self._part)
+            self._part = None
+            return self._consume_delimiter(len(self._body_delimiter))
+
+        # Ignore the epilogue
+        buffer.clear()
+        return False
+
+    def _delimiter_end(self, end):
+        # Offset just past the delimiter ending at `end` and its line break or closing
+        # dashes, None if more data is needed to tell
+        if len(self._buffer) < end + 2:
+            return None
+        if self._buffer[end:end + 2] == b"--":
+            return end + 2
+        # Skip transport padding up to the line break
+        line_end = self._buffer.find(b"\r\n", end)
+        return None if line_end < 0 else line_end + 2
+
+    def _consume_delimiter(self, end):
+        # Move past the delimiter ending at `end` into the next part or the epilogue
+        consumed = self._delimiter_end(end)
+        if consumed is None:
+            return False
+        closing = self._buffer[end:end + 2] == b"--"
+        del self._buffer[:consumed]
+        self._state = self._END if closing else self._HEADERS
+        return True
+
+
+def _parse_header_params(value):
+    message = Message()
+    message["content-type"] = value
+    return message
+
+
+def _parse_headers(raw):
+    headers = {}
+    for line in raw.decode("utf-8", errors="replace").split("\r\n"):
+        if not line.strip():
+            continue
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+def get_boundary(content_type):
+    """
+    Extract the boundary of a multipart/form-data Content-Type header.
+
+    :raises MultipartError: If the content type is not multipart/form-data.
+    """
+    message = _parse_header_params(content_type or "")
+    if message.get_content_type() != "multipart/form-data":
+        raise MultipartError("Invalid content type")
+    return message.get_param("boundary")
+
+
+def read_multipart(rfile, content_type, content_length, on_part=None, chunk_size=READ_CHUNK_SIZE):
+    """
+    Read and parse a multipart/form-data request body from a stream.
+
+    :param rfile: The request body stream.
+    :param content_type: The Content-Type header of the request.
+    :param content_length: The Content-Length header of the request.
+    :param on_part: Optional callable called with each part as soon as it is complete.
+    :param chunk_size: Size of the reads from the stream.
+    :return: The parts of the body in order.
+    :rtype: list[MultipartPart]
+    :raises MultipartError: If the body is not valid multipart/form-data.
+    """
+    if content_length is None:
+        raise MultipartError("Content-Length is required")
+    try:
+        remaining = int(content_length)
+    except ValueError:
+        raise MultipartError("Invalid Content-Length")
+
+    parser = MultipartParser(get_boundary(content_type), on_part=on_part)
+    while remaining > 0:
+        chunk = rfile.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        parser.feed(chunk)
+    return parser.close()
@@ -0,0 +1,90 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Response formats of the OpenAI compatible /v1/audio/transcriptions endpoint.
+
+Non streamed responses follow the "json", "text" and "verbose_json" formats of the
+OpenAI API. Streamed responses are server-sent events: one ``transcript.text.delta``
+event per decoded segment, then a ``transcript.text.done`` event with the full text.
+"""
+
+import json
+
+RESPONSE_FORMATS = ("json", "text", "verbose_json")
+
+
+def format_segment(index, segment):
+    """
+    Convert a backend segment into a verbose_json segment.
+
+    :param index: Position of the segment in the transcription.
+    :param segment: Dict with the "start", "end" and "text" of the segment.
+    :return: The segment with its id, start and end in seconds and text.
+    :rtype: dict
+    """
+    return {
+        "id": index,
+        "start": round(float(segment["start"]), 3),
+        "end": round(float(segment["end"]), 3),
+        "text": segment["text"],
+    }
+
+
+def join_segments(segments):
+    """
+    Full text of a list of segments.
+    """
+    return "".join(segment["text"] for segment in segments).strip()
+
+
+def verbose_result(language, duration, segments):
+    """
+    Build a verbose_json response body.
+
+    :param language: The detected or requested language, None if unknown.
+    :param duration: Duration of the audio in seconds.
+    :param segments: The formatted segments.
+    """
+    return {
+        "task": "transcribe",
+        "language": language,
+        "duration": round(duration, 3),
+        "text": join_segments(segments),
+        "segments": segments,
+    }
+
+
+def delta_event(segment):
+    """
+    Streamed event carrying one decoded segment.
+    """
+    return {"type": "transcript.text.delta", "delta": segment["text"], "segment": segment}
+
+
+def done_event(result):
+    """
+    Streamed event sent after the last segment, carrying the verbose_json result.
+    """
+    return {"type": "transcript.text.done", **result}
+
+
+def error_event(message):
+    """
+    Streamed event sent if the transcription fails after the stream started.
+    """
+    return {"type": "error", **error_body(message)}
+
+
+def error_body(message, error_type="invalid_request_error"):
+    """
+    Error response body in the OpenAI API format.
+    """
+    return {"error": {"message": message, "type": error_type}}
+
+
+def sse_event(data):
+    """
+    Encode a server-sent event.
+    """
+    return f"data: {json.dumps(data)}\n\n".encode()
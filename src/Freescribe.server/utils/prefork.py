@@ -0,0 +1,179 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Pre-forked multi-process mode for CPU-only Whisper servers.
+
+A single Python process can not keep every core busy with concurrent requests: the
+request threads share the GIL and each model uses one thread pool. In pre-fork mode
+the parent opens the listening socket (and, where the backend allows it, loads the
+models so the children share their weights copy-on-write), then forks one child per
+core group. Every child accepts connections from the shared socket and runs its own
+inference workers. Children that die are restarted, after a growing delay when they
+keep dying shortly after starting, e.g. because their model fails to load; the server
+gives up and exits with an error after MAX_FAST_FAILURES such failures in a row.
+
+Only available on POSIX systems.
+"""
+
+import os
+import signal
+import sys
+import time
+import traceback
+
+# A child exiting sooner than this after it started failed on startup
+MIN_UPTIME_SECONDS = 30
+# Delay before restarting a child after its first failure on startup, doubled after each
+RESTART_DELAY_SECONDS = 1
+MAX_RESTART_DELAY_SECONDS = 60
+# Consecutive failures on startup of a child after which the server exits
+MAX_FAST_FAILURES = 5
+
+
+def can_fork():
+    """
+    Whether this platform supports the pre-fork mode.
+    """
+    return hasattr(os, "fork")
+
+
+def share_listening_socket(server):
+    """
+    Prepare a socketserver whose listening socket is shared by the pre-forked processes.
+
+    Every process waits on the shared socket, so the ones that lose the race for a
+    connection must not block in accept(). Accepted connections inherit the non-blocking
+    mode of the listening socket on macOS and the BSDs, they are switched back to
+    blocking so reading a request body never fails halfway with BlockingIOError.
+    """
+    server.socket.setblocking(False)
+    accept = server.get_request
+
+    def get_request():
+        connection, address = accept()
+        connection.setblocking(True)
+        return connection, address
+
+    server.get_request = get_request
+
+
+def serve_prefork(processes, child_main, on_exit=None):
+    """
+    Fork worker processes and supervise them until interrupted.
+
+    :param processes: Number of worker processes.
+    :param child_main: Callable taking the index of the process, runs in each child
+        and serves requests until it returns.
+    :param on_exit: Optional callable taking the pid and index of a child that exited
+        while the server was running, called in the parent before it is restarted.
+    :raises SystemExit: With a non-zero status if a child failed on startup
+        MAX_FAST_FAILURES times in a row.
+    """
+    children = {}
+    started_at = {}
+    # Consecutive failures on startup and scheduled restart time, by process index
+    fast_failures = {}
+    restarts = {}
+    stopping = False
+
+    def spawn(index):
+        started_at[index] = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            # Child: exit on SIGTERM from the parent, never return into the parent's code
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            code = 0
+            try:
+                child_main(index)
+            except (KeyboardInterrupt, SystemExit):
+                pass
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum=None, frame=None):
+        nonlocal stopping
+        stopping = True
+        restarts.clear()
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def wait(timeout):
+        # os.wait() with a timeout in seconds, None to wait until a child exits
+        if timeout is None:
+            return os.wait()
+        deadline = time.monotonic() + timeout
+        while True:
+            if children:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid:
+                    return pid, status
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, None
+            time.sleep(min(0.1, remaining))
+
+    for index in range(processes):
+        spawn(index)
+    print(f"Started {processes} worker processes")
+
+    previous_handler = signal.signal(signal.SIGTERM, stop)
+    gave_up = None
+    try:
+        while children or restarts:
+            for index, restart_at in list(restarts.items()):
+                if restart_at <= time.monotonic():
+                    del restarts[index]
+                    spawn(index)
+            next_restart = min(restarts.values(), default=None)
+            try:
+                pid, status = wait(None if next_restart is None else max(0, next_restart - time.monotonic()))
+            except KeyboardInterrupt:
+                # Ctrl+C also reaches the children, make sure they all stop
+                stop()
+                continue
+            except ChildProcessError:
+                break
+            if pid is None:
+                continue
+
+            index = children.pop(pid, None)
+            if index is None or stopping:
+                continue
+            if on_exit is not None:
+                try:
+                    on_exit(pid, index)
+                except Exception:
+                    traceback.print_exc()
+
+            if time.monotonic() - started_at[index] < MIN_UPTIME_SECONDS:
+                fast_failures[index] = fast_failures.get(index, 0) + 1
+            else:
+                # A child that served for a while is restarted at once
+                fast_failures[index] = 0
+            failures = fast_failures[index]
+            if failures >= MAX_FAST_FAILURES:
+                gave_up = (f"Worker process {index} failed {failures} times in a row within "
+                           f"{MIN_UPTIME_SECONDS}s of starting, stopping the server")
+                print(gave_up)
+                stop()
+                continue
+
+            delay = min(RESTART_DELAY_SECONDS * 2 ** (failures - 1), MAX_RESTART_DELAY_SECONDS) if failures else 0
+            print(f"Worker process {pid} exited with status {status}, restarting it"
+                  + (f" in {delay:g}s" if delay else ""))
+            restarts[index] = time.monotonic() + delay
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+
+    if gave_up is not None:
+        raise SystemExit(gave_up)
@@ -0,0 +1,85 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Request priority classes for the Whisper servers.
+
+Realtime segments from a clinician's live transcript must not wait behind an uploaded
+hour-long recording. Every request belongs to a priority class, chosen by the client
+with the X-Priority header or the "priority" form field, or else by the length of its
+audio. The inference queue serves the realtime class first, and long bulk
+transcriptions are split at pauses into chunks that go back into the queue one after
+the other, so a realtime request waits for at most one chunk.
+"""
+
+import numpy as np
+
+from utils import vad
+from utils.audio_utils import SAMPLE_RATE
+
+REALTIME = "realtime"
+BULK = "bulk"
+# In scheduling order, the first class is served first
+PRIORITIES = (REALTIME, BULK)
+HEADER = "X-Priority"
+FIELD = "priority"
+# Requests without a priority are realtime up to this many seconds of audio
+REALTIME_MAX_SECONDS = 30
+# Seconds of bulk audio transcribed before the worker is yielded to queued requests
+DEFAULT_CHUNK_SECONDS = 30
+# Shortest chunk, shorter ones would spend more time in the queue and decoder setup than decoding
+MIN_CHUNK_SECONDS = 5
+# Chunks end at the quietest point of their last few seconds
+CUT_SEARCH_SECONDS = 5
+
+
+def request_priority(requested, duration):
+    """
+    The priority class of a request.
+
+    :param requested: The class asked for by the client, None or an unknown value to
+        choose it from the duration.
+    :param duration: Seconds of audio to transcribe.
+    :return: One of PRIORITIES.
+    """
+    requested = (requested or "").strip().lower()
+    if requested in PRIORITIES:
+        return requested
+    return REALTIME if duration <= REALTIME_MAX_SECONDS else BULK
+
+
+def rank(priority):
+    """
+    Position of a class in the inference queue, lower is served first.
+    """
+    return PRIORITIES.index(priority)
+
+
+def split_at_pauses(audio, chunk_seconds, sample_rate=SAMPLE_RATE):
+    """
+    Split a recording into chunks of about chunk_seconds, cutting at the quietest
+    point near each boundary so words are not cut apart.
+
+    :param audio: Mono float32 samples.
+    :param chunk_seconds: Longest chunk, the last one may be up to CUT_SEARCH_SECONDS longer.
+    :return: The chunks, in order.
+    :rtype: list[np.ndarray]
+    """
+    chunk = int(chunk_seconds * sample_rate)
+    search = int(min(CUT_SEARCH_SECONDS, chunk_seconds / 4) * sample_rate)
+    frame = int(sample_rate * vad.FRAME_MS / 1000)
+    frames = search // frame
+
+    chunks = []
+    start = 0
+    while len(audio) - start > chunk + search:
+        end = start + chunk
+        cut = end
+        if frames:
+            window = audio[end - frames * frame:end].reshape(frames, frame)
+            quietest = int(np.argmin(np.square(window, dtype=np.float32).mean(axis=1)))
+            cut = end - frames * frame + quietest * frame + frame // 2
+        chunks.append(audio[start:cut])
+        start = cut
+    chunks.append(audio[start:])
+    return chunks
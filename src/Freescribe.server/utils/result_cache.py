@@ -0,0 +1,202 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Transcription result cache for the Whisper servers.
+
+Clients retry the same segment after timeouts and the same file is often uploaded
+again. Results are keyed by the SHA-256 of the decoded PCM together with the model
+and the options that change the output, so a repeated request is answered without
+running the model. A bounded in-memory LRU is checked first, then an optional
+on-disk tier that survives restarts and is shared by pre-forked processes.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils import metrics
+
+ENTRY_SUFFIX = ".json"
+# Request options that change the transcription, the others only change its format
+KEY_OPTIONS = ("language", "prompt", "temperature")
+# The disk tier is scanned for eviction once every this many writes
+DISK_EVICT_INTERVAL = 16
+
+HITS = metrics.REGISTRY.register(metrics.Counter(
+    "whisper_result_cache_hits_total", "Transcriptions answered from the result cache, by tier.", ("tier",)))
+MISSES = metrics.REGISTRY.register(metrics.Counter(
+    "whisper_result_cache_misses_total", "Transcriptions not found in the result cache."))
+
+
+class ResultCache:
+    """
+    Two tier LRU cache of transcription results.
+
+    :param max_memory_bytes: Size budget of the in-memory tier, 0 to disable it.
+    :param disk_dir: Directory of the on-disk tier, None to disable it.
+    :param max_disk_bytes: Size budget of the on-disk tier.
+    """
+
+    def __init__(self, max_memory_bytes, disk_dir=None, max_disk_bytes=0):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(audio, kind, model, options, vad="off"):
+        """
+        Build the cache key of a transcription.
+
+        :param audio: The decoded 16 kHz mono float32 samples.
+        :param kind: The kind of result, e.g. "text" or "verbose".
+        :param model: Identifies the model that transcribes the audio.
+        :param options: The request's form fields, only KEY_OPTIONS are part of the key.
+        :param vad: The voice activity detection applied before decoding.
+        :return: Hex digest identifying the audio and transcription settings.
+        """
+        digest = hashlib.sha256(memoryview(np.ascontiguousarray(audio)).cast("B"))
+        settings = {"kind": kind, "model": model, "vad": vad, "options": {name: options.get(name) for name in KEY_OPTIONS}}
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Look up a result, memory first then disk.
+
+        :return: The cached result, or None on a miss.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None:
+            HITS.inc(tier="memory")
+            return json.loads(entry)
+
+        if self.disk_dir:
+            path = self._entry_path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = f.read()
+                result = json.loads(entry)
+                # Refresh the modification time so the entry is evicted last
+                os.utime(path, None)
+            except (FileNotFoundError, json.JSONDecodeError):
+                # A concurrent eviction or a half-written entry is just a miss
+                result = None
+            if result is not None:
+                HITS.inc(tier="disk")
+                self._put_memory(key, entry)
+                return result
+
+        MISSES.inc()
+        return None
+
+    def put(self, key, result):
+        """
+        Store a JSON serializable result in both tiers.
+        """
+        entry = json.dumps(result)
+        self._put_memory(key, entry)
+        if self.disk_dir:
+            self._put_disk(key, entry)
+
+    def _put_memory(self, key, entry):
+        size = len(entry)
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._memory[key] = entry
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _put_disk(self, key, entry):
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file and rename so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(entry)
+            os.replace(temp_path, path)
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            print(f"Failed to write the result cache entry {path}: {e}")
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            evict = self._disk_writes % DISK_EVICT_INTERVAL == 1
+        if evict:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Remove the least recently used entries until the disk tier fits in its budget
+        entries = []
+        total_size = 0
+        for directory, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith(ENTRY_SUFFIX):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process evicted it first
+                pass
+            total_size -= size
+
+    def _entry_path(self, key):
+        # Shard by the first two hex characters to keep directories small
+        return os.path.join(self.disk_dir, key[:2], key + ENTRY_SUFFIX)
+
+
+def add_result_cache_args(parser):
+    """
+    Add the result cache options to a server's argument parser.
+    """
+    parser.add_argument('--cache-size-mb', type=float, default=float(os.environ.get('WHISPER_CACHE_SIZE_MB', 64)),
+                        help="Size of the in-memory transcription result cache in MB, 0 to disable it.")
+    parser.add_argument('--cache-dir', default=os.environ.get('WHISPER_CACHE_DIR'),
+                        help="Directory of the on-disk transcription result cache, disabled if not set.")
+    parser.add_argument('--cache-disk-size-mb', type=float, default=float(os.environ.get('WHISPER_CACHE_DISK_SIZE_MB', 1024)),
+                        help="Size of the on-disk transcription result cache in MB.")
+
+
+def result_cache_from_options(cache_size_mb, cache_dir, cache_disk_size_mb):
+    """
+    Build a ResultCache, None if both tiers are disabled.
+    """
+    if not cache_size_mb and not cache_dir:
+        return None
+    return ResultCache(int(cache_size_mb * 1024 * 1024), cache_dir, int(cache_disk_size_mb * 1024 * 1024))
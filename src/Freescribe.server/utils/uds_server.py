@@ -0,0 +1,243 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Unix domain socket transport for clients on the same host as the Whisper server.
+
+When the client and the server run on one workstation, HTTP over TCP adds a
+multipart upload, a WAV container and a TLS proxy to every realtime segment. Over the
+Unix socket each request is a compact binary frame holding a small JSON header and the
+raw PCM samples, the response is a frame holding the JSON result. A connection stays
+open and carries any number of requests one after the other.
+
+Request frame::
+
+    MAGIC | header length (u32) | PCM length (u64) | JSON header | PCM
+
+The header holds the "sample_rate" (must be 16000), the "encoding" of the samples
+("s16le" or "f32le", mono) and the usual form fields, e.g. "model", "language" and
+"priority".
+
+Response frame::
+
+    MAGIC | status (u16) | body length (u32) | JSON body
+
+Statuses follow HTTP: 200 with {"text": ...}, 400 for invalid requests and 429 with
+{"error": ..., "retry_after": seconds} when the server is busy (503 when the requested
+model does not fit in the memory budget). All integers are
+big-endian. Access is controlled by the permissions of the socket file.
+
+Only available on POSIX systems.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import time
+
+import numpy as np
+
+from utils import metrics
+from utils.audio_utils import SAMPLE_RATE
+from utils.model_registry import ModelBusyError, UnknownModelError
+
+MAGIC = b"FSW1"
+REQUEST_HEADER = struct.Struct("!4sIQ")
+RESPONSE_HEADER = struct.Struct("!4sHI")
+MAX_HEADER_BYTES = 64 * 1024
+# Four hours of 16 kHz float32 audio
+MAX_PCM_BYTES = 4 * 3600 * SAMPLE_RATE * 4
+ENCODINGS = {"s16le": np.dtype("<i2"), "f32le": np.dtype("<f4")}
+# Endpoint label of the socket's requests in the metrics
+ENDPOINT = "unix"
+
+
+class FrameError(ValueError):
+    """Raised when a request frame is invalid."""
+
+
+def can_use_unix_sockets():
+    """
+    Whether this platform supports Unix domain sockets.
+    """
+    return hasattr(socket, "AF_UNIX")
+
+
+def read_request(rfile):
+    """
+    Read one request frame.
+
+    :param rfile: Buffered binary stream of the connection.
+    :return: Tuple of the header dict and the PCM bytes, or None if the client closed
+        the connection.
+    :raises FrameError: If the frame is malformed. The connection can not be used after it.
+    """
+    prefix = rfile.read(REQUEST_HEADER.size)
+    if not prefix:
+        return None
+    if len(prefix) < REQUEST_HEADER.size:
+        raise FrameError("Truncated frame header")
+
+    magic, header_length, pcm_length = REQUEST_HEADER.unpack(prefix)
+    if magic != MAGIC:
+        raise FrameError("Not a transcription frame")
+    if header_length > MAX_HEADER_BYTES:
+        raise FrameError(f"Frame header of {header_length} bytes is too large")
+    if pcm_length > MAX_PCM_BYTES:
+        raise FrameError(f"Audio of {pcm_length} bytes is too large")
+
+    header = rfile.read(header_length)
+    pcm = rfile.read(pcm_length)
+    if len(header) < header_length or len(pcm) < pcm_length:
+        raise FrameError("Truncated frame")
+    try:
+        header = json.loads(header) if header else {}
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise FrameError(f"Invalid frame header: {e}")
+    if not isinstance(header, dict):
+        raise FrameError("The frame header must be a JSON object")
+    return header, pcm
+
+
+def write_response(wfile, status, body):
+    """
+    Write one response frame.
+
+    :param status: HTTP style status code.
+    :param body: JSON serializable response body.
+    """
+    data = json.dumps(body).encode()
+    wfile.write(RESPONSE_HEADER.pack(MAGIC, status, len(data)) + data)
+    wfile.flush()
+
+
+def decode_pcm(pcm, header):
+    """
+    Convert the raw samples of a request to 16 kHz mono float32.
+
+    :raises FrameError: If the sample rate or encoding is not supported.
+    """
+    sample_rate = header.get("sample_rate", SAMPLE_RATE)
+    if sample_rate != SAMPLE_RATE:
+        raise FrameError(f"Unsupported sample_rate {sample_rate}, send {SAMPLE_RATE} Hz audio")
+    dtype = ENCODINGS.get(header.get("encoding", "s16le"))
+    if dtype is None:
+        raise FrameError(f"Unsupported encoding, use one of {', '.join(ENCODINGS)}")
+    if len(pcm) % dtype.itemsize:
+        raise FrameError("The audio length is not a whole number of samples")
+
+    samples = np.frombuffer(pcm, dtype=dtype)
+    if dtype.kind == "i":
+        return samples.astype(np.float32) / 32768
+    return samples.astype(np.float32)
+
+
+def frame_handler_class(handler_class):
+    """
+    Subclass a server's WhisperRequestHandler to answer socket frames instead of HTTP.
+
+    The transcription methods, result cache, admission control and VAD are those of the
+    HTTP endpoints, only the responses are written as frames.
+    """
+
+    class FrameRequest(handler_class):
+        def __init__(self, wfile):
+            # BaseHTTPRequestHandler.__init__ would try to parse an HTTP request
+            self.wfile = wfile
+            self.headers = None
+            self.response_status = None
+
+        def send_json(self, status, data, headers=None):
+            retry_after = (headers or {}).get("Retry-After")
+            if retry_after is not None:
+                data = dict(data, retry_after=int(retry_after))
+            self.response_status = status
+            write_response(self.wfile, status, data)
+
+    FrameRequest.__name__ = f"{handler_class.__name__}FrameRequest"
+    return FrameRequest
+
+
+class _FrameStreamHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = read_request(self.rfile)
+            except FrameError as e:
+                write_response(self.wfile, 400, {"error": str(e)})
+                return
+            if request is None:
+                return
+            self.handle_frame(*request)
+
+    def handle_frame(self, header, pcm):
+        start = time.monotonic()
+        handler = self.server.frame_class(self.wfile)
+        try:
+            audio = decode_pcm(pcm, header)
+            options = {key: str(value) for key, value in header.items()
+                       if key not in ("sample_rate", "encoding") and value is not None}
+            transcription = handler.run_cached_transcription("text", audio, options)
+            if transcription is None:
+                # Rejected, the 429 frame has been sent
+                return
+            response = {"text": transcription}
+            if handler.vad_skipped_seconds is not None:
+                response["skipped_seconds"] = round(handler.vad_skipped_seconds, 3)
+            handler.send_json(200, response)
+        except (FrameError, UnknownModelError) as e:
+            handler.send_json(400, {"error": str(e)})
+        except ModelBusyError as e:
+            handler.send_json(503, {"error": f"Server busy: {e}"}, headers={"Retry-After": str(e.retry_after)})
+        except Exception as e:
+            handler.send_json(500, {"error": f"Transcription failed: {e}"})
+            raise
+        finally:
+            metrics.REQUESTS.inc(endpoint=ENDPOINT, status=str(handler.response_status or 500))
+            metrics.REQUEST_DURATION.observe(time.monotonic() - start, endpoint=ENDPOINT)
+
+
+class UnixSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Threaded server answering transcription frames on a Unix domain socket.
+
+    :param path: Path of the socket file, a stale socket left by a previous run is replaced.
+    :param handler_class: The WhisperRequestHandler subclass of the server.
+    :param mode: Permissions of the socket file.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, handler_class, mode=0o660):
+        self.path = path
+        self.frame_class = frame_handler_class(handler_class)
+        if os.path.exists(path):
+            self._remove_stale_socket(path)
+        super().__init__(path, _FrameStreamHandler)
+        os.chmod(path, mode)
+
+    @staticmethod
+    def _remove_stale_socket(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise SystemExit(f"{path} exists and is not a socket")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(path)
+            return
+        finally:
+            probe.close()
+        raise SystemExit(f"Another server is already listening on {path}")
+
+    def remove(self):
+        """
+        Delete the socket file.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
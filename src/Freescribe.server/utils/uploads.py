@@ -0,0 +1,357 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Resumable progressive uploads of a recording while it is being made.
+
+The client streams the raw 16 kHz PCM of a session to the server in the background
+while recording. Every append names the byte offset it starts at, so a request retried
+after a dropped connection is applied once: bytes the server already has are skipped,
+and an append past the end is refused with the server's current offset. Regions of
+the audio that are complete are cut at pauses and decoded while recording continues.
+When the client finishes the upload only the tail is left to decode, and the
+transcript is published as a job of :mod:`utils.jobs`.
+
+The audio of each upload is kept in a file, the offsets and decoded regions in the
+job database, so any pre-forked process can serve any request of an upload. Each region
+records the process decoding it: when that process dies before the region is decoded,
+the upload and its job are failed.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from utils import jobs, priority
+from utils.audio_utils import SAMPLE_RATE
+
+BYTES_PER_SAMPLE = 2
+# Largest single append accepted
+MAX_APPEND_BYTES = 16 * 1024 * 1024
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS uploads (
+        id TEXT PRIMARY KEY,
+        created REAL NOT NULL,
+        updated REAL NOT NULL,
+        size INTEGER NOT NULL DEFAULT 0,
+        options TEXT NOT NULL,
+        decoded INTEGER NOT NULL DEFAULT 0,
+        regions INTEGER NOT NULL DEFAULT 0,
+        job_id TEXT,
+        error TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS upload_regions (
+        upload_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        end INTEGER NOT NULL,
+        text TEXT,
+        pid INTEGER,
+        PRIMARY KEY (upload_id, idx)
+    )
+    """,
+)
+
+
+class UploadError(ValueError):
+    """Raised when an upload request can not be applied."""
+
+
+class OffsetMismatch(UploadError):
+    """
+    Raised when an append or finish does not match the server's offset.
+
+    :ivar offset: The number of bytes the server has.
+    """
+
+    def __init__(self, offset):
+        super().__init__(f"The upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadStore:
+    """
+    Uploads in progress, stored next to the jobs of a :class:`utils.jobs.JobStore`.
+
+    :param db_path: Path of the job database.
+    :param directory: Directory of the uploaded audio.
+    :param ttl_seconds: Seconds an upload is kept after it was last updated.
+    """
+
+    def __init__(self, db_path, directory, ttl_seconds):
+        self.db_path = db_path
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._last_purge = 0.0
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            for statement in _SCHEMA:
+                db.execute(statement)
+            # Databases created before regions recorded their process
+            if "pid" not in [row[1] for row in db.execute("PRAGMA table_info(upload_regions)")]:
+                db.execute("ALTER TABLE upload_regions ADD COLUMN pid INTEGER")
+
+    def create(self, options):
+        """
+        Start an upload.
+
+        :param options: The request fields of the transcription, e.g. "language".
+        :return: The id of the upload.
+        """
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        now = time.time()
+        open(self._audio_path(upload_id), 'wb').close()
+        with self._connection() as db:
+            db.execute("INSERT INTO uploads (id, created, updated, options) VALUES (?, ?, ?, ?)",
+                       (upload_id, now, now, json.dumps(options)))
+        return upload_id
+
+    def get(self, upload_id):
+        """
+        Look up an upload.
+
+        :return: Dict with the id, size in bytes, options, decoded samples, job id and
+            error, None if there is no such upload.
+        """
+        row = self._connection().execute(
+            "SELECT id, size, options, decoded, job_id, error FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "size": row[1], "options": json.loads(row[2]), "decoded": row[3],
+                "job_id": row[4], "error": row[5]}
+
+    def append(self, upload_id, offset, data):
+        """
+        Append audio at a byte offset.
+
+        Bytes before the server's offset were already received and are skipped.
+
+        :return: The new size of the upload in bytes.
+        :raises OffsetMismatch: If the offset is past the end of the upload.
+        :raises UploadError: If the upload is finished or the data is not whole samples.
+        """
+        if offset % BYTES_PER_SAMPLE or len(data) % BYTES_PER_SAMPLE:
+            raise UploadError("Appends must hold whole 16-bit samples")
+        with self._transaction() as db:
+            size, job_id = self._row(db, upload_id, "size, job_id")
+            if job_id is not None:
+                raise UploadError("The upload is already finished")
+            if offset > size:
+                raise OffsetMismatch(size)
+            data = data[size - offset:]
+            if data:
+                with open(self._audio_path(upload_id), 'r+b') as f:
+                    f.seek(size)
+                    f.write(data)
+                size += len(data)
+                db.execute("UPDATE uploads SET size = ?, updated = ? WHERE id = ?", (size, time.time(), upload_id))
+            return size
+
+    def claim_region(self, upload_id, chunk_seconds):
+        """
+        Claim the next region of the upload for decoding. The region ends at a pause near
+        chunk_seconds, once enough audio has arrived since the last one. When the upload is
+        finished, the rest of its audio is claimed as the last region.
+
+        :return: Tuple of the region's index, start and end in samples, or None if there
+            is nothing to claim or decoding a region failed.
+        """
+        chunk = int(chunk_seconds * SAMPLE_RATE)
+        search = int(priority.CUT_SEARCH_SECONDS * SAMPLE_RATE)
+        with self._transaction() as db:
+            size, decoded, regions, job_id, error = self._row(db, upload_id, "size, decoded, regions, job_id, error")
+            samples = size // BYTES_PER_SAMPLE
+            if error is not None:
+                return None
+            if samples - decoded > chunk + search:
+                window = self.read_samples(upload_id, decoded, decoded + chunk + search + 1)
+                end = decoded + len(priority.split_at_pauses(window, chunk_seconds)[0])
+            elif job_id is not None and samples > decoded:
+                end = samples
+            else:
+                return None
+            return self._add_region(db, upload_id, regions, decoded, end)
+
+    def finish(self, upload_id, offset, job_id):
+        """
+        Close the upload. The audio not claimed yet is left to :meth:`claim_region`.
+
+        Finishing again, e.g. when the client retries after a dropped connection, returns
+        the job of the first finish.
+
+        :param offset: The size of the upload according to the client.
+        :param job_id: The job publishing the transcript.
+        :return: The id of the upload's job.
+        :raises OffsetMismatch: If the server did not receive all the audio.
+        """
+        with self._transaction() as db:
+            size, finished = self._row(db, upload_id, "size, job_id")
+            if offset != size:
+                raise OffsetMismatch(size)
+            if finished is not None:
+                return finished
+            db.execute("UPDATE uploads SET job_id = ?, updated = ? WHERE id = ?", (job_id, time.time(), upload_id))
+            return job_id
+
+    def complete_region(self, upload_id, index, text):
+        """
+        Store the text of a decoded region.
+
+        :return: Tuple of the job id and the transcript once the upload is finished and
+            every region is decoded, None otherwise.
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE upload_regions SET text = ? WHERE upload_id = ? AND idx = ?", (text, upload_id, index))
+            return self._transcript(db, upload_id)
+
+    def transcript(self, upload_id):
+        """
+        Tuple of the job id and the transcript if the upload is finished and decoded, None otherwise.
+        """
+        with self._transaction() as db:
+            return self._transcript(db, upload_id)
+
+    def fail(self, upload_id, error):
+        """
+        Record that decoding a region failed.
+
+        :return: The id of the upload's job, None if it is not finished yet.
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE uploads SET error = ?, updated = ? WHERE id = ?", (str(error), time.time(), upload_id))
+            row = db.execute("SELECT job_id FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        return row[0] if row else None
+
+    def fail_unfinished(self, error, pid=None):
+        """
+        Fail the uploads with a region claimed but not decoded by a previous run of the
+        server, or by a process that died.
+
+        :param pid: The process whose regions are failed, None for the regions of every process.
+        :return: The job id of each failed upload, None for uploads not finished yet.
+        """
+        query = ("SELECT DISTINCT uploads.id, uploads.job_id FROM uploads JOIN upload_regions "
+                 "ON upload_regions.upload_id = uploads.id WHERE upload_regions.text IS NULL AND uploads.error IS NULL")
+        params = ()
+        if pid is not None:
+            query += " AND upload_regions.pid = ?"
+            params += (pid,)
+        with self._transaction() as db:
+            failed = db.execute(query, params).fetchall()
+            for upload_id, _ in failed:
+                db.execute("UPDATE uploads SET error = ?, updated = ? WHERE id = ?", (error, time.time(), upload_id))
+        return [job_id for _, job_id in failed]
+
+    def delete(self, upload_id):
+        """
+        Remove an upload and its audio.
+
+        :return: Whether the upload existed.
+        """
+        with self._transaction() as db:
+            db.execute("DELETE FROM upload_regions WHERE upload_id = ?", (upload_id,))
+            existed = db.execute("DELETE FROM uploads WHERE id = ?", (upload_id,)).rowcount > 0
+        try:
+            os.remove(self._audio_path(upload_id))
+        except FileNotFoundError:
+            pass
+        return existed
+
+    def read_samples(self, upload_id, start, end):
+        """
+        Read uploaded audio as float32 samples.
+
+        :param start: First sample.
+        :param end: Sample after the last one, clipped to the uploaded audio.
+        """
+        with open(self._audio_path(upload_id), 'rb') as f:
+            f.seek(start * BYTES_PER_SAMPLE)
+            data = f.read((end - start) * BYTES_PER_SAMPLE)
+        data = data[:len(data) - len(data) % BYTES_PER_SAMPLE]
+        return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768
+
+    def purge_expired(self):
+        """
+        Remove the uploads not updated within the time to live.
+        """
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        expired = [row[0] for row in self._connection().execute(
+            "SELECT id FROM uploads WHERE updated < ?", (now - self.ttl_seconds,))]
+        for upload_id in expired:
+            self.delete(upload_id)
+
+    def _add_region(self, db, upload_id, index, start, end):
+        db.execute("INSERT INTO upload_regions (upload_id, idx, start, end, pid) VALUES (?, ?, ?, ?, ?)",
+                   (upload_id, index, start, end, os.getpid()))
+        db.execute("UPDATE uploads SET decoded = ?, regions = ? WHERE id = ?", (end, index + 1, upload_id))
+        return index, start, end
+
+    def _transcript(self, db, upload_id):
+        job_id, error, size, decoded = self._row(db, upload_id, "job_id, error, size, decoded")
+        if job_id is None or error is not None or decoded < size // BYTES_PER_SAMPLE:
+            return None
+        texts = db.execute("SELECT text FROM upload_regions WHERE upload_id = ? ORDER BY idx", (upload_id,)).fetchall()
+        if any(text is None for text, in texts):
+            return None
+        return job_id, " ".join(text.strip() for text, in texts if text.strip())
+
+    @staticmethod
+    def _row(db, upload_id, columns):
+        row = db.execute(f"SELECT {columns} FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        if row is None:
+            raise KeyError(upload_id)
+        return row
+
+    def _audio_path(self, upload_id):
+        return os.path.join(self.directory, upload_id + ".pcm")
+
+    def _transaction(self):
+        # Serializes the read-modify-write of an upload across threads and processes
+        return _Transaction(self._connection())
+
+    def _connection(self):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(os.getpid())
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connections[os.getpid()] = connection
+        return connection
+
+
+class _Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+def add_upload_args(parser):
+    """
+    Add the progressive upload options to a server's argument parser.
+    """
+    parser.add_argument('--uploads-dir', default=os.environ.get('WHISPER_UPLOADS_DIR', os.path.join(jobs.default_data_dir(), 'uploads')),
+                        help="Directory of the audio of progressive uploads (/v1/uploads), which require the job API, "
+                             "empty to disable them. Defaults to uploads in WHISPER_DATA_DIR or the user's application data directory.")
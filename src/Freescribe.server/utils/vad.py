@@ -0,0 +1,129 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Energy based voice activity detection for the Whisper servers.
+
+Clinical recordings contain long silences and exam room noise that Whisper still
+encodes, and sometimes hallucinates over. Frames whose energy stays close to the
+recording's noise floor are removed before inference. The kept regions are recorded
+in a TimestampMap so segment timestamps can be mapped back to the original audio.
+"""
+
+import numpy as np
+
+from utils.audio_utils import SAMPLE_RATE
+
+FRAME_MS = 30
+# Frames this far above the noise floor are speech
+THRESHOLD_DB = 12.0
+# Frames quieter than this are never speech, whatever the noise floor
+MIN_SPEECH_DB = -55.0
+# Percentile of the frame energies used as the noise floor
+NOISE_FLOOR_PERCENTILE = 10
+# Speech shorter than this is treated as noise
+MIN_SPEECH_MS = 250
+# Silence shorter than this is kept so words are not cut apart
+MIN_SILENCE_MS = 500
+# Audio kept before and after each speech region
+PAD_MS = 200
+
+
+class TimestampMap:
+    """
+    Maps times in the speech-only audio back to times in the original audio.
+
+    :param regions: The kept regions as (start, end) sample offsets in the original audio.
+    :param sample_rate: Sample rate of the audio.
+    """
+
+    def __init__(self, regions, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.regions = list(regions)
+        # Start of each region in the speech-only audio, in samples
+        self._offsets = np.cumsum([0] + [end - start for start, end in self.regions])
+
+    @property
+    def kept_seconds(self):
+        return float(self._offsets[-1]) / self.sample_rate
+
+    def to_original(self, seconds, is_end=False):
+        """
+        Convert a time in the speech-only audio to the original audio.
+
+        :param seconds: Time in the speech-only audio.
+        :param is_end: Whether the time ends a segment. A time exactly on the boundary
+            between two regions then maps to the end of the earlier region.
+        :return: Time in the original audio.
+        """
+        if not self.regions:
+            return seconds
+        sample = seconds * self.sample_rate
+        side = "left" if is_end else "right"
+        index = int(np.searchsorted(self._offsets[1:], sample, side=side))
+        index = min(index, len(self.regions) - 1)
+        start = self.regions[index][0]
+        return (start + sample - self._offsets[index]) / self.sample_rate
+
+
+def detect_speech(audio, sample_rate=SAMPLE_RATE, min_silence_ms=MIN_SILENCE_MS):
+    """
+    Find the speech regions of a recording.
+
+    :param audio: Mono float32 samples.
+    :param sample_rate: Sample rate of the audio.
+    :param min_silence_ms: Shortest silence that splits two speech regions.
+    :return: The speech regions as (start, end) sample offsets.
+    :rtype: list[tuple[int, int]]
+    """
+    frame = int(sample_rate * FRAME_MS / 1000)
+    frames = len(audio) // frame
+    if frames == 0:
+        return [(0, len(audio))] if len(audio) else []
+
+    energy = np.square(audio[:frames * frame].reshape(frames, frame), dtype=np.float32).mean(axis=1)
+    db = 10 * np.log10(energy + 1e-10)
+    threshold = max(np.percentile(db, NOISE_FLOOR_PERCENTILE) + THRESHOLD_DB, MIN_SPEECH_DB)
+    speech = db > threshold
+
+    # Runs of speech frames as [start, end) frame indexes
+    edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+    runs = list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+    # Join runs separated by short silences, then drop short blips of noise
+    max_gap = min_silence_ms // FRAME_MS
+    merged = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] < max_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    min_frames = MIN_SPEECH_MS // FRAME_MS
+    merged = [(start, end) for start, end in merged if end - start >= min_frames]
+
+    # Pad the regions and convert them to samples, merging regions the padding joins
+    pad = int(sample_rate * PAD_MS / 1000)
+    regions = []
+    for start, end in merged:
+        start = max(0, int(start) * frame - pad)
+        end = min(len(audio), int(end) * frame + pad)
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return regions
+
+
+def filter_speech(audio, sample_rate=SAMPLE_RATE, min_silence_ms=MIN_SILENCE_MS):
+    """
+    Remove the non-speech regions of a recording.
+
+    :param audio: Mono float32 samples.
+    :return: Tuple of the speech-only samples and the TimestampMap back to the original.
+    """
+    regions = detect_speech(audio, sample_rate, min_silence_ms)
+    if len(regions) == 1 and regions[0] == (0, len(audio)):
+        return audio, TimestampMap(regions, sample_rate)
+    if not regions:
+        return audio[:0], TimestampMap(regions, sample_rate)
+    return np.concatenate([audio[start:end] for start, end in regions]), TimestampMap(regions, sample_rate)
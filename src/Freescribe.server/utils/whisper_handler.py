@@ -0,0 +1,1473 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Request handling shared by the Whisper servers.
+
+Each server subclasses WhisperRequestHandler and implements ``transcribe`` for its
+backend. Requests are accepted concurrently by a ThreadingHTTPServer, uploads are
+parsed and decoded in memory on the request thread and the transcriptions themselves
+run on a bounded InferenceWorkerPool.
+"""
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import copy
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+from utils import bulk, jobs, metrics, openai_api, prefork, priority, uds_server, uploads, vad
+from utils.admission import AdmissionController, AdmissionRejected
+from utils.audio_utils import SAMPLE_RATE, AudioDecodeError, audio_duration, decode_audio
+from utils.batcher import DynamicBatcher
+from utils.model_registry import ModelBusyError, UnknownModelError
+from utils.multipart_utils import MultipartError, read_multipart
+from utils.result_cache import add_result_cache_args, result_cache_from_options
+from utils.worker_pool import InferenceWorkerPool, default_worker_count
+
+# Longest segment batched with other requests, Whisper decodes 30 second windows
+MAX_BATCH_AUDIO_SECONDS = 30
+JOBS_PATH = '/v1/jobs'
+BULK_PATH = '/v1/bulk'
+UPLOADS_PATH = '/v1/uploads'
+
+
+class PendingTranscription:
+    """
+    An admitted request waiting for an inference worker.
+    """
+
+    def __init__(self, handler, audio, options, duration, ticket, fn=None, priority=priority.REALTIME, on_progress=None):
+        self.handler = handler
+        self.audio = audio
+        self.options = options
+        self.duration = duration
+        self.ticket = ticket
+        # Runs the transcription, None for the handler's transcribe
+        self.fn = fn
+        self.priority = priority
+        # Called with the fraction of the audio transcribed, from 0 when the transcription starts
+        self.on_progress = on_progress
+        self.submitted = time.monotonic()
+
+    def report_progress(self, fraction):
+        if self.on_progress is not None:
+            self.on_progress(fraction)
+
+
+class WhisperRequestHandler(BaseHTTPRequestHandler):
+    """
+    Base request handler for the /whisperaudio, /v1/audio/transcriptions, /v1/bulk, /v1/jobs,
+    /v1/uploads and /metrics endpoints.
+
+    Subclasses implement :meth:`transcribe` and optionally :meth:`transcribe_segments`
+    and :meth:`transcribe_batch`. The worker pool and the admission controller of each
+    priority class are attached to the class by :func:`run_server`, servers with several
+    resident models also attach their ModelRegistry.
+    """
+
+    worker_pool = None
+    # AdmissionController of each priority class
+    admissions = None
+    batcher = None
+    result_cache = None
+    model_registry = None
+    # JobStore of the asynchronous job API, None if it is disabled
+    job_store = None
+    # UploadStore of the progressive uploads, None if they are disabled
+    upload_store = None
+    # Name of the model of servers without a ModelRegistry, part of the result cache key
+    model_name = None
+    # Voice activity detection: "off", "energy" (utils.vad) or "builtin" (the backend's own)
+    vad_mode = "off"
+    vad_min_silence_ms = vad.MIN_SILENCE_MS
+    # Set by backends with a built-in VAD
+    supports_builtin_vad = False
+    # Seconds of bulk audio transcribed before yielding the worker, 0 to never yield
+    preempt_chunk_seconds = priority.DEFAULT_CHUNK_SECONDS
+
+    # Per request state, the handler is instantiated for every request
+    original_duration = None
+    timestamp_map = None
+    # Seconds of non-speech removed before decoding, None if VAD is off. Backends using
+    # their built-in VAD set it while transcribing.
+    vad_skipped_seconds = None
+    # Set by subclasses that implement transcribe_batch
+    supports_batching = False
+    # Whether models can be loaded before forking and shared by the pre-forked processes.
+    # Backends whose models start native thread pools on load must load them after forking.
+    preload_before_fork = True
+
+    def transcribe(self, audio, options):
+        """
+        Transcribe decoded audio.
+
+        :param audio: 16 kHz mono float32 samples.
+        :type audio: np.ndarray
+        :param options: The other form fields of the request, e.g. "model" and "compute_type".
+        :return: The transcribed text.
+        """
+        raise NotImplementedError
+
+    def transcribe_batch(self, audios, options):
+        """
+        Transcribe several short segments from different requests in one batched pass.
+
+        Only called for segments of at most MAX_BATCH_AUDIO_SECONDS selecting the same model.
+
+        :param audios: 16 kHz mono float32 samples of each segment.
+        :type audios: list[np.ndarray]
+        :param options: The form fields of the first request, e.g. "model" and "compute_type".
+        :return: The transcribed texts, in order.
+        """
+        raise NotImplementedError
+
+    def transcribe_segments(self, audio, options):
+        """
+        Transcribe decoded audio into timestamped segments.
+
+        Backends that decode incrementally return a generator so segments can be streamed
+        to the client as they are produced. The default runs :meth:`transcribe` and
+        returns the whole audio as one segment.
+
+        :param audio: 16 kHz mono float32 samples.
+        :param options: The other form fields of the request, e.g. "model" and "language".
+        :return: Tuple of the detected language (None if unknown) and an iterable of
+            dicts with the "start", "end" and "text" of each segment.
+        """
+        text = self.transcribe(audio, options)
+        return options.get("language"), [{"start": 0.0, "end": audio_duration(audio), "text": text}]
+
+    def send_response(self, code, message=None):
+        # Remember the status for the request metrics
+        self.response_status = code
+        super().send_response(code, message)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = metrics.REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header('Content-type', metrics.CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path.startswith(JOBS_PATH + '/') and self.path.endswith('/result'):
+            self.handle_route(self.handle_job_result, JOBS_PATH + '/{id}/result')
+        elif self.path.startswith(JOBS_PATH + '/'):
+            self.handle_route(self.handle_job_status, JOBS_PATH + '/{id}')
+        elif self.path.startswith(UPLOADS_PATH + '/'):
+            self.handle_route(self.handle_upload_status, UPLOADS_PATH + '/{id}')
+        else:
+            self.send_error(404, "File not found")
+
+    def do_POST(self):
+        routes = {
+            '/whisperaudio': self.handle_whisperaudio,
+            '/v1/audio/transcriptions': self.handle_transcriptions,
+            BULK_PATH: self.handle_bulk,
+            JOBS_PATH: self.handle_job_submit,
+            UPLOADS_PATH: self.handle_upload_create,
+        }
+        route = routes.get(self.path)
+        if route is not None:
+            self.handle_route(route, self.path)
+        elif self.path.startswith(UPLOADS_PATH + '/') and self.path.endswith('/finish'):
+            self.handle_route(self.handle_upload_finish, UPLOADS_PATH + '/{id}/finish')
+        else:
+            self.send_error(404, "File not found")
+
+    def do_PATCH(self):
+        if self.path.startswith(UPLOADS_PATH + '/'):
+            self.handle_route(self.handle_upload_append, UPLOADS_PATH + '/{id}')
+        else:
+            self.send_error(404, "File not found")
+
+    def do_DELETE(self):
+        if self.path.startswith(JOBS_PATH + '/'):
+            self.handle_route(self.handle_job_delete, JOBS_PATH + '/{id}')
+        elif self.path.startswith(UPLOADS_PATH + '/'):
+            self.handle_route(self.handle_upload_delete, UPLOADS_PATH + '/{id}')
+        else:
+            self.send_error(404, "File not found")
+
+    def handle_route(self, route, endpoint):
+        """
+        Run a route handler and record the request metrics under its endpoint.
+        """
+        start = time.monotonic()
+        self.response_status = None
+        try:
+            route()
+        except ModelBusyError as e:
+            print(f"{endpoint} failed: {e}")
+            if self.response_status is None:
+                self.send_json(503, {"error": f"Server busy: {e}"}, headers={"Retry-After": str(e.retry_after)})
+        except Exception as e:
+            # A failed transcription is answered instead of dropping the connection
+            print(f"{endpoint} failed ({e.__class__.__name__}): {e}")
+            traceback.print_exc()
+            if self.response_status is None:
+                self.send_error(500, f"Transcription failed ({e.__class__.__name__}): {e}")
+        finally:
+            metrics.REQUESTS.inc(endpoint=endpoint, status=str(self.response_status or 500))
+            metrics.REQUEST_DURATION.observe(time.monotonic() - start, endpoint=endpoint)
+
+    def handle_whisperaudio(self):
+        """
+        Transcribe the audio uploaded to /whisperaudio.
+        """
+        upload = self.read_audio_upload()
+        if upload is None:
+            return
+        audio, options = upload
+
+        try:
+            # Wait for a free inference worker to process the audio
+            transcription = self.run_cached_transcription("text", audio, options)
+            if transcription is None:
+                return
+
+            # Send response
+            response = {"text": transcription}
+            if self.vad_skipped_seconds is not None:
+                response["skipped_seconds"] = round(self.vad_skipped_seconds, 3)
+            self.send_json(200, response)
+        except UnknownModelError as e:
+            self.send_error(400, str(e))
+
+    def handle_transcriptions(self):
+        """
+        OpenAI compatible transcriptions endpoint.
+
+        Supports the "json", "text" and "verbose_json" response formats. With ``stream=true``
+        segments are sent as server-sent events while the audio is being decoded.
+        """
+        upload = self.read_audio_upload('file', api_errors=True)
+        if upload is None:
+            return
+        audio, options = upload
+
+        response_format = options.get("response_format", "json")
+        if response_format not in openai_api.RESPONSE_FORMATS:
+            self.send_api_error(400, f"Unsupported response_format '{response_format}', "
+                                     f"use one of {', '.join(openai_api.RESPONSE_FORMATS)}")
+            return
+        # OpenAI clients send model names like "whisper-1", those select the default model
+        options["model"] = self.served_model(options.get("model"))
+
+        if options.get("stream", "false").lower() == "true":
+            self.stream_transcription(audio, options)
+            return
+
+        try:
+            result = self.run_cached_transcription("verbose", audio, options, self.transcribe_verbose)
+        except UnknownModelError as e:
+            self.send_api_error(400, str(e))
+            return
+        if result is None:
+            return
+
+        if response_format == "text":
+            self.send_text(200, result["text"])
+        elif response_format == "verbose_json":
+            self.send_json(200, result)
+        else:
+            self.send_json(200, {"text": result["text"]})
+
+    def handle_bulk(self):
+        """
+        Transcribe every audio file uploaded to /v1/bulk in one request.
+
+        Accepts any number of file parts and zip or tar archives of audio files, the other
+        form fields apply to every file. Responds with newline-delimited JSON: a line with
+        the "index", "filename" and "text" (or "error") of each file as soon as it is
+        transcribed, then a summary line. Files are queued one after the other in the bulk
+        class unless the request asks for another, waiting while the queue is full
+        instead of answering 429.
+        """
+        try:
+            parts = read_multipart(self.rfile, self.headers.get('content-type'), self.headers.get('content-length'))
+            files = bulk.list_files([part for part in parts if part.filename is not None])
+        except (MultipartError, bulk.BulkError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        if not files:
+            self.send_json(400, {"error": "No audio files uploaded"})
+            return
+
+        try:
+            options = {part.name: part.text() for part in parts if part.filename is None}
+        except UnicodeDecodeError as e:
+            self.send_json(400, {"error": f"Form fields must be UTF-8: {e}"})
+            return
+        if priority.FIELD not in options and self.headers.get(priority.HEADER) is None:
+            options[priority.FIELD] = priority.BULK
+        if self.model_registry is not None:
+            try:
+                self.model_registry.resolve(options.get("model"), options.get("compute_type"))
+            except UnknownModelError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+
+        results = queue.Queue()
+        cancelled = threading.Event()
+        threading.Thread(target=self.schedule_bulk, args=(files, options, results, cancelled),
+                         name="bulk", daemon=True).start()
+
+        self.send_response(200)
+        self.send_header('Content-type', bulk.CONTENT_TYPE)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        failed = 0
+        try:
+            for _ in files:
+                result = results.get()
+                failed += "error" in result
+                self.wfile.write(bulk.ndjson_line(result))
+                self.wfile.flush()
+            self.wfile.write(bulk.ndjson_line({"done": True, "files": len(files), "failed": failed}))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, files already queued still finish on their workers
+            cancelled.set()
+
+    def schedule_bulk(self, files, options, results, cancelled):
+        """
+        Queue the files of a bulk request one after the other and put the result line of
+        each on the results queue as it completes.
+
+        Files are read and decoded just before they are queued. Each one is queued on its
+        own copy of the handler, which holds its per request state such as the VAD
+        statistics.
+
+        :param files: The BulkFile objects of the request.
+        :param cancelled: Event set when the client went away, no more files are queued.
+        """
+        finished = threading.Event()
+
+        def report(index, name, result):
+            results.put(dict(result, index=index, filename=name))
+            finished.set()
+
+        for index, file in enumerate(files):
+            if cancelled.is_set():
+                return
+            try:
+                audio = decode_audio(file.read())
+                future = copy.copy(self).queue_bulk_file(audio, options, finished, cancelled)
+            except (bulk.BulkError, AudioDecodeError) as e:
+                report(index, file.name, {"error": str(e)})
+                continue
+            except Exception as e:
+                report(index, file.name, {"error": f"Transcription failed: {e}"})
+                continue
+            if future is None:
+                return
+            future.add_done_callback(lambda f, index=index, name=file.name: report(index, name, f.result()))
+
+    def queue_bulk_file(self, audio, options, finished, cancelled):
+        """
+        Queue one file of a bulk request, answering it from the result cache when possible.
+
+        While the queue is full it waits until another file finished or the Retry-After
+        delay passed, then tries again.
+
+        :param finished: Event set whenever a file of the request finishes.
+        :param cancelled: Event set when the client went away.
+        :return: A future resolved with the file's result line, or None if the request was
+            cancelled while waiting.
+        :rtype: concurrent.futures.Future
+        """
+        result = Future()
+        duration = round(audio_duration(audio), 3)
+        cache_key, cached = self.cached_result("text", audio, options)
+        if cached is not None:
+            result.set_result({"text": cached, "duration": duration})
+            return result
+
+        speech = self.apply_vad(audio)
+        while True:
+            # Cleared before trying, so a file finishing meanwhile ends the wait at once
+            finished.clear()
+            try:
+                future = self.queue_transcription(speech, options)
+                break
+            except AdmissionRejected as e:
+                finished.wait(e.retry_after)
+                if cancelled.is_set():
+                    return None
+
+        def done(f):
+            error = f.exception()
+            if error is not None:
+                result.set_result({"error": f"Transcription failed: {error}"})
+                return
+            if cache_key is not None:
+                self.result_cache.put(cache_key, f.result())
+            line = {"text": f.result(), "duration": duration}
+            if self.vad_skipped_seconds is not None:
+                line["skipped_seconds"] = round(self.vad_skipped_seconds, 3)
+            result.set_result(line)
+
+        future.add_done_callback(done)
+        return result
+
+    def handle_job_submit(self):
+        """
+        Queue the audio uploaded to /v1/jobs as an asynchronous job.
+
+        Responds 202 with the job's status and its URL in the Location header. The job is
+        answered from the result cache when possible.
+        """
+        if self.job_store is None:
+            self.send_json(404, {"error": "The job API is disabled on this server"})
+            return
+        upload = self.read_audio_upload()
+        if upload is None:
+            return
+        audio, options = upload
+
+        try:
+            cache_key, cached = self.cached_result("text", audio, options)
+        except UnknownModelError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        store = self.job_store
+        if cached is not None:
+            job_id = store.create(audio_duration(audio), jobs.DONE, {"text": cached})
+        else:
+            job_id = store.create(audio_duration(audio))
+            future = self.submit_transcription(audio, options,
+                                               on_progress=lambda fraction: store.set_progress(job_id, fraction))
+            if future is None:
+                # Rejected with a 429, the client submits again later
+                store.delete(job_id)
+                return
+            future.add_done_callback(lambda f: self.finish_job(job_id, cache_key, f))
+
+        self.send_json(202, self.job_status(store.get(job_id)), headers={"Location": f"{JOBS_PATH}/{job_id}"})
+
+    def finish_job(self, job_id, cache_key, future):
+        """
+        Store the result of a job's transcription.
+        """
+        error = future.exception()
+        if error is not None:
+            self.job_store.fail(job_id, error)
+            return
+        transcription = future.result()
+        if cache_key is not None:
+            self.result_cache.put(cache_key, transcription)
+        result = {"text": transcription}
+        if self.vad_skipped_seconds is not None:
+            result["skipped_seconds"] = round(self.vad_skipped_seconds, 3)
+        self.job_store.finish(job_id, result)
+
+    def handle_job_status(self):
+        """
+        Report the status and progress of a job.
+        """
+        job = self.find_job()
+        if job is not None:
+            self.send_json(200, self.job_status(job))
+
+    def handle_job_result(self):
+        """
+        Send the result of a finished job, 409 while it is still queued or running.
+        """
+        job = self.find_job()
+        if job is None:
+            return
+        if job["status"] == jobs.DONE:
+            self.send_json(200, job["result"])
+        elif job["status"] == jobs.FAILED:
+            self.send_json(500, {"error": job["error"]})
+        else:
+            self.send_json(409, dict(self.job_status(job), error=f"The job is {job['status']}"))
+
+    def handle_job_delete(self):
+        """
+        Remove a job and its result.
+        """
+        job = self.find_job()
+        if job is not None:
+            self.job_store.delete(job["id"])
+            self.send_json(200, {"id": job["id"], "deleted": True})
+
+    def find_job(self):
+        """
+        Look up the job named in the request path.
+
+        Sends a 404 response if there is no such job.
+
+        :return: The job, or None if an error response was sent.
+        """
+        parts = self.path[len(JOBS_PATH) + 1:].split('/')
+        job = self.job_store.get(parts[0]) if self.job_store is not None else None
+        if job is None:
+            self.send_json(404, {"error": "No such job"})
+        return job
+
+    @staticmethod
+    def job_status(job):
+        """
+        The public fields of a job, without its result.
+        """
+        status = {key: job[key] for key in ("id", "status", "created", "duration", "progress")}
+        if "error" in job:
+            status["error"] = job["error"]
+        return status
+
+    def handle_upload_create(self):
+        """
+        Start a progressive upload. The optional JSON body holds the request fields of
+        the transcription, e.g. "language".
+
+        Responds 201 with the upload's id and offset, and its URL in the Location header.
+        """
+        if self.upload_store is None:
+            self.send_json(404, {"error": "Progressive uploads are disabled on this server"})
+            return
+        length = int(self.headers.get('content-length') or 0)
+        try:
+            options = json.loads(self.rfile.read(length)) if length else {}
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            self.send_json(400, {"error": f"Invalid JSON body: {e}"})
+            return
+        if not isinstance(options, dict):
+            self.send_json(400, {"error": "The body must be a JSON object"})
+            return
+        options = {key: str(value) for key, value in options.items() if value is not None}
+        try:
+            self.served_model(options.get("model"))
+        except UnknownModelError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        upload_id = self.upload_store.create(options)
+        self.send_json(201, {"id": upload_id, "offset": 0}, headers={"Location": f"{UPLOADS_PATH}/{upload_id}"})
+
+    def handle_upload_append(self):
+        """
+        Append raw 16 kHz mono 16-bit little-endian samples at the byte offset of the
+        Upload-Offset header.
+
+        Responds with the new offset, or 409 with the server's offset if the append does
+        not continue the received audio. Complete regions of the audio are queued for
+        decoding right away while the bulk queue has room for them.
+        """
+        upload_id = self.find_upload()
+        if upload_id is None:
+            return
+        offset = self.upload_offset()
+        if offset is None:
+            return
+        length = int(self.headers.get('content-length') or 0)
+        if length > uploads.MAX_APPEND_BYTES:
+            self.send_json(413, {"error": f"Appends are limited to {uploads.MAX_APPEND_BYTES} bytes"})
+            return
+        data = self.rfile.read(length)
+        if len(data) < length:
+            self.send_json(400, {"error": "Truncated request body"})
+            return
+
+        try:
+            size = self.upload_store.append(upload_id, offset, data)
+        except uploads.OffsetMismatch as e:
+            self.send_json(409, {"error": str(e), "offset": e.offset}, headers={"Upload-Offset": str(e.offset)})
+            return
+        except uploads.UploadError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except KeyError:
+            self.send_json(404, {"error": "No such upload"})
+            return
+
+        self.send_json(200, {"id": upload_id, "offset": size}, headers={"Upload-Offset": str(size)})
+        self.queue_upload_regions(upload_id)
+
+    def handle_upload_finish(self):
+        """
+        Close a progressive upload at the offset of the Upload-Offset header and publish
+        its transcript as a job of /v1/jobs.
+
+        Only the audio after the last queued region is left to transcribe, it is queued
+        on a background thread that waits while the bulk queue is full. Responds 202 with
+        the job's status and its URL in the Location header, or 409 with the server's
+        offset if audio is missing.
+        """
+        upload_id = self.find_upload()
+        if upload_id is None:
+            return
+        offset = self.upload_offset()
+        if offset is None:
+            return
+
+        store = self.job_store
+        job_id = store.create(offset / uploads.BYTES_PER_SAMPLE / SAMPLE_RATE)
+        try:
+            finished = self.upload_store.finish(upload_id, offset, job_id)
+        except uploads.OffsetMismatch as e:
+            store.delete(job_id)
+            self.send_json(409, {"error": str(e), "offset": e.offset}, headers={"Upload-Offset": str(e.offset)})
+            return
+        except KeyError:
+            store.delete(job_id)
+            self.send_json(404, {"error": "No such upload"})
+            return
+
+        if finished != job_id:
+            # A retried finish, the first one created the job
+            store.delete(job_id)
+            job_id = finished
+        else:
+            store.set_progress(job_id, 0.0)
+            upload = self.upload_store.get(upload_id)
+            if upload is None:
+                store.fail(job_id, "The upload was deleted before it was transcribed")
+            elif upload["error"] is not None:
+                store.fail(job_id, upload["error"])
+            else:
+                threading.Thread(target=self.finish_upload, args=(upload_id,), name="upload", daemon=True).start()
+
+        job = store.get(job_id)
+        if job is None:
+            self.send_json(404, {"error": "The upload's job no longer exists"})
+            return
+        self.send_json(202, self.job_status(job), headers={"Location": f"{JOBS_PATH}/{job_id}"})
+
+    def handle_upload_status(self):
+        """
+        Report the offset of a progressive upload and the seconds of it already decoded.
+        """
+        upload_id = self.find_upload()
+        if upload_id is None:
+            return
+        upload = self.upload_store.get(upload_id)
+        if upload is None:
+            self.send_json(404, {"error": "No such upload"})
+            return
+        status = {"id": upload_id, "offset": upload["size"],
+                  "decoded_seconds": round(upload["decoded"] / SAMPLE_RATE, 3), "job_id": upload["job_id"]}
+        if upload["error"] is not None:
+            status["error"] = upload["error"]
+        self.send_json(200, status, headers={"Upload-Offset": str(upload["size"])})
+
+    def handle_upload_delete(self):
+        """
+        Abandon a progressive upload and remove its audio.
+        """
+        upload_id = self.find_upload()
+        if upload_id is None:
+            return
+        if not self.upload_store.delete(upload_id):
+            self.send_json(404, {"error": "No such upload"})
+            return
+        self.send_json(200, {"id": upload_id, "deleted": True})
+
+    def find_upload(self):
+        """
+        The id of the upload named in the request path.
+
+        Sends a 404 response if progressive uploads are disabled.
+
+        :return: The id, or None if an error response was sent.
+        """
+        if self.upload_store is None:
+            self.send_json(404, {"error": "Progressive uploads are disabled on this server"})
+            return None
+        return self.path[len(UPLOADS_PATH) + 1:].split('/')[0]
+
+    def upload_offset(self):
+        """
+        The byte offset of the Upload-Offset header.
+
+        Sends a 400 response if it is missing or invalid.
+
+        :return: The offset, or None if an error response was sent.
+        """
+        try:
+            offset = int(self.headers.get('Upload-Offset', ''))
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            self.send_json(400, {"error": "Missing or invalid Upload-Offset header"})
+            return None
+        return offset
+
+    def queue_upload_regions(self, upload_id, wait=False):
+        """
+        Queue the regions of a progressive upload for decoding, in the bulk class.
+
+        Each region is admitted like the other bulk requests. While the bulk queue is
+        full the rest of the audio stays in the upload, for a later append or the finish
+        to queue.
+
+        :param wait: Wait for room in the queue, like the files of /v1/bulk, until every
+            region is queued, instead of leaving the audio in the upload.
+        """
+        chunk_seconds = self.preempt_chunk_seconds or priority.DEFAULT_CHUNK_SECONDS
+        admission = self.admissions[priority.BULK]
+        while True:
+            try:
+                # Regions end at a pause near chunk_seconds, only the last one is shorter
+                ticket = admission.admit(chunk_seconds)
+            except AdmissionRejected as e:
+                if not wait:
+                    return
+                time.sleep(e.retry_after)
+                continue
+            try:
+                region = self.upload_store.claim_region(upload_id, chunk_seconds)
+            except KeyError:
+                # Deleted or expired meanwhile
+                region = None
+            if region is None:
+                admission.release(ticket)
+                return
+            self.decode_upload_region(upload_id, region, ticket)
+
+    def finish_upload(self, upload_id):
+        """
+        Queue the rest of a finished progressive upload, then publish its transcript if
+        every region was already decoded.
+        """
+        self.queue_upload_regions(upload_id, wait=True)
+        self.publish_upload(upload_id)
+
+    def decode_upload_region(self, upload_id, region, ticket):
+        """
+        Queue the transcription of a region of a progressive upload.
+
+        The transcript is published once the upload is finished and its last region
+        decoded.
+
+        :param region: Tuple of the region's index, start and end in samples.
+        :param ticket: The region's AdmissionTicket of the bulk class, released once it is decoded.
+        """
+        index, start, end = region
+        store = self.upload_store
+        submitted = time.monotonic()
+        # Seconds of audio decoded and the time it took, for the throughput estimate
+        timing = {}
+
+        def run():
+            ticket.start()
+            metrics.QUEUE_WAIT.observe(time.monotonic() - submitted, priority=priority.BULK)
+            upload = store.get(upload_id)
+            if upload is None:
+                # Deleted or expired while the region was queued, there is nothing to publish
+                return None
+            options = upload["options"]
+            audio = store.read_samples(upload_id, start, end)
+            if self.vad_mode == "energy":
+                audio, _ = vad.filter_speech(audio, min_silence_ms=self.vad_min_silence_ms)
+            duration = audio_duration(audio)
+            if duration == 0:
+                return ""
+            started = time.monotonic()
+            try:
+                return self.transcribe(audio, options)
+            finally:
+                service = time.monotonic() - started
+                timing.update(duration=duration, service=service)
+                metrics.INFERENCE_DURATION.observe(service)
+                metrics.AUDIO_DURATION.observe(duration)
+                metrics.REAL_TIME_FACTOR.observe(service / duration)
+
+        def done(future):
+            service = timing.get("service")
+            if service:
+                # The ticket was admitted with the chunk length, scale the time to it so
+                # the measured real-time factor stays right
+                service *= ticket.audio_seconds / timing["duration"]
+            ticket.controller.release(ticket, service)
+            error = future.exception()
+            if error is not None:
+                job_id = store.fail(upload_id, error)
+                if job_id is not None:
+                    self.job_store.fail(job_id, error)
+                return
+            if future.result() is None:
+                return
+            try:
+                transcript = store.complete_region(upload_id, index, future.result())
+            except KeyError:
+                # Deleted or expired while the region was decoded, there is nothing to publish
+                return
+            if transcript is not None:
+                job_id, text = transcript
+                self.job_store.finish(job_id, {"text": text})
+
+        self.worker_pool.submit(run, priority=priority.rank(priority.BULK)).add_done_callback(done)
+
+    def publish_upload(self, upload_id):
+        """
+        Finish the job of a progressive upload whose regions are all decoded.
+        """
+        try:
+            transcript = self.upload_store.transcript(upload_id)
+        except KeyError:
+            # Deleted or expired meanwhile
+            return
+        if transcript is not None:
+            job_id, text = transcript
+            self.job_store.finish(job_id, {"text": text})
+
+    def stream_transcription(self, audio, options):
+        """
+        Send the segments of a transcription as server-sent events as they are decoded.
+        """
+        events = queue.Queue()
+        try:
+            cache_key, cached = self.cached_result("verbose", audio, options)
+        except UnknownModelError as e:
+            self.send_api_error(400, str(e))
+            return
+
+        if cached is not None:
+            future = Future()
+            for segment in cached["segments"]:
+                events.put(segment)
+            future.set_result(cached)
+        else:
+            future = self.submit_transcription(
+                audio, options, lambda audio, options: self.transcribe_verbose(audio, options, on_segment=events.put))
+            if future is None:
+                return
+            if cache_key is not None:
+                future.add_done_callback(lambda f: f.exception() is None and self.result_cache.put(cache_key, f.result()))
+        # Marks the end of the stream once the last segment has been queued
+        future.add_done_callback(lambda _: events.put(None))
+
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        try:
+            while True:
+                segment = events.get()
+                if segment is None:
+                    break
+                self.wfile.write(openai_api.sse_event(openai_api.delta_event(segment)))
+                self.wfile.flush()
+
+            error = future.exception()
+            if error is None:
+                self.wfile.write(openai_api.sse_event(openai_api.done_event(future.result())))
+            else:
+                self.wfile.write(openai_api.sse_event(openai_api.error_event(str(error))))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, the transcription still finishes on its worker
+            pass
+
+    def transcribe_verbose(self, audio, options, on_segment=None):
+        """
+        Transcribe into the OpenAI verbose_json structure.
+
+        :param on_segment: Optional callable called with each segment as it is decoded.
+        :return: Dict with the task, language, duration, text and segments.
+        """
+        language, segments = self.transcribe_segments(audio, options) if len(audio) else (options.get("language"), [])
+        collected = []
+        for segment in segments:
+            if self.timestamp_map is not None:
+                # Timestamps of the speech-only audio, move them back onto the upload
+                segment = dict(segment,
+                               start=self.timestamp_map.to_original(segment["start"]),
+                               end=self.timestamp_map.to_original(segment["end"], is_end=True))
+            segment = openai_api.format_segment(len(collected), segment)
+            collected.append(segment)
+            if on_segment is not None:
+                on_segment(segment)
+
+        result = openai_api.verbose_result(language, self.original_duration or audio_duration(audio), collected)
+        if self.vad_skipped_seconds is not None:
+            result["skipped_seconds"] = round(self.vad_skipped_seconds, 3)
+        return result
+
+    def served_model(self, name):
+        """
+        Returns the model name if the server is configured with it, None for the default model.
+        """
+        if not name or self.model_registry is None:
+            return None
+        try:
+            self.model_registry.resolve(name)
+        except UnknownModelError:
+            return None
+        return name
+
+    def cached_result(self, kind, audio, options):
+        """
+        Look up a transcription in the result cache.
+
+        :param kind: The kind of result, "text" or "verbose".
+        :return: Tuple of the cache key (None if caching is disabled) and the cached
+            result (None on a miss).
+        :raises UnknownModelError: If the request selects a model the server does not have.
+        """
+        if self.result_cache is None:
+            return None, None
+        if self.model_registry is not None:
+            model = self.model_registry.resolve(options.get("model"), options.get("compute_type")).key
+        else:
+            model = f"{type(self).__module__}:{self.model_name}"
+        key = self.result_cache.make_key(audio, kind, model, options, self.vad_mode)
+        return key, self.result_cache.get(key)
+
+    def run_cached_transcription(self, kind, audio, options, fn=None):
+        """
+        Like :meth:`run_transcription`, but answers repeated requests from the result cache.
+
+        :param kind: The kind of result fn returns, "text" or "verbose".
+        """
+        key, result = self.cached_result(kind, audio, options)
+        if result is not None:
+            return result
+
+        result = self.run_transcription(audio, options, fn)
+        if result is not None and key is not None:
+            self.result_cache.put(key, result)
+        return result
+
+    def run_transcription(self, audio, options, fn=None):
+        """
+        Queue a transcription on the worker pool and wait for it.
+
+        Sends a 429 response with a Retry-After header if the queue is full.
+
+        :param audio: 16 kHz mono float32 samples.
+        :param options: The other form fields of the request.
+        :param fn: Callable taking the audio and options that runs the transcription,
+            None for :meth:`transcribe`.
+        :return: The result of the transcription, or None if the request was rejected.
+        """
+        future = self.submit_transcription(audio, options, fn)
+        return None if future is None else future.result()
+
+    def submit_transcription(self, audio, options, fn=None, on_progress=None):
+        """
+        Queue a transcription on the worker pool if the server has capacity for it.
+
+        Sends a 429 response with a Retry-After header if the queue is full.
+
+        :param on_progress: Optional callable called with the fraction of the audio
+            transcribed, from 0 when the transcription starts.
+
+        :return: A future resolved with the result of the transcription, or None if the
+            request was rejected.
+        :rtype: concurrent.futures.Future
+        """
+        audio = self.apply_vad(audio)
+        try:
+            return self.queue_transcription(audio, options, fn, on_progress)
+        except AdmissionRejected as e:
+            self.send_json(429, {"error": f"Server busy: {e}"}, headers={"Retry-After": str(e.retry_after)})
+            return None
+
+    def queue_transcription(self, audio, options, fn=None, on_progress=None):
+        """
+        Queue a transcription of audio that went through :meth:`apply_vad`.
+
+        :return: A future resolved with the result of the transcription.
+        :rtype: concurrent.futures.Future
+        :raises AdmissionRejected: If the queue of the request's priority class is full.
+        """
+        duration = audio_duration(audio)
+        if duration == 0:
+            # Nothing but silence, there is nothing to decode
+            future = Future()
+            future.set_result("" if fn is None else fn(audio, options))
+            self.record_vad()
+            return future
+
+        request_priority = self.request_priority(options, self.original_duration)
+        ticket = self.admissions[request_priority].admit(duration)
+
+        request = PendingTranscription(self, audio, options, duration, ticket, fn, request_priority, on_progress)
+        # The batched pass bypasses the backend's built-in VAD
+        batchable = self.supports_batching and self.vad_mode != "builtin" and duration <= MAX_BATCH_AUDIO_SECONDS
+        if fn is None and self.batcher is not None and batchable:
+            # Short segments wait briefly to be decoded together with concurrent requests
+            key = (options.get("model"), options.get("compute_type"), request_priority)
+            return self.batcher.submit(key, request)
+        if (fn is None and request_priority != priority.REALTIME and self.preempt_chunk_seconds
+                and duration > self.preempt_chunk_seconds + priority.CUT_SEARCH_SECONDS):
+            return self.transcribe_chunked(request)
+        return self.worker_pool.submit(self.transcribe_request, request, priority=priority.rank(request_priority))
+
+    def request_priority(self, options, duration):
+        """
+        The priority class of the request, from its "priority" field or X-Priority
+        header, or else from the duration of its audio.
+        """
+        requested = options.get(priority.FIELD)
+        if requested is None and self.headers is not None:
+            requested = self.headers.get(priority.HEADER)
+        return priority.request_priority(requested, duration)
+
+    def apply_vad(self, audio):
+        """
+        Remove the non-speech regions of the audio if the energy VAD is enabled.
+
+        The timestamp map and the skipped seconds are kept on the handler.
+
+        :return: The audio to decode.
+        """
+        self.original_duration = audio_duration(audio)
+        if self.vad_mode != "energy":
+            return audio
+        speech, self.timestamp_map = vad.filter_speech(audio, min_silence_ms=self.vad_min_silence_ms)
+        self.vad_skipped_seconds = self.original_duration - audio_duration(speech)
+        return speech
+
+    def record_vad(self):
+        """
+        Report the seconds of non-speech the VAD skipped for this request.
+        """
+        if self.vad_skipped_seconds is None:
+            return
+        metrics.VAD_SKIPPED.observe(self.vad_skipped_seconds)
+        print(f"VAD skipped {self.vad_skipped_seconds:.1f}s of {self.original_duration:.1f}s of audio")
+
+    def transcribe_request(self, request):
+        """
+        Transcribe a single queued request on an inference worker.
+        """
+        return self.transcribe_requests([request])[0]
+
+    def transcribe_requests(self, requests):
+        """
+        Transcribe queued requests on an inference worker, as one batch if there are several.
+
+        :param requests: The PendingTranscription objects to transcribe.
+        :return: The transcribed texts, in order.
+        """
+        start = time.monotonic()
+        for request in requests:
+            request.ticket.start()
+            metrics.QUEUE_WAIT.observe(start - request.submitted, priority=request.priority)
+            request.report_progress(0.0)
+
+        try:
+            if len(requests) == 1:
+                request = requests[0]
+                fn = request.fn or self.transcribe
+                return [fn(request.audio, request.options)]
+            return self.transcribe_batch([request.audio for request in requests], requests[0].options)
+        finally:
+            service = time.monotonic() - start
+            total_duration = sum(request.duration for request in requests)
+            metrics.INFERENCE_DURATION.observe(service)
+            metrics.BATCH_SIZE.observe(len(requests))
+            for request in requests:
+                metrics.AUDIO_DURATION.observe(request.duration)
+                if request.duration > 0:
+                    metrics.REAL_TIME_FACTOR.observe(service / request.duration)
+                # Share the batch time by audio duration so the throughput estimate stays right
+                share = request.duration / total_duration if total_duration > 0 else 1 / len(requests)
+                request.ticket.controller.release(request.ticket, service * share)
+                request.handler.record_vad()
+
+    def transcribe_chunked(self, request):
+        """
+        Transcribe a long bulk request one chunk at a time.
+
+        Each chunk is queued after the previous one finished, so requests of a higher
+        priority class that arrived meanwhile run in between.
+
+        :return: A future resolved with the transcribed text.
+        :rtype: concurrent.futures.Future
+        """
+        chunks = priority.split_at_pauses(request.audio, self.preempt_chunk_seconds)
+        rank = priority.rank(request.priority)
+        result = Future()
+        texts = []
+        progress = {"service": 0.0, "skipped": 0.0}
+
+        def finish(error=None):
+            service = progress["service"]
+            metrics.INFERENCE_DURATION.observe(service)
+            metrics.AUDIO_DURATION.observe(request.duration)
+            if request.duration > 0 and error is None:
+                metrics.REAL_TIME_FACTOR.observe(service / request.duration)
+            request.ticket.controller.release(request.ticket, service if error is None else None)
+            if self.vad_mode == "builtin":
+                self.vad_skipped_seconds = progress["skipped"]
+            self.record_vad()
+            if error is None:
+                result.set_result(" ".join(text.strip() for text in texts if text.strip()))
+            else:
+                result.set_exception(error)
+
+        def run_chunk(index):
+            start = time.monotonic()
+            if index == 0:
+                request.ticket.start()
+                metrics.QUEUE_WAIT.observe(start - request.submitted, priority=request.priority)
+                request.report_progress(0.0)
+            try:
+                texts.append(self.transcribe(chunks[index], request.options))
+            except BaseException as e:
+                progress["service"] += time.monotonic() - start
+                finish(e)
+                return
+            progress["service"] += time.monotonic() - start
+            if self.vad_mode == "builtin" and self.vad_skipped_seconds is not None:
+                progress["skipped"] += self.vad_skipped_seconds
+
+            if index + 1 < len(chunks):
+                request.report_progress((index + 1) / len(chunks))
+                # Back into the queue, behind any waiting request of a higher priority class
+                self.worker_pool.submit(run_chunk, index + 1, priority=rank)
+            else:
+                finish()
+
+        self.worker_pool.submit(run_chunk, 0, priority=rank)
+        return result
+
+    def read_audio_upload(self, field_name='audio', api_errors=False):
+        """
+        Parse a multipart upload and decode its audio field in memory.
+
+        Sends a 400 response if the upload is invalid.
+
+        :param field_name: Name of the form field holding the audio file.
+        :param api_errors: Send errors as OpenAI style JSON instead of HTML.
+        :return: Tuple of the decoded audio and a dict of the other form fields, or None
+            if an error response was sent.
+        """
+        send_error = self.send_api_error if api_errors else self.send_error
+        try:
+            parts = read_multipart(self.rfile, self.headers.get('content-type'), self.headers.get('content-length'))
+        except MultipartError as e:
+            send_error(400, str(e))
+            return None
+
+        audio_part = next((part for part in parts if part.name == field_name), None)
+        if audio_part is None:
+            send_error(400, f"Missing '{field_name}' field")
+            return None
+
+        try:
+            options = {part.name: part.text() for part in parts if part.filename is None and part.name != field_name}
+        except UnicodeDecodeError as e:
+            send_error(400, f"Form fields must be UTF-8: {e}")
+            return None
+
+        try:
+            audio = decode_audio(audio_part.data)
+        except AudioDecodeError as e:
+            send_error(400, str(e))
+            return None
+
+        return audio, options
+
+    def send_json(self, status, data, headers=None):
+        """
+        Send a JSON response.
+
+        :param status: HTTP status code.
+        :param data: JSON serializable response body.
+        :param headers: Optional extra response headers.
+        """
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text):
+        """
+        Send a plain text response.
+        """
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_api_error(self, status, message):
+        """
+        Send an error in the OpenAI API format.
+        """
+        self.send_json(status, openai_api.error_body(message))
+
+
+def build_arg_parser(description, device="cpu"):
+    """
+    Command line options shared by the Whisper servers.
+
+    :param description: Description shown in --help.
+    :param device: Default device of the server, used to size the worker pool.
+    :return: The argument parser.
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--port', type=int, default=int(os.environ.get('WHISPER_PORT', 8000)),
+                        help="Port to listen on.")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WHISPER_WORKERS', default_worker_count(device))),
+                        help="Number of transcriptions that run concurrently in each process. Other requests are queued.")
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('WHISPER_PROCESSES', 1)),
+                        help="Number of pre-forked processes sharing the listening socket, for CPU-only hosts (POSIX only).")
+    parser.add_argument('--max-queue-depth', type=int, default=int(os.environ.get('WHISPER_MAX_QUEUE_DEPTH', 16)),
+                        help="Maximum number of requests waiting for a worker before answering 429, 0 for no limit.")
+    parser.add_argument('--max-queued-audio-seconds', type=float, default=float(os.environ.get('WHISPER_MAX_QUEUED_AUDIO_SECONDS', 1800)),
+                        help="Maximum seconds of audio waiting for a worker before answering 429, 0 for no limit.")
+    parser.add_argument('--batch-size', type=int, default=int(os.environ.get('WHISPER_BATCH_SIZE', 1)),
+                        help="Maximum number of short segments from concurrent requests decoded in one batch, 1 to disable batching.")
+    parser.add_argument('--batch-window-ms', type=float, default=float(os.environ.get('WHISPER_BATCH_WINDOW_MS', 20)),
+                        help="Milliseconds a segment waits for other segments to batch with.")
+    parser.add_argument('--vad', choices=("off", "energy", "builtin"), default=os.environ.get('WHISPER_VAD', "off"),
+                        help="Remove non-speech before decoding: 'energy' uses a fast energy detector, "
+                             "'builtin' the backend's own VAD (faster-whisper only).")
+    parser.add_argument('--preempt-chunk-seconds', type=chunk_seconds,
+                        default=float(os.environ.get('WHISPER_PREEMPT_CHUNK_SECONDS', priority.DEFAULT_CHUNK_SECONDS)),
+                        help=f"Seconds of bulk audio transcribed before queued realtime requests may run, at least "
+                             f"{priority.MIN_CHUNK_SECONDS}, 0 to transcribe bulk files in one go.")
+    parser.add_argument('--vad-min-silence-ms', type=int, default=int(os.environ.get('WHISPER_VAD_MIN_SILENCE_MS', vad.MIN_SILENCE_MS)),
+                        help="Shortest silence the energy VAD removes.")
+    parser.add_argument('--unix-socket', default=os.environ.get('WHISPER_UNIX_SOCKET'),
+                        help="Also accept binary framed PCM requests on this Unix domain socket, for clients "
+                             "on the same host (POSIX only).")
+    parser.add_argument('--verbose', action='store_true', default=os.environ.get('WHISPER_VERBOSE', '') not in ('', '0'),
+                        help="Log the queue wait and service time of every transcription.")
+    add_result_cache_args(parser)
+    jobs.add_job_store_args(parser)
+    uploads.add_upload_args(parser)
+    return parser
+
+
+def chunk_seconds(text):
+    """
+    Parse the --preempt-chunk-seconds option: 0, or at least MIN_CHUNK_SECONDS.
+    """
+    value = float(text)
+    if value != 0 and not value >= priority.MIN_CHUNK_SECONDS:
+        raise argparse.ArgumentTypeError(f"must be 0 or at least {priority.MIN_CHUNK_SECONDS} seconds, not {text}")
+    return value
+
+
+def register_queue_metrics(worker_pool, admissions):
+    """
+    Expose the current state of the worker pool and the admission queue of each
+    priority class on /metrics.
+    """
+    def by_priority(stat):
+        return lambda: {(name,): admission.stats()[stat] for name, admission in admissions.items()}
+
+    metrics.REGISTRY.register(metrics.Gauge(
+        "whisper_workers", "Number of inference workers.", lambda: worker_pool.num_workers))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "whisper_active_requests", "Transcriptions running on an inference worker.", lambda: worker_pool.stats()["active"]))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "whisper_queue_depth", "Transcriptions waiting for an inference worker, by priority class.",
+        by_priority("queued"), ("priority",)))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "whisper_queued_audio_seconds", "Seconds of audio waiting for an inference worker, by priority class.",
+        by_priority("queued_audio_seconds"), ("priority",)))
+    metrics.REGISTRY.register(metrics.Gauge(
+        "whisper_rejected_requests", "Requests answered 429 because their queue was full, by priority class.",
+        by_priority("rejected"), ("priority",)))
+
+
+def server_options(args):
+    """
+    Keyword arguments of :func:`run_server` from the options of :func:`build_arg_parser`.
+    """
+    return {
+        "port": args.port,
+        "workers": args.workers,
+        "processes": args.processes,
+        "max_queue_depth": args.max_queue_depth,
+        "max_queued_audio_seconds": args.max_queued_audio_seconds,
+        "batch_size": args.batch_size,
+        "batch_window_ms": args.batch_window_ms,
+        "cache_size_mb": args.cache_size_mb,
+        "cache_dir": args.cache_dir,
+        "cache_disk_size_mb": args.cache_disk_size_mb,
+        "vad": args.vad,
+        "vad_min_silence_ms": args.vad_min_silence_ms,
+        "preempt_chunk_seconds": args.preempt_chunk_seconds,
+        "unix_socket": args.unix_socket,
+        "jobs_db": args.jobs_db,
+        "job_ttl_hours": args.job_ttl_hours,
+        "uploads_dir": args.uploads_dir,
+        "verbose": args.verbose,
+    }
+
+
+def run_server(handler_class, port=8000, workers=1, processes=1, model_registry=None, max_queue_depth=None,
+               max_queued_audio_seconds=None, batch_size=1, batch_window_ms=20, cache_size_mb=0, cache_dir=None,
+               cache_disk_size_mb=0, vad="off", vad_min_silence_ms=None, preempt_chunk_seconds=None, unix_socket=None,
+               jobs_db=None, job_ttl_hours=jobs.DEFAULT_TTL_HOURS, uploads_dir=None, after_fork=None, verbose=False,
+               server_class=ThreadingHTTPServer):
+    """
+    Start a Whisper server and serve requests until interrupted.
+
+    :param handler_class: The WhisperRequestHandler subclass of the server.
+    :param port: Port to listen on.
+    :param workers: Number of inference workers of each process.
+    :param processes: Number of pre-forked processes sharing the listening socket, 1 to
+        serve from this process.
+    :param model_registry: Optional ModelRegistry, its models are loaded before the server starts.
+        In pre-fork mode they are loaded before forking if the handler's
+        ``preload_before_fork`` allows it, otherwise in each process.
+    :param max_queue_depth: Maximum number of queued requests of each priority class, None for no limit.
+    :param max_queued_audio_seconds: Maximum seconds of queued audio of each priority class, None for no limit.
+    :param batch_size: Maximum number of concurrent short segments decoded together, 1 to disable.
+        Only used if the handler supports batching.
+    :param batch_window_ms: Milliseconds a segment waits for others to batch with.
+    :param cache_size_mb: Size of the in-memory result cache of each process, 0 to disable it.
+    :param cache_dir: Directory of the on-disk result cache shared by all processes, None to disable it.
+    :param cache_disk_size_mb: Size of the on-disk result cache.
+    :param vad: Voice activity detection before decoding, "off", "energy" or "builtin".
+    :param vad_min_silence_ms: Shortest silence the energy VAD removes, None for the default.
+    :param preempt_chunk_seconds: Seconds of bulk audio transcribed before queued realtime
+        requests may run, 0 to never split bulk requests, None for the default. Must be 0 or
+        at least MIN_CHUNK_SECONDS.
+    :param unix_socket: Optional path of a Unix domain socket also served with the binary
+        framing of :mod:`utils.uds_server`.
+    :param jobs_db: Path of the SQLite database of the asynchronous job API, None to disable it.
+    :param job_ttl_hours: Hours finished jobs are kept.
+    :param uploads_dir: Directory of the audio of progressive uploads, None to disable them.
+        They require the job API.
+    :param after_fork: Optional callable taking the process index, called in each pre-forked
+        process before it loads models or starts serving.
+    :param verbose: Log the queue wait and service time of every transcription.
+    :param server_class: HTTP server class, threaded by default so uploads and queued
+        requests do not block each other.
+    """
+    if processes > 1 and not prefork.can_fork():
+        raise SystemExit("--processes requires a system with fork(), use --workers instead")
+    if vad == "builtin" and not handler_class.supports_builtin_vad:
+        raise SystemExit("This server has no built-in VAD, use --vad energy instead")
+    if unix_socket and not uds_server.can_use_unix_sockets():
+        raise SystemExit("--unix-socket requires a system with Unix domain sockets")
+    if preempt_chunk_seconds is not None and preempt_chunk_seconds != 0 and not preempt_chunk_seconds >= priority.MIN_CHUNK_SECONDS:
+        raise SystemExit(f"--preempt-chunk-seconds must be 0 or at least {priority.MIN_CHUNK_SECONDS} seconds")
+
+    handler_class.vad_mode = vad
+    if vad_min_silence_ms is not None:
+        handler_class.vad_min_silence_ms = vad_min_silence_ms
+    if preempt_chunk_seconds is not None:
+        handler_class.preempt_chunk_seconds = preempt_chunk_seconds
+    if jobs_db:
+        handler_class.job_store = jobs.JobStore(jobs_db, job_ttl_hours * 3600)
+        interrupted = handler_class.job_store.fail_unfinished("The server restarted before the job finished")
+        if interrupted:
+            print(f"Failed {interrupted} job(s) interrupted by the last shutdown")
+        if uploads_dir:
+            handler_class.upload_store = uploads.UploadStore(jobs_db, uploads_dir, job_ttl_hours * 3600)
+            # Their jobs, if finished, were failed with the other jobs above
+            interrupted = handler_class.upload_store.fail_unfinished("The server restarted before the upload was decoded")
+            if interrupted:
+                print(f"Failed {len(interrupted)} upload(s) interrupted by the last shutdown")
+
+    if model_registry is not None:
+        handler_class.model_registry = model_registry
+        if processes == 1 or handler_class.preload_before_fork:
+            model_registry.preload()
+
+    server_address = ('', port)
+    httpd = server_class(server_address, handler_class)
+    unix_server = uds_server.UnixSocketServer(unix_socket, handler_class) if unix_socket else None
+    if unix_server is not None:
+        print(f'Accepting framed PCM requests on {unix_socket}')
+
+    def fail_jobs_of_process(pid, index):
+        # The jobs of a crashed process would stay running until they expire
+        if handler_class.job_store is None:
+            return
+        failed = handler_class.job_store.fail_unfinished(f"Worker process {index} stopped before the job finished", pid=pid)
+        if failed:
+            print(f"Failed {failed} job(s) of worker process {pid}")
+        if handler_class.upload_store is None:
+            return
+        # Regions it was decoding would never get their text, and their upload's job,
+        # possibly of another process, would never finish
+        error = f"Worker process {index} stopped before the upload was decoded"
+        failed = handler_class.upload_store.fail_unfinished(error, pid=pid)
+        for job_id in failed:
+            if job_id is not None:
+                handler_class.job_store.fail(job_id, error)
+        if failed:
+            print(f"Failed {len(failed)} upload(s) of worker process {pid}")
+
+    def serve(index=None):
+        if index is not None and after_fork is not None:
+            after_fork(index)
+        if model_registry is not None:
+            # Loads the models of processes that could not share them, no-op otherwise
+            model_registry.preload()
+        handler_class.result_cache = result_cache_from_options(cache_size_mb, cache_dir, cache_disk_size_mb)
+        serve_requests(httpd, handler_class, workers, max_queue_depth, max_queued_audio_seconds,
+                       batch_size, batch_window_ms, unix_server, verbose)
+
+    try:
+        if processes > 1:
+            prefork.share_listening_socket(httpd)
+            if unix_server is not None:
+                prefork.share_listening_socket(unix_server)
+            print(f'Server running at http://localhost:{port}/ with {processes} processes of {workers} inference worker(s)')
+            try:
+                prefork.serve_prefork(processes, serve, on_exit=fail_jobs_of_process)
+            finally:
+                httpd.server_close()
+        else:
+            print(f'Server running at http://localhost:{port}/ with {workers} inference worker(s)')
+            serve()
+    finally:
+        if unix_server is not None:
+            unix_server.server_close()
+            unix_server.remove()
+
+
+def serve_requests(httpd, handler_class, workers, max_queue_depth, max_queued_audio_seconds, batch_size, batch_window_ms,
+                   unix_server=None, verbose=False):
+    """
+    Start the inference workers of this process and serve requests until interrupted.
+
+    The optional Unix socket server is served on a background thread.
+    """
+    handler_class.worker_pool = InferenceWorkerPool(workers, verbose=verbose)
+    # Realtime segments are admitted and rejected independently of the bulk backlog
+    handler_class.admissions = {name: AdmissionController(workers, max_queue_depth, max_queued_audio_seconds)
+                                for name in priority.PRIORITIES}
+    register_queue_metrics(handler_class.worker_pool, handler_class.admissions)
+
+    if handler_class.supports_batching and batch_size > 1:
+        pool = handler_class.worker_pool
+        handler_class.batcher = DynamicBatcher(
+            lambda key, requests: pool.submit(requests[0].handler.transcribe_requests, requests,
+                                              priority=priority.rank(requests[0].priority)),
+            max_batch_size=batch_size, max_wait=batch_window_ms / 1000)
+        print(f'Batching up to {batch_size} segments within {batch_window_ms:g} ms')
+
+    if unix_server is not None:
+        threading.Thread(target=unix_server.serve_forever, name="unix-socket", daemon=True).start()
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if unix_server is not None:
+            unix_server.shutdown()
+        if handler_class.batcher is not None:
+            handler_class.batcher.shutdown()
+        handler_class.worker_pool.shutdown()
@@ -0,0 +1,157 @@
+# Copyright (c) 2023 Braedon Hendy
+# This software is released under the GNU General Public License v3.0
+
+"""
+Bounded pool of inference workers shared by the Whisper servers.
+
+The HTTP server accepts and parses requests on as many threads as there are clients,
+but only a fixed number of transcriptions run at once. Everything else waits in the
+pool's queue, ordered by priority, and the time spent waiting is recorded per request.
+"""
+
+import itertools
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Threads each CPU inference worker is expected to keep busy
+CPU_THREADS_PER_WORKER = 4
+
+
+def default_worker_count(device="cpu"):
+    """
+    Number of inference workers that fits the hardware.
+
+    On GPU the model already saturates the device so requests are decoded one at a
+    time. On CPU one worker is started per group of CPU_THREADS_PER_WORKER cores.
+
+    :param device: The device the model runs on, "cpu" or "cuda".
+    :return: The number of workers to start.
+    """
+    if device == "cuda":
+        return 1
+    return max(1, (os.cpu_count() or 1) // CPU_THREADS_PER_WORKER)
+
+
+class _Task:
+    def __init__(self, fn, args, kwargs):
+        self.future = Future()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+
+
+class InferenceWorkerPool:
+    """
+    Fixed size pool of worker threads running inference jobs by priority, in FIFO
+    order within a priority.
+
+    :param num_workers: Number of jobs allowed to run concurrently.
+    :param name: Name used for the worker threads and log lines.
+    :param verbose: Log the queue wait and service time of every job.
+    """
+
+    def __init__(self, num_workers, name="inference", verbose=False):
+        self.num_workers = num_workers
+        self.name = name
+        self.verbose = verbose
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_queue_wait = 0.0
+        self._total_service_time = 0.0
+        self._threads = []
+
+        for i in range(num_workers):
+            thread = threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, *args, priority=0, **kwargs):
+        """
+        Queue a job for the workers.
+
+        :param priority: Jobs with a lower priority value run first.
+        :return: A future resolved with the return value of fn.
+        :rtype: concurrent.futures.Future
+        """
+        task = _Task(fn, args, kwargs)
+        with self._lock:
+            self._queued += 1
+        self._queue.put((priority, next(self._sequence), task))
+        return task.future
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Queue a job and block until it has been executed.
+
+        :return: The return value of fn. Exceptions raised by fn are re-raised.
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stats(self):
+        """
+        Returns a snapshot of the pool's queueing statistics.
+        """
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                "workers": self.num_workers,
+                "queued": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_queue_wait": self._total_queue_wait / finished if finished else 0.0,
+                "avg_service_time": self._total_service_time / finished if finished else 0.0,
+            }
+
+    def shutdown(self):
+        """
+        Stop the workers once the jobs already queued have run.
+        """
+        for _ in self._threads:
+            self._queue.put((math.inf, next(self._sequence), None))
+        for thread in self._threads:
+            thread.join()
+
+    def _worker(self):
+        while True:
+            _, _, task = self._queue.get()
+            if task is None:
+                break
+
+            started_at = time.monotonic()
+            queue_wait = started_at - task.enqueued_at
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+
+            failed = False
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.fn(*task.args, **task.kwargs))
+                except BaseException as e:
+                    failed = True
+                    task.future.set_exception(e)
+
+            service_time = time.monotonic() - started_at
+            with self._lock:
+                self._active -= 1
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+                self._total_queue_wait += queue_wait
+                self._total_service_time += service_time
+                queued, active = self._queued, self._active
+
+            if self.verbose:
+                print(f"[{threading.current_thread().name}] queue_wait={queue_wait:.3f}s service={service_time:.3f}s queued={queued} active={active}")